@@ -0,0 +1,127 @@
+"""
+Чтение с реплики базы данных
+
+DATABASE_REPLICA_URL добавляет в DATABASES алиас DB_REPLICA_ALIAS ("replica") -
+потоковую реплику PostgreSQL или (для локальной проверки) копию файла SQLite.
+Запись и миграции всегда идут в default. На реплику читают только view,
+помеченные @read_replica (база знаний, дашборд, поиск): они допускают отставание
+на доли секунды, остальной код читает с primary как раньше.
+
+Read-your-writes: после запроса с записью (POST, PUT, PATCH, DELETE)
+ReplicaStickinessMiddleware ставит cookie DB_REPLICA_STICKY_COOKIE на
+DB_REPLICA_STICKY_SECONDS. Пока она не истекла, помеченные view этого
+пользователя читают с primary и видят его изменения, даже если реплика отстаёт.
+Недоступная реплика не ломает страницы: view читает с primary.
+"""
+import contextvars
+import functools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+# Алиас для чтения в текущем запросе; None - решает Django (default)
+_read_alias = contextvars.ContextVar("db_read_alias", default=None)
+
+
+def replica_alias() -> Optional[str]:
+    """Алиас реплики или None, если DATABASE_REPLICA_URL не задан"""
+    alias = getattr(settings, "DB_REPLICA_ALIAS", "replica")
+    return alias if alias in settings.DATABASES else None
+
+
+def _cookie_name() -> str:
+    return getattr(settings, "DB_REPLICA_STICKY_COOKIE", "db_primary_until")
+
+
+def is_sticky(request) -> bool:
+    """Пользователь недавно писал - читать нужно с primary"""
+    try:
+        until = float(request.COOKIES.get(_cookie_name(), 0))
+    except ValueError:
+        return False
+    return until > time.time()
+
+
+def _replica_available(alias: str) -> bool:
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError as e:
+        logger.warning(f"Replica {alias} unavailable, reading from primary: {e}")
+        return False
+    return True
+
+
+@contextmanager
+def use_replica():
+    """Чтения ORM внутри блока идут на реплику (если она настроена и доступна)"""
+    alias = replica_alias()
+    token = _read_alias.set(alias if alias and _replica_available(alias) else None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def read_replica(view):
+    """Декоратор view, которые можно обслуживать с реплики"""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if replica_alias() is None or is_sticky(request):
+            return view(request, *args, **kwargs)
+        with use_replica():
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """DATABASE_ROUTERS: чтение - по use_replica, запись и миграции - только default"""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика - та же база: объекты, прочитанные с неё, связываются с объектами primary
+        aliases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схему реплика получает от primary (репликация или копия файла)
+        if db == replica_alias():
+            return False
+        return None
+
+
+class ReplicaStickinessMiddleware:
+    """После запроса с записью ставит cookie, закрепляющую чтение за primary"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and replica_alias() is not None:
+            seconds = getattr(settings, "DB_REPLICA_STICKY_SECONDS", 10)
+            response.set_cookie(
+                _cookie_name(),
+                f"{time.time() + seconds:.3f}",
+                max_age=seconds,
+                httponly=True,
+                samesite="Lax",
+                secure=request.is_secure(),
+            )
+        return response
@@ -0,0 +1,159 @@
+"""
+Management command: конкурентная запись в SQLite из нескольких процессов
+Запуск: python manage.py benchmark_sqlite_contention --processes 6 --duration 10
+
+Процессы повторяют нагрузку очереди входящих: вставка события, захват ожидающего
+события UPDATE-ом внутри транзакции и чтения глубины очереди. Замер выполняется
+на временном файле (рабочая база не затрагивается) дважды:
+
+- default - как Django без профиля: журнал отката, таймаут sqlite3 по умолчанию,
+  отложенные (DEFERRED) транзакции;
+- production - PRAGMA из SQLITE_PRAGMAS и транзакции BEGIN IMMEDIATE.
+
+Печатаются записи и чтения в секунду, ошибки "database is locked" и задержки записи.
+"""
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.db import apply_pragmas
+
+SCHEMA = [
+    "CREATE TABLE events (id INTEGER PRIMARY KEY, conversation TEXT, payload TEXT,"
+    " status TEXT, owner INTEGER, created_at REAL)",
+    "CREATE INDEX events_status ON events (status, id)",
+]
+
+
+def _worker(path, pragmas, begin, deadline, read_ratio, seed, results):
+    rng = random.Random(seed)
+    # isolation_level=None - транзакциями управляем сами, как Django в режиме autocommit
+    db = sqlite3.connect(path, timeout=5.0, isolation_level=None)
+    cursor = db.cursor()
+    apply_pragmas(cursor, pragmas)
+    writes = reads = errors = 0
+    latencies = []
+    payload = "x" * 512
+
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            if rng.random() < read_ratio:
+                cursor.execute("SELECT COUNT(*) FROM events WHERE status = 'pending'")
+                cursor.fetchone()
+                reads += 1
+                continue
+            cursor.execute(begin)
+            try:
+                # Чтение, затем запись в той же транзакции - как захват события потребителем
+                cursor.execute("SELECT id FROM events WHERE status = 'pending' ORDER BY id LIMIT 1")
+                row = cursor.fetchone()
+                if row:
+                    cursor.execute(
+                        "UPDATE events SET status = 'leased', owner = ? WHERE id = ? AND status = 'pending'",
+                        (os.getpid(), row[0]),
+                    )
+                cursor.execute(
+                    "INSERT INTO events (conversation, payload, status, created_at) VALUES (?, ?, 'pending', ?)",
+                    (f"telegram:{rng.randrange(1000)}", payload, time.time()),
+                )
+                cursor.execute("COMMIT")
+            except sqlite3.Error:
+                if db.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+            writes += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+        except sqlite3.OperationalError:
+            errors += 1
+
+    db.close()
+    results.put((writes, reads, errors, latencies))
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает пропускную способность записи SQLite с профилем по умолчанию и производственным'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help='Параллельных процессов')
+        parser.add_argument('--duration', type=float, default=5.0, help='Секунд на один профиль')
+        parser.add_argument('--read-ratio', type=float, default=0.3, help='Доля чтений в нагрузке')
+        parser.add_argument(
+            '--profile',
+            choices=['default', 'production', 'both'],
+            default='both',
+            help='Какие профили замерить',
+        )
+
+    def handle(self, *args, **options):
+        profiles = {
+            'default': ({}, 'BEGIN'),
+            'production': (getattr(settings, 'SQLITE_PRAGMAS', {}), 'BEGIN IMMEDIATE'),
+        }
+        names = list(profiles) if options['profile'] == 'both' else [options['profile']]
+        self.stdout.write(
+            f'Процессов: {options["processes"]}, длительность: {options["duration"]} с, '
+            f'доля чтений: {options["read_ratio"]}'
+        )
+
+        throughput = {}
+        for name in names:
+            pragmas, begin = profiles[name]
+            writes, reads, errors, latencies = self._run(pragmas, begin, options)
+            duration = options['duration']
+            throughput[name] = writes / duration
+            latencies.sort()
+            p50 = statistics.median(latencies) if latencies else 0.0
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{name}'))
+            self.stdout.write(
+                f'  записей/с: {writes / duration:.0f}, чтений/с: {reads / duration:.0f}, '
+                f'ошибок блокировки: {errors}'
+            )
+            self.stdout.write(f'  задержка записи: p50 {p50:.2f} ms, p99 {p99:.2f} ms')
+
+        if len(throughput) == 2 and throughput['default']:
+            self.stdout.write(self.style.SUCCESS(
+                f'\nПроизводственный профиль: x{throughput["production"] / throughput["default"]:.1f} записей/с'
+            ))
+
+    def _run(self, pragmas, begin, options):
+        directory = tempfile.mkdtemp(prefix='sqlite_contention_')
+        path = os.path.join(directory, 'bench.sqlite3')
+        try:
+            db = sqlite3.connect(path)
+            for statement in SCHEMA:
+                db.execute(statement)
+            db.commit()
+            db.close()
+
+            results = multiprocessing.Queue()
+            deadline = time.time() + options['duration']
+            workers = [
+                multiprocessing.Process(
+                    target=_worker,
+                    args=(path, pragmas, begin, deadline, options['read_ratio'], seed, results),
+                )
+                for seed in range(options['processes'])
+            ]
+            for worker in workers:
+                worker.start()
+            collected = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        writes = sum(item[0] for item in collected)
+        reads = sum(item[1] for item in collected)
+        errors = sum(item[2] for item in collected)
+        latencies = [latency for item in collected for latency in item[3]]
+        return writes, reads, errors, latencies
@@ -15,10 +15,12 @@ class User(AbstractUser):
 
     LANGUAGE_RU = "ru"
     LANGUAGE_KK = "kk"
+    LANGUAGE_EN = "en"
 
     LANGUAGE_CHOICES = [
         (LANGUAGE_RU, "Русский"),
         (LANGUAGE_KK, "Қазақша"),
+        (LANGUAGE_EN, "English"),
     ]
 
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default=ROLE_CLIENT)
@@ -1,6 +1,19 @@
 from django.contrib import admin
 
-from .models import Message, Ticket
+from . import inbound_bus, prefilter
+from .models import (
+    Channel,
+    DeadLetterEvent,
+    InboundEvent,
+    MediaBlob,
+    Message,
+    OutboundMessage,
+    QuarantinedMessage,
+    SenderReputation,
+    SpamModel,
+    Ticket,
+    WorkerLease,
+)
 
 
 @admin.register(Ticket)
@@ -14,10 +27,13 @@ class TicketAdmin(admin.ModelAdmin):
         "category",
         "department",
         "is_auto_solved",
+        "message_count",
         "created_at",
     )
     list_filter = ("status", "priority", "category", "department", "is_auto_solved")
     search_fields = ("subject", "description", "author__username", "author__full_name")
+    # Счётчики ведут сигналы сообщений (tickets.signals)
+    readonly_fields = ("message_count", "last_message_at", "first_bot_reply_at", "first_operator_reply_at")
 
 
 @admin.register(Message)
@@ -25,3 +41,80 @@ class MessageAdmin(admin.ModelAdmin):
     list_display = ("id", "ticket", "is_bot", "created_at")
     list_filter = ("is_bot", "created_at")
     search_fields = ("text",)
+
+
+@admin.register(Channel)
+class ChannelAdmin(admin.ModelAdmin):
+    list_display = ("name", "is_active", "created_at")
+    list_filter = ("is_active",)
+
+
+@admin.register(InboundEvent)
+class InboundEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "channel", "conversation_key", "status", "priority", "attempts", "available_at", "created_at")
+    list_filter = ("channel", "status")
+    search_fields = ("conversation_key", "idempotency_key")
+
+
+@admin.register(DeadLetterEvent)
+class DeadLetterEventAdmin(admin.ModelAdmin):
+    list_display = ("original_id", "channel", "conversation_key", "attempts", "failed_at")
+    list_filter = ("channel",)
+    search_fields = ("conversation_key", "last_error")
+
+
+@admin.register(WorkerLease)
+class WorkerLeaseAdmin(admin.ModelAdmin):
+    list_display = ("name", "holder", "fencing_token", "expires_at", "heartbeat_at")
+    search_fields = ("name", "holder")
+
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "ticket", "channel", "recipient", "status", "attempts", "sent_at", "created_at")
+    list_filter = ("channel", "status")
+    search_fields = ("recipient", "provider_message_id", "last_error")
+
+
+@admin.register(QuarantinedMessage)
+class QuarantinedMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "channel", "user_identifier", "reason", "score", "status", "created_at")
+    list_filter = ("status", "channel", "reason")
+    search_fields = ("user_identifier",)
+    actions = ("release_messages", "confirm_spam")
+
+    @admin.action(description="Выпустить в очередь (не спам)")
+    def release_messages(self, request, queryset):
+        released = 0
+        for quarantined in queryset.filter(status=QuarantinedMessage.STATUS_QUARANTINED):
+            inbound_bus.release(quarantined)
+            released += 1
+        self.message_user(request, f"Выпущено сообщений: {released}")
+
+    @admin.action(description="Подтвердить спам")
+    def confirm_spam(self, request, queryset):
+        confirmed = 0
+        for quarantined in queryset.filter(status=QuarantinedMessage.STATUS_QUARANTINED):
+            prefilter.confirm_spam(quarantined)
+            confirmed += 1
+        self.message_user(request, f"Отмечено как спам: {confirmed}")
+
+
+@admin.register(SenderReputation)
+class SenderReputationAdmin(admin.ModelAdmin):
+    list_display = ("channel", "identifier", "accepted", "quarantined", "dropped", "spam", "blocked", "last_seen")
+    list_filter = ("channel", "blocked")
+    search_fields = ("identifier",)
+
+
+@admin.register(SpamModel)
+class SpamModelAdmin(admin.ModelAdmin):
+    list_display = ("name", "version", "updated_at")
+    exclude = ("data",)
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ("name", "size", "ref_count", "updated_at")
+    search_fields = ("sha256",)
+    readonly_fields = ("sha256", "name", "size", "ref_count", "created_at", "updated_at")
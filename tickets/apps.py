@@ -5,3 +5,6 @@ class TicketsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "tickets"
     verbose_name = "Tickets"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,498 @@
+"""
+Архив закрытых тикетов: холодные данные в сжатых сегментах вне БД
+
+archive_closed_tickets() переносит тикеты, закрытые больше ARCHIVE_AFTER_DAYS дней
+назад, вместе с сообщениями, уведомлениями, Message-ID писем и доставками в
+сегменты ARCHIVE_DIR и удаляет строки из БД порциями. Сегмент - файл JSONL, где
+каждый тикет сжат отдельным кадром zstd (пакет zstandard, если установлен) или
+членом gzip: файл целиком читается стандартными утилитами (zstdcat, zcat), а один
+тикет - чтением и распаковкой только его кадра. Рядом лежит индекс .idx:
+отсортированные (id тикета, время создания, смещение, длина).
+
+Сегменты только дописываются новыми файлами: сегмент и индекс пишутся во
+временные файлы и переименовываются после fsync, строки удаляются только после
+этого. Если тикет изменился после записи в сегмент (новое сообщение, повторное
+открытие), строка остаётся в БД; читатели всегда сначала смотрят в БД, а из
+архива берут копию из самого нового сегмента.
+
+Тикеты, на которые ссылается статья базы знаний (source_ticket), не
+архивируются: удаление обнулило бы ссылку (SET_NULL). Message-ID писем уходят
+в архив вместе с тикетом, и ответ в цепочку архивного тикета открывает новый.
+"""
+import gzip
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .leases import LeaderLease
+from .media_store import retain_references
+from .metrics import get_metrics
+from .models import EmailReference, KnowledgeArticle, Message, Notification, OutboundMessage, Ticket
+
+try:
+    import zstandard
+except ImportError:  # необязательная зависимость: без неё сегменты сжимаются gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("archive")
+
+INDEX_MAGIC = b"TKAR"
+INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct("<4sBI")
+# id тикета, created_at (мкс от эпохи), смещение кадра, длина кадра
+_INDEX_ENTRY = struct.Struct("<qqQI")
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Связанные строки, которые уходят в архив вместе с тикетом (related_name -> модель)
+RELATED = {
+    "messages": Message,
+    "notifications": Notification,
+    "email_references": EmailReference,
+    "outbound_messages": OutboundMessage,
+}
+
+
+class _Encoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder обрезает время до миллисекунд, архиву нужна точная копия
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _micros(moment: datetime) -> int:
+    return (moment - _EPOCH) // timedelta(microseconds=1)
+
+
+class GzipCodec:
+    extension = ".jsonl.gz"
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=6, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class ZstdCodec:
+    extension = ".jsonl.zst"
+
+    def __init__(self, level: int = 9):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+def get_codec(name: Optional[str] = None):
+    """Кодек для новых сегментов: ARCHIVE_COMPRESSION, zstd без пакета zstandard -> gzip"""
+    name = name or getattr(settings, "ARCHIVE_COMPRESSION", "zstd")
+    if name == "zstd" and zstandard is not None:
+        return ZstdCodec(getattr(settings, "ARCHIVE_ZSTD_LEVEL", 9))
+    if name == "zstd":
+        logger.info("zstandard не установлен, сегменты архива сжимаются gzip")
+    return GzipCodec()
+
+
+def _codec_for(path: str):
+    if path.endswith(ZstdCodec.extension):
+        if zstandard is None:
+            raise RuntimeError(f"Для чтения {path} нужен пакет zstandard")
+        return ZstdCodec()
+    return GzipCodec()
+
+
+def _fsync_directory(directory: str) -> None:
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SegmentWriter:
+    """Новый сегмент: append() по тикету, commit() - атомарная публикация сегмента и индекса"""
+
+    def __init__(self, directory: str, codec=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.codec = codec or get_codec()
+        name = f"segment-{timezone.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(directory, name + self.codec.extension)
+        self.index_path = os.path.join(directory, name + ".idx")
+        self._file = open(self.path + ".tmp", "wb")
+        self._entries: List[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        ticket = record["ticket"]
+        data = json.dumps(record, cls=_Encoder, ensure_ascii=False).encode("utf-8") + b"\n"
+        frame = self.codec.compress(data)
+        offset = self._file.tell()
+        self._file.write(frame)
+        self._entries.append((ticket["id"], _micros(ticket["created_at"]), offset, len(frame)))
+
+    def commit(self) -> int:
+        """Сбрасывает сегмент и индекс на диск и публикует их; возвращает размер сегмента"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        size = self._file.tell()
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+        # Индекс появляется последним: сегмент без индекса читатели не видят
+        with open(self.index_path + ".tmp", "wb") as index:
+            index.write(_INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self._entries)))
+            for entry in sorted(self._entries):
+                index.write(_INDEX_ENTRY.pack(*entry))
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(self.index_path + ".tmp", self.index_path)
+        _fsync_directory(self.directory)
+        return size
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self.path + ".tmp")
+        except OSError:
+            pass
+
+
+class Segment:
+    """Индекс одного сегмента в памяти: массивы по ~28 байт на тикет, поиск делением пополам"""
+
+    def __init__(self, path: str, index_path: str):
+        self.path = path
+        self.name = os.path.basename(index_path)[: -len(".idx")]
+        with open(index_path, "rb") as index:
+            data = index.read()
+        magic, version, count = _INDEX_HEADER.unpack_from(data, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"Неизвестный формат индекса {index_path}")
+        self.ids, self.created, self.offsets, self.lengths = array("q"), array("q"), array("Q"), array("I")
+        for ticket_id, created, offset, length in _INDEX_ENTRY.iter_unpack(
+            data[_INDEX_HEADER.size:_INDEX_HEADER.size + count * _INDEX_ENTRY.size]
+        ):
+            self.ids.append(ticket_id)
+            self.created.append(created)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+        self.min_created = min(self.created, default=0)
+        self.max_created = max(self.created, default=-1)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def find(self, ticket_id: int) -> Optional[int]:
+        position = bisect_left(self.ids, ticket_id)
+        if position < len(self.ids) and self.ids[position] == ticket_id:
+            return position
+        return None
+
+    def read(self, position: int) -> Dict[str, Any]:
+        with open(self.path, "rb") as segment:
+            segment.seek(self.offsets[position])
+            frame = segment.read(self.lengths[position])
+        return json.loads(_codec_for(self.path).decompress(frame))
+
+
+class ArchiveReader:
+    """
+    Чтение архива по id тикета. Индексы всех сегментов загружаются один раз и
+    перечитываются, когда в каталоге появляются новые файлы (меняется mtime каталога).
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = str(directory or getattr(settings, "ARCHIVE_DIR", "archive"))
+        self._lock = threading.Lock()
+        self._segments: List[Segment] = []
+        self._version: Optional[int] = None
+
+    def segments(self) -> List[Segment]:
+        """Сегменты от нового к старому"""
+        try:
+            version = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        with self._lock:
+            if version != self._version:
+                self._segments = self._load()
+                self._version = version
+            return self._segments
+
+    def _load(self) -> List[Segment]:
+        loaded = []
+        names = sorted(os.listdir(self.directory), reverse=True)
+        for name in names:
+            if not name.endswith(".idx"):
+                continue
+            base = name[: -len(".idx")]
+            path = next(
+                (os.path.join(self.directory, base + codec.extension)
+                 for codec in (ZstdCodec, GzipCodec) if base + codec.extension in names),
+                None,
+            )
+            if path is None:
+                logger.error(f"Archive index {name} has no segment file")
+                continue
+            try:
+                loaded.append(Segment(path, os.path.join(self.directory, name)))
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Archive segment {base} is unreadable: {e}")
+        return loaded
+
+    def get(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        """Запись тикета из самого нового сегмента или None"""
+        for segment in self.segments():
+            position = segment.find(ticket_id)
+            if position is not None:
+                metrics.incr("reads")
+                return segment.read(position)
+        return None
+
+    def __contains__(self, ticket_id: int) -> bool:
+        return any(segment.find(ticket_id) is not None for segment in self.segments())
+
+    def records_created_between(self, start: datetime, end: datetime) -> Iterator[Dict[str, Any]]:
+        """Записи тикетов, созданных в [start, end), по одной на тикет"""
+        low, high = _micros(start), _micros(end)
+        seen = set()
+        for segment in self.segments():
+            if segment.max_created < low or segment.min_created >= high:
+                continue
+            for position, created in enumerate(segment.created):
+                if low <= created < high and segment.ids[position] not in seen:
+                    seen.add(segment.ids[position])
+                    yield segment.read(position)
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """Все записи архива, по одной (самой новой) на тикет"""
+        seen = set()
+        for segment in self.segments():
+            for position, ticket_id in enumerate(segment.ids):
+                if ticket_id not in seen:
+                    seen.add(ticket_id)
+                    yield segment.read(position)
+
+    def created_hours(self) -> set:
+        """Часы (UTC) создания архивных тикетов - для полного пересчёта агрегатов"""
+        hour = 3600 * 1_000_000
+        return {
+            _EPOCH + timedelta(microseconds=created - created % hour)
+            for segment in self.segments()
+            for created in segment.created
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self.segments()
+        return {
+            "segments": len(segments),
+            "tickets": len({ticket_id for segment in segments for ticket_id in segment.ids}),
+            "bytes": sum(os.path.getsize(segment.path) for segment in segments),
+        }
+
+
+_readers: Dict[str, ArchiveReader] = {}
+_readers_lock = threading.Lock()
+
+
+def get_reader() -> ArchiveReader:
+    """Общий на процесс читатель каталога ARCHIVE_DIR"""
+    directory = str(getattr(settings, "ARCHIVE_DIR", "archive"))
+    with _readers_lock:
+        if directory not in _readers:
+            _readers[directory] = ArchiveReader(directory)
+        return _readers[directory]
+
+
+def _instance(model, fields: Dict[str, Any]):
+    # Значения из JSON (даты строками) приводятся полями модели
+    values = {}
+    for field in model._meta.concrete_fields:
+        if field.attname in fields:
+            value = fields[field.attname]
+            values[field.attname] = field.to_python(value) if value is not None else None
+    return model(**values)
+
+
+def ticket_from_record(record: Dict[str, Any]) -> Ticket:
+    """
+    Несохранённый Ticket из записи архива: is_archived = True, сообщения по
+    времени - в archived_messages, исходная запись - в archived_record.
+    """
+    ticket = _instance(Ticket, record["ticket"])
+    ticket.is_archived = True
+    ticket.archived_record = record
+    ticket.archived_messages = sorted(
+        (_instance(Message, fields) for fields in record["messages"]),
+        key=lambda message: (message.created_at, message.id),
+    )
+    return ticket
+
+
+def load_ticket(ticket_id: int, author_id: Optional[int] = None) -> Optional[Ticket]:
+    """Архивный тикет или None, если его нет в архиве или у него другой автор"""
+    record = get_reader().get(ticket_id)
+    if record is None or (author_id is not None and record["ticket"]["author_id"] != author_id):
+        return None
+    return ticket_from_record(record)
+
+
+def _records(tickets: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Записи архива: поля тикета и связанных строк (values() - *_id вместо объектов)"""
+    records = {ticket["id"]: {"ticket": ticket, **{name: [] for name in RELATED}} for ticket in tickets}
+    for name, model in RELATED.items():
+        for row in model.objects.filter(ticket_id__in=records).order_by("ticket_id", "id").values():
+            records[row["ticket_id"]][name].append(row)
+    return list(records.values())
+
+
+def _article_sources():
+    """id тикетов, из которых созданы статьи базы знаний"""
+    return KnowledgeArticle.objects.filter(source_ticket__isnull=False).values("source_ticket_id")
+
+
+def _delete_unchanged(versions: Dict[int, datetime], chunk_size: int) -> int:
+    """Удаляет тикеты, не изменившиеся с момента записи в сегмент; возвращает число тикетов"""
+    deleted = 0
+    ids = sorted(versions)
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        with transaction.atomic():
+            unchanged = [
+                ticket_id
+                for ticket_id, updated_at in Ticket.objects.select_for_update()
+                .filter(id__in=chunk, status=Ticket.STATUS_CLOSED)
+                .exclude(id__in=_article_sources())
+                .values_list("id", "updated_at")
+                if versions[ticket_id] == updated_at
+            ]
+            if unchanged:
+                # Архив продолжает ссылаться на изображения сообщений
+                with retain_references():
+                    Ticket.objects.filter(id__in=unchanged).delete()
+        deleted += len(unchanged)
+    return deleted
+
+
+def archive_closed_tickets(
+    older_than_days: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    segment_tickets: Optional[int] = None,
+    limit: Optional[int] = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Переносит тикеты, закрытые раньше older_than_days дней назад, в новые сегменты
+    (не больше segment_tickets тикетов в сегменте) и удаляет их из БД порциями
+    по chunk_size. dry_run - только посчитать кандидатов.
+    """
+    started = time.monotonic()
+    days = older_than_days if older_than_days is not None else getattr(settings, "ARCHIVE_AFTER_DAYS", 180)
+    chunk_size = chunk_size or getattr(settings, "ARCHIVE_CHUNK_SIZE", 500)
+    segment_tickets = segment_tickets or getattr(settings, "ARCHIVE_SEGMENT_TICKETS", 10000)
+    candidates = (
+        Ticket.objects.filter(status=Ticket.STATUS_CLOSED, closed_at__lt=timezone.now() - timedelta(days=days))
+        .exclude(id__in=_article_sources())
+        .order_by("id")
+    )
+    if dry_run:
+        return {"candidates": candidates.count(), "archived": 0, "deleted": 0, "segments": 0, "bytes": 0}
+
+    directory = str(getattr(settings, "ARCHIVE_DIR", "archive"))
+    archived = deleted = segments = size = 0
+    last_id = 0
+    exhausted = False
+    while not exhausted and (limit is None or archived < limit):
+        writer = None
+        versions: Dict[int, datetime] = {}
+        try:
+            while len(versions) < segment_tickets and (limit is None or archived + len(versions) < limit):
+                take = min(chunk_size, segment_tickets - len(versions))
+                if limit is not None:
+                    take = min(take, limit - archived - len(versions))
+                tickets = list(candidates.filter(id__gt=last_id).values()[:take])
+                if not tickets:
+                    exhausted = True
+                    break
+                writer = writer or SegmentWriter(directory)
+                for record in _records(tickets):
+                    writer.append(record)
+                    versions[record["ticket"]["id"]] = record["ticket"]["updated_at"]
+                last_id = tickets[-1]["id"]
+            if writer is None:
+                break
+            size += writer.commit()
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+
+        segments += 1
+        archived += len(versions)
+        deleted += _delete_unchanged(versions, chunk_size)
+        logger.info(f"Archive segment {os.path.basename(writer.path)}: {len(versions)} tickets")
+
+    metrics.incr("tickets_archived", value=archived)
+    metrics.incr("tickets_deleted", value=deleted)
+    return {
+        "archived": archived,
+        "deleted": deleted,
+        "segments": segments,
+        "bytes": size,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+class TicketArchiver:
+    """Роль воркера: периодический archive_closed_tickets() на одном узле (аренда archive:tickets)"""
+
+    LEASE_NAME = "archive:tickets"
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval or getattr(settings, "ARCHIVE_INTERVAL", 3600)
+        self.lease = LeaderLease(self.LEASE_NAME)
+
+    def run(self, stop_event) -> None:
+        try:
+            self.lease.run_while_leader(stop_event, self._archive_as_leader)
+        finally:
+            close_old_connections()
+
+    def _archive_as_leader(self, leader_stop) -> None:
+        while not leader_stop.is_set():
+            close_old_connections()
+            try:
+                result = archive_closed_tickets()
+                if result["archived"]:
+                    logger.info(f"Tickets archived: {result}")
+            except Exception as e:
+                logger.error(f"Ticket archival error: {e}")
+            leader_stop.wait(self.interval)
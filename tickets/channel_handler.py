@@ -5,6 +5,7 @@ from typing import Dict, Any, Optional
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
 from .models import Ticket, Message, Channel
+from . import langid, ticket_lifecycle
 from core.utils import AIService
 import base64
 
@@ -14,6 +15,9 @@ User = get_user_model()
 class ChannelHandler:
     """Единая точка входа для обработки сообщений из всех каналов"""
     
+    # Каналы, где тикет определяется цепочкой сообщений, а не "последним открытым тикетом"
+    THREADED_CHANNELS = {Channel.CHANNEL_EMAIL}
+    
     @staticmethod
     def process_incoming_message(
         channel: str,
@@ -21,7 +25,8 @@ class ChannelHandler:
         text: str,
         image_data: Optional[bytes] = None,
         external_id: Optional[str] = None,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        ticket_id: Optional[int] = None,
     ) -> Dict[str, Any]:
         """
         Обрабатывает входящее сообщение из любого канала
@@ -33,6 +38,7 @@ class ChannelHandler:
             image_data: Бинарные данные изображения (опционально)
             external_id: ID сообщения во внешней системе
             metadata: Дополнительные метаданные
+            ticket_id: Тикет, найденный по цепочке сообщений (например, In-Reply-To письма)
             
         Returns:
             Dict с ответом AI и информацией о тикете
@@ -48,15 +54,26 @@ class ChannelHandler:
             channel=channel,
             external_id=external_id,
             text=text,
-            image_data=image_data
+            image_data=image_data,
+            department=metadata.get("department"),
+            ticket_id=ticket_id,
         )
         
+        # Язык определяем по самому сообщению; если текст короткий или неоднозначный -
+        # остаётся язык, известный по прошлым сообщениям пользователя
+        detection = langid.resolve_language(text, getattr(user, 'language', 'ru') or 'ru')
+        if detection.reliable and channel != Channel.CHANNEL_WEB and user.language != detection.language:
+            User.objects.filter(id=user.id).update(language=detection.language)
+            user.language = detection.language
+        
         # Сохраняем сообщение пользователя
         user_message = Message.objects.create(
             ticket=ticket,
             text=text,
             is_bot=False,
             sender=user,
+            language=detection.language,
+            language_confidence=round(detection.confidence, 4),
         )
         
         if image_data:
@@ -75,11 +92,10 @@ class ChannelHandler:
             })
         
         # Генерируем ответ AI
-        language = getattr(user, 'language', 'ru')
         ai_response = AIService.generate_response(
             history=history,
             user_input=text,
-            language=language
+            language=detection.language
         )
         
         # Сохраняем ответ AI (от имени системы, без конкретного пользователя)
@@ -98,19 +114,48 @@ class ChannelHandler:
             "свяжу со специалистом"
         ])
         
-        if needs_escalation and ticket.status == Ticket.STATUS_NEW:
-            ticket.status = Ticket.STATUS_IN_PROGRESS
-            ticket.is_auto_solved = False
-            ticket.save(update_fields=["status", "is_auto_solved"])
+        if needs_escalation:
+            ticket_lifecycle.start_progress(ticket, auto_solved=False)
         
         return {
             "reply": ai_response,
             "ticket_id": ticket.id,
+            "user_message_id": user_message.id,
+            "bot_message_id": bot_message.id,
             "channel": channel,
             "needs_escalation": needs_escalation,
-            "status": ticket.status
+            "status": ticket.status,
+            "priority": ticket.priority,
+            "language": detection.language,
+            "language_confidence": round(detection.confidence, 4),
         }
     
+    @staticmethod
+    def process_event(
+        channel: str,
+        payload: Dict[str, Any],
+        ticket_id: Optional[int] = None,
+        image_data: Optional[bytes] = None,
+    ) -> Dict[str, Any]:
+        """
+        Обрабатывает событие из очереди входящих (см. inbound_bus.publish)
+        
+        payload: user_identifier, text, image_base64, external_id, metadata
+        image_data: изображение, загруженное обработчиком канала (фото Telegram)
+        """
+        if image_data is None and payload.get("image_base64"):
+            image_data = base64.b64decode(payload["image_base64"])
+        
+        return ChannelHandler.process_incoming_message(
+            channel=channel,
+            user_identifier=payload["user_identifier"],
+            text=payload.get("text", ""),
+            image_data=image_data,
+            external_id=payload.get("external_id"),
+            metadata=payload.get("metadata") or {},
+            ticket_id=ticket_id or payload.get("ticket_id"),
+        )
+    
     @staticmethod
     def _get_or_create_user(channel: str, identifier: str, metadata: Dict) -> User:
         """Получает существующего пользователя или создаёт нового"""
@@ -159,33 +204,43 @@ class ChannelHandler:
         channel: str,
         external_id: Optional[str],
         text: str,
-        image_data: Optional[bytes]
+        image_data: Optional[bytes],
+        department: Optional[str] = None,
+        ticket_id: Optional[int] = None,
     ) -> Ticket:
         """Получает существующий открытый тикет или создаёт новый"""
         
-        # Ищем открытый тикет пользователя из этого канала
-        open_ticket = Ticket.objects.filter(
-            author=user,
-            channel=channel,
-            status__in=[Ticket.STATUS_NEW, Ticket.STATUS_IN_PROGRESS]
-        ).first()
+        # Продолжение известной цепочки: ответ на закрытый тикет открывает его заново
+        if ticket_id:
+            thread_ticket = Ticket.objects.filter(id=ticket_id, author=user).first()
+            if thread_ticket:
+                if thread_ticket.status == Ticket.STATUS_CLOSED and not ticket_lifecycle.reopen(thread_ticket):
+                    # Тикет мог переоткрыть параллельный обработчик
+                    thread_ticket.refresh_from_db(fields=["status", "closed_at"])
+                if thread_ticket.status != Ticket.STATUS_CLOSED:
+                    return thread_ticket
+                # Переоткрыть нельзя: у пользователя уже есть открытый тикет в канале
         
-        if open_ticket:
-            return open_ticket
+        # Ищем открытый тикет пользователя из этого канала
+        if channel not in ChannelHandler.THREADED_CHANNELS:
+            open_ticket = ticket_lifecycle.find_open_ticket(user, channel)
+            if open_ticket:
+                return open_ticket
         
         # Классифицируем новый тикет
         classification = AIService.classify_ticket(text, image_data)
         
-        # Создаём новый тикет
-        ticket = Ticket.objects.create(
-            author=user,
-            channel=channel,
+        # Создаём новый тикет; если параллельный обработчик успел раньше - берём его тикет
+        ticket, _created = ticket_lifecycle.create_ticket(
+            user,
+            channel,
             external_id=external_id,
             subject=classification.get("summary", text[:100]),
             description=text,
             category=classification.get("category", "other").lower(),
             priority=classification.get("priority", "medium").lower(),
-            department=classification.get("department", "technical").lower(),
+            # Отдел ящика (например, billing@) важнее догадки классификатора
+            department=department or classification.get("department", "technical").lower(),
         )
         
         return ticket
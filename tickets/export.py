@@ -0,0 +1,314 @@
+"""
+Потоковая выгрузка тикетов с сообщениями: CSV, JSONL, Parquet
+
+Тикеты читаются .iterator(chunk_size=DB_ITERATOR_CHUNK_SIZE), сообщения - одним
+запросом на порцию тикетов; порция сразу превращается в байты и отдаётся
+дальше (StreamingHttpResponse или файл), поэтому память не зависит от размера
+выгрузки. Форматы:
+
+    csv     - строка на сообщение, поля тикета повторяются (ticket_*, message_*);
+              тикет без сообщений - одна строка с пустыми message_*; ячейки,
+              похожие на формулу (=, +, -, @), начинаются с апострофа
+    jsonl   - строка на тикет, сообщения вложенным списком
+    parquet - те же строки, что в CSV, колонками; группа строк на порцию
+              (нужен пакет pyarrow)
+
+С include_archived в выгрузку попадают и тикеты из архива (tickets.archive).
+"""
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .archive import get_reader
+from .models import Message, Ticket
+
+TICKET_FIELDS = (
+    "id",
+    "created_at",
+    "updated_at",
+    "closed_at",
+    "status",
+    "priority",
+    "category",
+    "department",
+    "channel",
+    "author_id",
+    "assigned_operator_id",
+    "subject",
+    "description",
+    "is_auto_solved",
+    "escalated_at",
+    "message_count",
+    "first_bot_reply_at",
+    "first_operator_reply_at",
+)
+MESSAGE_FIELDS = ("id", "created_at", "sender_id", "is_bot", "text", "language", "rating", "image")
+COLUMNS = (
+    [f"ticket_{name}" for name in TICKET_FIELDS]
+    + ["ticket_archived"]
+    + [f"message_{name}" for name in MESSAGE_FIELDS]
+)
+
+# Формат -> (Content-Type, расширение файла)
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "jsonl": ("application/x-ndjson; charset=utf-8", "jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def check_format(fmt: str) -> None:
+    """ValueError для неизвестного формата или parquet без pyarrow - до начала потока"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt!r}: {', '.join(FORMATS)}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("Для формата parquet установите пакет pyarrow")
+
+
+def filename(fmt: str) -> str:
+    return f"tickets-{timezone.localdate():%Y%m%d}.{FORMATS[fmt][1]}"
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time(), tzinfo=timezone.get_current_timezone())
+
+
+class Filters:
+    """Фильтр выгрузки: местные сутки создания [date_from, date_to] и значения полей"""
+
+    def __init__(self, date_from=None, date_to=None, category=None, channel=None, status=None):
+        self.start = _day_start(date_from) if date_from else None
+        self.end = _day_start(date_to + timedelta(days=1)) if date_to else None
+        self.fields = {
+            name: value
+            for name, value in (("category", category), ("channel", channel), ("status", status))
+            if value
+        }
+
+    def queryset(self):
+        tickets = Ticket.objects.filter(**self.fields)
+        if self.start:
+            tickets = tickets.filter(created_at__gte=self.start)
+        if self.end:
+            tickets = tickets.filter(created_at__lt=self.end)
+        return tickets.order_by("id")
+
+    def matches(self, ticket: Dict[str, Any]) -> bool:
+        if any(ticket.get(name) != value for name, value in self.fields.items()):
+            return False
+        created_at = ticket["created_at"]
+        return (not self.start or created_at >= self.start) and (not self.end or created_at < self.end)
+
+
+def _with_messages(tickets: List[Dict[str, Any]], chunk_size: int) -> List[Dict[str, Any]]:
+    by_id = {}
+    for ticket in tickets:
+        ticket["archived"] = False
+        ticket["messages"] = []
+        by_id[ticket["id"]] = ticket
+    messages = (
+        Message.objects.filter(ticket_id__in=by_id)
+        .order_by("ticket_id", "created_at", "id")
+        .values("ticket_id", *MESSAGE_FIELDS)
+    )
+    for message in messages.iterator(chunk_size=chunk_size):
+        by_id[message.pop("ticket_id")]["messages"].append(message)
+    return tickets
+
+
+def _live_batches(filters: Filters, chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for ticket in filters.queryset().values(*TICKET_FIELDS).iterator(chunk_size=chunk_size):
+        batch.append(ticket)
+        if len(batch) >= chunk_size:
+            yield _with_messages(batch, chunk_size)
+            batch = []
+    if batch:
+        yield _with_messages(batch, chunk_size)
+
+
+def _parse_times(row: Dict[str, Any], names: Iterable[str]) -> Dict[str, Any]:
+    # В архиве время хранится строками ISO 8601
+    result = {}
+    for name in names:
+        value = row.get(name)
+        if isinstance(value, str) and name.endswith("_at"):
+            value = datetime.fromisoformat(value)
+        result[name] = value
+    return result
+
+
+def _archived_batches(filters: Filters, chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """Тикеты архива, подходящие под фильтр; тикеты, которые снова есть в БД, уже выгружены"""
+    batch: List[Dict[str, Any]] = []
+
+    def flush():
+        live = set(Ticket.objects.filter(id__in=[t["id"] for t in batch]).values_list("id", flat=True))
+        return [ticket for ticket in batch if ticket["id"] not in live]
+
+    for record in get_reader().records():
+        ticket = _parse_times(record["ticket"], TICKET_FIELDS)
+        if not filters.matches(ticket):
+            continue
+        ticket["archived"] = True
+        ticket["messages"] = sorted(
+            (_parse_times(message, MESSAGE_FIELDS) for message in record["messages"]),
+            key=lambda message: (message["created_at"], message["id"]),
+        )
+        batch.append(ticket)
+        if len(batch) >= chunk_size:
+            yield flush()
+            batch = []
+    if batch:
+        yield flush()
+
+
+def _flat_rows(tickets: List[Dict[str, Any]]) -> Iterator[list]:
+    empty = [None] * len(MESSAGE_FIELDS)
+    for ticket in tickets:
+        head = [ticket[name] for name in TICKET_FIELDS] + [ticket["archived"]]
+        if not ticket["messages"]:
+            yield head + empty
+        for message in ticket["messages"]:
+            yield head + [message[name] for name in MESSAGE_FIELDS]
+
+
+# Ячейка, начинающаяся с этих символов, в Excel/LibreOffice - формула (CSV injection)
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _text(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Апостроф заставляет табличный редактор показать ячейку как текст
+        return "'" + value
+    return "" if value is None else value
+
+
+def _csv_chunks(batches: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    # BOM - чтобы Excel открыл кириллицу без мастера импорта
+    yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in _flat_rows(batch):
+            writer.writerow([_text(value) for value in row])
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _jsonl_chunks(batches: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    def default(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+    for batch in batches:
+        yield "".join(
+            json.dumps(ticket, default=default, ensure_ascii=False) + "\n" for ticket in batch
+        ).encode("utf-8")
+
+
+class _Sink:
+    """Файлоподобный буфер для ParquetWriter: drain() забирает записанное с прошлого раза"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_schema():
+    import pyarrow as pa
+
+    types = {
+        "DateTimeField": pa.timestamp("us", tz="UTC"),
+        "BooleanField": pa.bool_(),
+        "BigAutoField": pa.int64(),
+        "AutoField": pa.int64(),
+        "ForeignKey": pa.int64(),
+        "IntegerField": pa.int64(),
+        "FloatField": pa.float64(),
+    }
+    fields = []
+    for model, prefix, names in ((Ticket, "ticket_", TICKET_FIELDS), (Message, "message_", MESSAGE_FIELDS)):
+        for name in names:
+            field = model._meta.get_field(name[: -len("_id")] if name.endswith("_id") else name)
+            fields.append(pa.field(prefix + name, types.get(field.get_internal_type(), pa.string())))
+        if model is Ticket:
+            fields.append(pa.field("ticket_archived", pa.bool_()))
+    return pa.schema(fields)
+
+
+def _parquet_chunks(batches: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema()
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for batch in batches:
+        rows = list(_flat_rows(batch))
+        if not rows:
+            continue
+        columns = [pa.array(list(column), type=field.type) for column, field in zip(zip(*rows), schema)]
+        writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+_WRITERS = {"csv": _csv_chunks, "jsonl": _jsonl_chunks, "parquet": _parquet_chunks}
+
+
+def export_tickets(
+    fmt: str,
+    filters: Optional[Filters] = None,
+    include_archived: bool = False,
+    chunk_size: Optional[int] = None,
+) -> Iterator[bytes]:
+    """
+    Байты выгрузки порциями по chunk_size тикетов. Формат проверяется сразу
+    (ValueError), данные читаются по мере потребления генератора.
+    """
+    check_format(fmt)
+    filters = filters or Filters()
+    chunk_size = chunk_size or getattr(settings, "DB_ITERATOR_CHUNK_SIZE", 2000)
+
+    def batches():
+        yield from _live_batches(filters, chunk_size)
+        if include_archived:
+            yield from _archived_batches(filters, chunk_size)
+
+    return _WRITERS[fmt](batches())
@@ -0,0 +1,299 @@
+"""
+Очередь входящих событий (inbox) для всех не-веб каналов
+
+Каналы только публикуют сырое событие (publish) и сразу отвечают внешней
+системе. Потребители (InboundConsumer) арендуют события на время обработки:
+если потребитель упал, аренда истекает и событие снова становится доступным.
+События одного диалога (conversation_key) обрабатываются строго по порядку,
+диалоги с приоритетными тикетами - раньше остальных. Событие, которое не
+удалось обработать за INBOUND_MAX_ATTEMPTS попыток, переносится в DeadLetterEvent.
+Перед записью сообщение проходит префильтр (prefilter.screen): мусор не
+попадает в очередь вовсе.
+"""
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Min, Q
+from django.utils import timezone
+
+from . import prefilter
+from .metrics import get_metrics
+from .models import DeadLetterEvent, InboundEvent, QuarantinedMessage, Ticket
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("inbound")
+
+DEFAULT_PRIORITY = InboundEvent.PRIORITY_RANKS[Ticket.PRIORITY_MEDIUM]
+
+
+def conversation_key(channel: str, user_identifier: str) -> str:
+    return f"{channel}:{user_identifier}"[:255]
+
+
+def publish(
+    channel: str,
+    user_identifier: str,
+    payload: Dict[str, Any],
+    idempotency_key: Optional[str] = None,
+    screen: bool = True,
+) -> Tuple[Optional[InboundEvent], bool]:
+    """
+    Записывает событие в очередь. Возвращает (событие, создано ли);
+    повтор с тем же idempotency_key (ретрай webhook, повторное чтение письма)
+    возвращает уже существующее событие. Отсеянное префильтром сообщение
+    возвращает (None, False); screen=False - без префильтра (выпуск из карантина).
+    """
+    if idempotency_key:
+        existing = InboundEvent.objects.filter(idempotency_key=idempotency_key[:255]).first()
+        if existing:
+            metrics.incr("duplicates", channel=channel)
+            return existing, False
+    if screen and not prefilter.screen(channel, user_identifier, payload, idempotency_key).accepted:
+        return None, False
+
+    key = conversation_key(channel, user_identifier)
+
+    # Новое событие наследует приоритет последнего события диалога,
+    # который потребитель обновляет по приоритету тикета
+    priority = (
+        InboundEvent.objects.filter(conversation_key=key)
+        .order_by("-id")
+        .values_list("priority", flat=True)
+        .first()
+    )
+
+    try:
+        with transaction.atomic():
+            event = InboundEvent.objects.create(
+                channel=channel,
+                conversation_key=key,
+                idempotency_key=idempotency_key[:255] if idempotency_key else None,
+                payload=dict(payload, user_identifier=user_identifier),
+                priority=DEFAULT_PRIORITY if priority is None else priority,
+            )
+    except IntegrityError:
+        metrics.incr("duplicates", channel=channel)
+        return InboundEvent.objects.filter(idempotency_key=idempotency_key[:255]).first(), False
+
+    metrics.incr("published", channel=channel)
+    return event, True
+
+
+def publish_many(channel: str, items: List[Tuple[str, Dict[str, Any], Optional[str]]]) -> int:
+    """
+    Пакетная запись событий одного канала: items - (user_identifier, payload, idempotency_key).
+    Один запрос на приоритеты диалогов, один на дубликаты и один INSERT.
+    Возвращает число новых событий.
+    """
+    if not items:
+        return 0
+
+    idempotency_keys = [key[:255] for _, _, key in items if key]
+    existing = set(
+        InboundEvent.objects.filter(idempotency_key__in=idempotency_keys).values_list("idempotency_key", flat=True)
+    ) if idempotency_keys else set()
+
+    events = []
+    duplicates = 0
+    seen = set(existing)
+    for user_identifier, payload, idempotency_key in items:
+        idempotency_key = idempotency_key[:255] if idempotency_key else None
+        if idempotency_key:
+            if idempotency_key in seen:
+                duplicates += 1
+                continue
+            seen.add(idempotency_key)
+        # Повторы webhook не проходят префильтр второй раз и не портят репутацию отправителя
+        if not prefilter.screen(channel, user_identifier, payload, idempotency_key).accepted:
+            continue
+        events.append(InboundEvent(
+            channel=channel,
+            conversation_key=conversation_key(channel, user_identifier),
+            idempotency_key=idempotency_key,
+            payload=dict(payload, user_identifier=user_identifier),
+        ))
+    metrics.incr("duplicates", duplicates, channel=channel)
+    if not events:
+        return 0
+
+    keys = {event.conversation_key for event in events}
+    last_ids = (
+        InboundEvent.objects.filter(conversation_key__in=keys)
+        .values("conversation_key")
+        .annotate(last_id=Max("id"))
+        .values_list("last_id", flat=True)
+    )
+    priorities = dict(InboundEvent.objects.filter(id__in=last_ids).values_list("conversation_key", "priority"))
+    for event in events:
+        event.priority = priorities.get(event.conversation_key, DEFAULT_PRIORITY)
+
+    # Параллельная запись того же события другим запросом отсекается уникальным ключом
+    InboundEvent.objects.bulk_create(events, ignore_conflicts=True)
+    metrics.incr("published", len(events), channel=channel)
+    return len(events)
+
+
+def release(quarantined: QuarantinedMessage) -> Optional[InboundEvent]:
+    """Выпускает сообщение из карантина в очередь и дообучает префильтр на нём как на не-спаме"""
+    event, _created = publish(
+        quarantined.channel,
+        quarantined.user_identifier,
+        quarantined.payload,
+        idempotency_key=quarantined.idempotency_key,
+        screen=False,
+    )
+    QuarantinedMessage.objects.filter(id=quarantined.id).update(
+        status=QuarantinedMessage.STATUS_RELEASED,
+        reviewed_at=timezone.now(),
+    )
+    prefilter.train([(prefilter.message_text(quarantined.payload), False)])
+    return event
+
+
+def lease(owner: str, limit: int = 10, visibility_timeout: Optional[int] = None) -> List[InboundEvent]:
+    """
+    Арендует до limit событий: не больше одного на диалог и только самое
+    раннее незавершённое событие диалога. Аренда - условный UPDATE, поэтому
+    одно событие не достанется двум потребителям.
+    """
+    visibility_timeout = visibility_timeout or getattr(settings, "INBOUND_VISIBILITY_TIMEOUT", 300)
+    now = timezone.now()
+
+    # Только самое раннее незавершённое событие каждого диалога: более поздние ждут
+    # своей очереди. Головы выбираются до LIMIT, поэтому длинная очередь одного
+    # диалога не занимает окно кандидатов. Голова, которая сейчас в работе, не
+    # проходит фильтр по статусу - её диалог пропускается целиком.
+    heads = (
+        InboundEvent.objects.exclude(status=InboundEvent.STATUS_DONE)
+        .values("conversation_key")
+        .annotate(head=Min("id"))
+        .values("head")
+    )
+    candidates = list(
+        InboundEvent.objects.filter(id__in=heads, available_at__lte=now)
+        .filter(
+            Q(status=InboundEvent.STATUS_PENDING)
+            | Q(status=InboundEvent.STATUS_LEASED, lease_expires_at__lte=now)
+        )
+        .order_by("priority", "id")
+        .values_list("id", "status", "lease_expires_at")[:limit * 2]
+    )
+    if not candidates:
+        return []
+
+    lease_expires_at = now + timedelta(seconds=visibility_timeout)
+    claimed_ids = []
+    for event_id, status, previous_expiry in candidates:
+        claimed = InboundEvent.objects.filter(
+            id=event_id,
+            status=status,
+            lease_expires_at=previous_expiry,
+        ).update(
+            status=InboundEvent.STATUS_LEASED,
+            lease_owner=owner[:100],
+            lease_expires_at=lease_expires_at,
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            claimed_ids.append(event_id)
+            if len(claimed_ids) >= limit:
+                break
+
+    if claimed_ids:
+        metrics.incr("leased", len(claimed_ids))
+    return list(InboundEvent.objects.filter(id__in=claimed_ids).order_by("priority", "id"))
+
+
+def save_result(event: InboundEvent, result: Dict[str, Any]) -> None:
+    """
+    Запоминает результат обработки до доставки ответа: повторная попытка
+    после сбоя доставки не создаёт тикет и сообщения заново
+    """
+    event.result = result
+    InboundEvent.objects.filter(id=event.id, lease_owner=event.lease_owner).update(result=result)
+
+
+def ack(event: InboundEvent) -> bool:
+    """Отмечает событие обработанным; False, если аренда уже перешла другому потребителю"""
+    done = InboundEvent.objects.filter(
+        id=event.id,
+        status=InboundEvent.STATUS_LEASED,
+        lease_owner=event.lease_owner,
+    ).update(
+        status=InboundEvent.STATUS_DONE,
+        lease_expires_at=None,
+        processed_at=timezone.now(),
+        last_error="",
+    )
+    if done:
+        metrics.incr("acked", channel=event.channel)
+        metrics.observe("latency_seconds", (timezone.now() - event.created_at).total_seconds(), channel=event.channel)
+    return bool(done)
+
+
+def fail(event: InboundEvent, error: Exception) -> bool:
+    """
+    Возвращает событие в очередь с задержкой или переносит его в dead letter.
+    True, если событие перенесено в dead letter.
+    """
+    max_attempts = getattr(settings, "INBOUND_MAX_ATTEMPTS", 5)
+    retry_base = getattr(settings, "INBOUND_RETRY_BASE", 10)
+
+    if event.attempts >= max_attempts:
+        with transaction.atomic():
+            deleted, _ = InboundEvent.objects.filter(id=event.id, lease_owner=event.lease_owner).delete()
+            if deleted:
+                DeadLetterEvent.objects.create(
+                    original_id=event.id,
+                    channel=event.channel,
+                    conversation_key=event.conversation_key,
+                    idempotency_key=event.idempotency_key,
+                    payload=event.payload,
+                    attempts=event.attempts,
+                    last_error=str(error)[:1000],
+                    received_at=event.created_at,
+                )
+        metrics.incr("dead_lettered", channel=event.channel)
+        logger.error(f"Inbound event {event.id} moved to dead letter after {event.attempts} attempts: {error}")
+        return bool(deleted)
+
+    InboundEvent.objects.filter(id=event.id, lease_owner=event.lease_owner).update(
+        status=InboundEvent.STATUS_PENDING,
+        lease_expires_at=None,
+        available_at=timezone.now() + timedelta(seconds=retry_base * 2 ** (event.attempts - 1)),
+        last_error=str(error)[:1000],
+    )
+    metrics.incr("retried", channel=event.channel)
+    logger.warning(f"Inbound event {event.id} failed (attempt {event.attempts}): {error}")
+    return False
+
+
+def update_conversation_priority(key: str, ticket_priority: str) -> None:
+    """События диалога (и будущие, см. publish) получают приоритет его тикета"""
+    rank = InboundEvent.PRIORITY_RANKS.get(ticket_priority, DEFAULT_PRIORITY)
+    InboundEvent.objects.filter(conversation_key=key).exclude(priority=rank).update(priority=rank)
+
+
+def purge_done(retention_hours: Optional[int] = None) -> int:
+    """Удаляет обработанные события старше срока хранения"""
+    retention_hours = retention_hours or getattr(settings, "INBOUND_RETENTION_HOURS", 24)
+    cutoff = timezone.now() - timedelta(hours=retention_hours)
+    deleted, _ = InboundEvent.objects.filter(status=InboundEvent.STATUS_DONE, processed_at__lt=cutoff).delete()
+    return deleted
+
+
+def depth() -> Dict[str, int]:
+    """Число ожидающих и арендованных событий"""
+    counts = {InboundEvent.STATUS_PENDING: 0, InboundEvent.STATUS_LEASED: 0}
+    rows = (
+        InboundEvent.objects.exclude(status=InboundEvent.STATUS_DONE)
+        .values("status")
+        .annotate(count=Count("id"))
+        .values_list("status", "count")
+    )
+    counts.update(dict(rows))
+    return counts
@@ -0,0 +1,122 @@
+"""
+Потребитель очереди входящих событий
+
+Для каждого канала задаётся обработка события (создание тикета и ответ AI) и
+доставка ответа обратно в канал. Результат обработки сохраняется в событии до
+доставки, поэтому повтор после сбоя доставки не дублирует сообщения в тикете.
+"""
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import inbound_bus
+from .channel_handler import ChannelHandler
+from .integrations import email_integration, telegram_integration, whatsapp_integration
+from .metrics import get_metrics
+from .models import Channel, InboundEvent
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("inbound")
+
+
+def _process_generic(channel: str) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    return lambda payload: ChannelHandler.process_event(channel, payload)
+
+
+class InboundConsumer:
+    """Арендует события из очереди, обрабатывает их и доставляет ответы"""
+
+    # Канал -> (обработка, доставка ответа, уведомление об окончательной ошибке)
+    HANDLERS: Dict[str, tuple] = {
+        Channel.CHANNEL_EMAIL: (
+            email_integration.process_email_event,
+            email_integration.deliver_email_reply,
+            None,
+        ),
+        Channel.CHANNEL_TELEGRAM: (
+            telegram_integration.process_telegram_event,
+            telegram_integration.deliver_telegram_reply,
+            telegram_integration.notify_telegram_failure,
+        ),
+        Channel.CHANNEL_WHATSAPP: (
+            whatsapp_integration.process_whatsapp_event,
+            whatsapp_integration.deliver_whatsapp_reply,
+            None,
+        ),
+        # Ответ API забирают по event_id (см. external_api_event)
+        Channel.CHANNEL_API: (_process_generic(Channel.CHANNEL_API), None, None),
+    }
+
+    def __init__(self, batch_size: Optional[int] = None, name: Optional[str] = None):
+        self.batch_size = batch_size or getattr(settings, "INBOUND_BATCH_SIZE", 10)
+        self.poll_interval = getattr(settings, "INBOUND_POLL_INTERVAL", 1)
+        self.purge_interval = getattr(settings, "INBOUND_PURGE_INTERVAL", 3600)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{name or uuid.uuid4().hex[:8]}"
+        self._last_purge = time.monotonic()
+
+    def process_batch(self) -> int:
+        """Обрабатывает одну пачку событий, возвращает число успешно обработанных"""
+        events = inbound_bus.lease(self.owner, limit=self.batch_size)
+        done = 0
+        for event in events:
+            if self.process(event):
+                done += 1
+        return done
+
+    def process(self, event: InboundEvent) -> bool:
+        process, deliver, notify_failure = self.HANDLERS.get(
+            event.channel, (_process_generic(event.channel), None, None)
+        )
+        started = time.monotonic()
+        try:
+            result = event.result
+            if result is None:
+                result = process(event.payload)
+                inbound_bus.save_result(event, result)
+                if result.get("priority"):
+                    inbound_bus.update_conversation_priority(event.conversation_key, result["priority"])
+            if deliver is not None:
+                deliver(event.payload, result)
+        except Exception as e:
+            dead = inbound_bus.fail(event, e)
+            if dead and notify_failure is not None:
+                try:
+                    notify_failure(event.payload)
+                except Exception as notify_error:
+                    logger.warning(f"Failed to notify about dead event {event.id}: {notify_error}")
+            return False
+
+        inbound_bus.ack(event)
+        metrics.observe("processing_seconds", time.monotonic() - started, channel=event.channel)
+        return True
+
+    def run(self, stop_event) -> None:
+        """Обрабатывает события до stop_event; пустая очередь опрашивается раз в poll_interval"""
+        logger.info(f"Inbound consumer {self.owner} started")
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                processed = self.process_batch()
+                self._maybe_purge()
+                metrics.gauge("pending", inbound_bus.depth()[InboundEvent.STATUS_PENDING])
+            except Exception as e:
+                logger.error(f"Inbound consumer error: {e}")
+                processed = 0
+            if not processed:
+                stop_event.wait(self.poll_interval)
+        close_old_connections()
+
+    def _maybe_purge(self) -> None:
+        if time.monotonic() - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = time.monotonic()
+        purged = inbound_bus.purge_done()
+        if purged:
+            logger.info(f"Purged {purged} processed inbound events")
@@ -1,174 +1,453 @@
 """
 Интеграция с email для приёма обращений
+
+Письма читаются по UID начиная с сохранённой позиции (MailboxCheckpoint):
+заголовки и BODYSTRUCTURE забираются одним пакетным UID FETCH, после чего
+скачиваются только нужные части (текст или HTML и первое изображение). В режиме
+listen() соединение держится открытым и новые письма приходят через IMAP IDLE.
+Разобранное письмо ставится в очередь входящих (inbound_bus), тикет и ответ
+создаёт потребитель очереди.
 """
+import base64
 import imaplib
 import email
+import os
+import time
+from concurrent.futures import Future
 from email.header import decode_header
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 import logging
 from django.conf import settings
+from .. import inbound_bus, prefilter
 from ..channel_handler import ChannelHandler
-from ..models import Channel
+from ..leases import LeaseLost
+from ..metrics import get_metrics
+from ..models import Channel, MailboxCheckpoint, Ticket
+from . import email_threading, imap_protocol
+from .email_normalizer import normalize_email_body
+from .email_outbox import enqueue_reply
 
 logger = logging.getLogger(__name__)
 
+metrics = get_metrics("email")
+
+HEADER_FIELDS = (
+    "FROM SUBJECT MESSAGE-ID IN-REPLY-TO REFERENCES DATE "
+    # Для префильтра: автоответы, рассылки и отчёты о недоставке
+    "AUTO-SUBMITTED PRECEDENCE X-AUTOREPLY X-AUTORESPOND LIST-ID LIST-UNSUBSCRIBE "
+    "X-FAILED-RECIPIENTS RETURN-PATH CONTENT-TYPE"
+)
+
 
 class EmailIntegration:
     """Обработчик входящих email-обращений"""
-    
-    def __init__(self):
-        self.imap_server = getattr(settings, 'EMAIL_IMAP_SERVER', 'imap.gmail.com')
-        self.imap_port = getattr(settings, 'EMAIL_IMAP_PORT', 993)
-        self.email_address = getattr(settings, 'SUPPORT_EMAIL', '')
-        self.email_password = getattr(settings, 'SUPPORT_EMAIL_PASSWORD', '')
-    
+
+    def __init__(
+        self,
+        mailbox: Optional[Dict[str, Any]] = None,
+        submit: Optional[Callable[..., Future]] = None,
+        fence: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Args:
+            mailbox: Описание ящика из Channel.config["mailboxes"]; по умолчанию - из settings
+            submit: Функция отправки задачи в пул обработки (см. MailboxSupervisor);
+                без неё письма обрабатываются последовательно в текущем потоке
+            fence: Проверка аренды ящика (LeaderLease.check) перед чтением пачки и
+                сдвигом checkpoint; бросает LeaseLost, если ящик перешёл другому узлу
+        """
+        mailbox = mailbox or {}
+        self.name = mailbox.get('name', 'default')
+        self.imap_server = mailbox.get('server') or getattr(settings, 'EMAIL_IMAP_SERVER', 'imap.gmail.com')
+        self.imap_port = int(mailbox.get('port') or getattr(settings, 'EMAIL_IMAP_PORT', 993))
+        self.email_address = mailbox.get('address') or getattr(settings, 'SUPPORT_EMAIL', '')
+        self.email_password = self._mailbox_password(mailbox) or getattr(settings, 'SUPPORT_EMAIL_PASSWORD', '')
+        self.folder = mailbox.get('folder') or getattr(settings, 'EMAIL_IMAP_FOLDER', 'INBOX')
+        self.department = mailbox.get('department')
+        self.batch_size = getattr(settings, 'EMAIL_FETCH_BATCH_SIZE', 50)
+        self.retry_attempts = getattr(settings, 'EMAIL_RETRY_ATTEMPTS', 5)
+        self.max_image_bytes = getattr(settings, 'EMAIL_MAX_IMAGE_BYTES', 5 * 1024 * 1024)
+        self.idle_timeout = getattr(settings, 'EMAIL_IDLE_TIMEOUT', 25 * 60)
+        self.submit = submit
+        self.fence = fence
+        self.uidvalidity = 0
+
+    @staticmethod
+    def _mailbox_password(mailbox: Dict[str, Any]) -> str:
+        """Пароль можно хранить в конфиге или сослаться на переменную окружения"""
+        if mailbox.get('password_env'):
+            return os.environ.get(mailbox['password_env'], '')
+        return mailbox.get('password', '')
+
+    @property
+    def mailbox_key(self) -> str:
+        return f"{self.email_address}@{self.imap_server}/{self.folder}"
+
     def fetch_new_emails(self) -> List[Dict[str, Any]]:
         """
-        Подключается к почтовому ящику и получает новые письма
-        
+        Подключается к почтовому ящику и обрабатывает письма после сохранённой позиции
+
         Returns:
             Список обработанных сообщений
         """
         if not self.email_address or not self.email_password:
             logger.warning("Email credentials not configured")
             return []
-        
+
         processed = []
-        
+
         try:
-            # Подключаемся к IMAP серверу
-            mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port)
-            mail.login(self.email_address, self.email_password)
-            mail.select('INBOX')
-            
-            # Ищем непрочитанные письма
-            status, messages = mail.search(None, 'UNSEEN')
-            
-            if status != 'OK':
-                logger.error("Failed to search emails")
-                return []
-            
-            email_ids = messages[0].split()
-            
-            for email_id in email_ids:
+            mail = self._connect()
+            try:
+                processed = self._process_new(mail)
+            finally:
+                self._disconnect(mail)
+        except LeaseLost:
+            logger.warning(f"Mailbox {self.mailbox_key} is now handled by another node")
+        except Exception as e:
+            logger.error(f"Email integration error: {e}")
+
+        return processed
+
+    def listen(self, stop_event=None) -> None:
+        """
+        Долгоживущий режим: держит соединение и ждёт новые письма через IDLE.
+        При обрыве переподключается с экспоненциальной задержкой.
+        """
+        if not self.email_address or not self.email_password:
+            logger.warning("Email credentials not configured")
+            return
+
+        backoff = 1
+        while not (stop_event and stop_event.is_set()):
+            try:
+                mail = self._connect()
+                backoff = 1
                 try:
-                    # Получаем письмо
-                    status, msg_data = mail.fetch(email_id, '(RFC822)')
-                    
-                    if status != 'OK':
-                        continue
-                    
-                    # Парсим письмо
-                    raw_email = msg_data[0][1]
-                    msg = email.message_from_bytes(raw_email)
-                    
-                    # Извлекаем данные
-                    subject = self._decode_header(msg['Subject'])
-                    from_email = email.utils.parseaddr(msg['From'])[1]
-                    message_id = msg['Message-ID']
-                    
-                    # Получаем текст письма
-                    body = self._get_email_body(msg)
-                    
-                    # Получаем вложения (изображения)
-                    image_data = self._get_first_image(msg)
-                    
-                    # Обрабатываем через единый обработчик
-                    result = ChannelHandler.process_incoming_message(
-                        channel=Channel.CHANNEL_EMAIL,
-                        user_identifier=from_email,
-                        text=body or subject,
-                        image_data=image_data,
-                        external_id=message_id,
-                        metadata={
-                            "subject": subject,
-                            "from": from_email,
-                        }
-                    )
-                    
-                    # Отправляем ответ
-                    self._send_reply(from_email, subject, result['reply'])
-                    
-                    # Помечаем как прочитанное
-                    mail.store(email_id, '+FLAGS', '\\Seen')
-                    
-                    processed.append(result)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing email {email_id}: {e}")
-                    continue
-            
+                    supports_idle = 'IDLE' in mail.capabilities
+                    while not (stop_event and stop_event.is_set()):
+                        self._process_new(mail)
+                        if supports_idle:
+                            imap_protocol.idle(mail, self.idle_timeout, stop_event)
+                        else:
+                            # Сервер без IDLE: опрашиваем через NOOP
+                            self._wait(stop_event, 30)
+                            mail.noop()
+                finally:
+                    self._disconnect(mail)
+            except LeaseLost:
+                raise
+            except Exception as e:
+                logger.error(f"Email listener error for {self.mailbox_key}: {e}")
+                self._wait(stop_event, backoff)
+                backoff = min(backoff * 2, 300)
+
+    @staticmethod
+    def _wait(stop_event, seconds: float) -> None:
+        if stop_event is not None:
+            stop_event.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    def _connect(self) -> imaplib.IMAP4_SSL:
+        mail = imaplib.IMAP4_SSL(self.imap_server, self.imap_port)
+        mail.login(self.email_address, self.email_password)
+        mail.select(self.folder)
+        _, data = mail.response('UIDVALIDITY')
+        self.uidvalidity = int(data[0]) if data and data[0] else 0
+        return mail
+
+    @staticmethod
+    def _disconnect(mail: imaplib.IMAP4) -> None:
+        try:
             mail.close()
             mail.logout()
-            
-        except Exception as e:
-            logger.error(f"Email integration error: {e}")
-        
+        except Exception:
+            pass
+
+    def _load_checkpoint(self) -> MailboxCheckpoint:
+        """Загружает позицию чтения; при смене UIDVALIDITY начинает заново"""
+        uidvalidity = self.uidvalidity
+        checkpoint, created = MailboxCheckpoint.objects.get_or_create(
+            mailbox=self.mailbox_key,
+            defaults={"uidvalidity": uidvalidity},
+        )
+        if not created and checkpoint.uidvalidity != uidvalidity:
+            logger.warning(f"UIDVALIDITY changed for {self.mailbox_key}, resetting checkpoint")
+            checkpoint.uidvalidity = uidvalidity
+            checkpoint.last_uid = 0
+            checkpoint.retry_uids = {}
+            checkpoint.save(update_fields=["uidvalidity", "last_uid", "retry_uids", "updated_at"])
+        return checkpoint
+
+    def _search_new_uids(self, mail: imaplib.IMAP4, checkpoint: MailboxCheckpoint) -> List[int]:
+        if checkpoint.last_uid:
+            status, data = mail.uid('SEARCH', None, f'UID {checkpoint.last_uid + 1}:*')
+        else:
+            # Первый запуск: как раньше, берём только непрочитанные
+            status, data = mail.uid('SEARCH', None, 'UNSEEN')
+
+        if status != 'OK':
+            logger.error("Failed to search emails")
+            return []
+
+        # "N:*" всегда возвращает последнее письмо, даже если его UID меньше N
+        uids = [int(uid) for uid in (data[0] or b'').split()]
+        return sorted(uid for uid in uids if uid > checkpoint.last_uid)
+
+    def _process_new(self, mail: imaplib.IMAP4) -> List[Dict[str, Any]]:
+        checkpoint = self._load_checkpoint()
+        # Сначала повторяем письма, не обработанные в прошлых проходах (их UID меньше last_uid)
+        retry = {int(uid): attempts for uid, attempts in (checkpoint.retry_uids or {}).items()}
+        uids = sorted(retry) + self._search_new_uids(mail, checkpoint)
+
+        processed = []
+        for start in range(0, len(uids), self.batch_size):
+            batch = uids[start:start + self.batch_size]
+            if self.fence is not None:
+                self.fence()
+            messages = self._fetch_batch(mail, batch)
+            if messages is None:
+                # FETCH не удался - вся пачка уходит на повтор
+                failed = list(batch)
+                messages = {}
+            else:
+                failed = []
+                # UID без ответа FETCH - письмо удалено из ящика, повторять нечего
+                for uid in batch:
+                    if uid not in messages:
+                        retry.pop(uid, None)
+
+            metrics.incr("fetched", len(messages), mailbox=self.name)
+            if self.submit is None:
+                outcomes = [(uid, self._run_handler(messages[uid])) for uid in batch if uid in messages]
+            else:
+                # Письма пачки обрабатываются параллельно в общем пуле; submit блокируется,
+                # если пул перегружен, и тем самым притормаживает чтение ящика
+                futures = [(uid, self.submit(self._run_handler, messages[uid])) for uid in batch if uid in messages]
+                outcomes = [(uid, future.result()) for uid, future in futures]
+
+            seen = []
+            for uid, result in outcomes:
+                if result is None:
+                    failed.append(uid)
+                    continue
+                processed.append(result)
+                seen.append(uid)
+                retry.pop(uid, None)
+
+            if seen:
+                mail.uid('STORE', ','.join(str(uid) for uid in seen), '+FLAGS', '(\\Seen)')
+
+            for uid in failed:
+                attempts = retry.get(uid, 0) + 1
+                if attempts < self.retry_attempts:
+                    retry[uid] = attempts
+                    continue
+                # Письмо остаётся непрочитанным в ящике для ручного разбора
+                retry.pop(uid, None)
+                metrics.incr("abandoned", mailbox=self.name)
+                logger.error(f"Email UID {uid} in {self.mailbox_key} failed {attempts} times, left unread")
+
+            if self.fence is not None:
+                self.fence()
+            checkpoint.last_uid = max(checkpoint.last_uid, batch[-1])
+            checkpoint.retry_uids = {str(uid): attempts for uid, attempts in sorted(retry.items())}
+            checkpoint.save(update_fields=["last_uid", "retry_uids", "updated_at"])
+
         return processed
-    
+
+    def _run_handler(self, parsed: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        started = time.monotonic()
+        try:
+            result = self._handle_email(parsed)
+        except Exception as e:
+            metrics.incr("failed", mailbox=self.name)
+            logger.error(f"Error processing email {parsed.get('uid')} from {self.name}: {e}")
+            return None
+        metrics.incr("processed", mailbox=self.name)
+        metrics.observe("processing_seconds", time.monotonic() - started, mailbox=self.name)
+        return result
+
+    def _fetch_batch(self, mail: imaplib.IMAP4, uids: List[int]) -> Optional[Dict[int, Dict[str, Any]]]:
+        """
+        Пакетно забирает заголовки и структуру писем, затем только нужные части.
+        Письма с одинаковым набором частей скачиваются одним UID FETCH.
+        None - FETCH не удался, пачку нужно повторить.
+        """
+        uid_set = ','.join(str(uid) for uid in uids)
+        status, data = mail.uid(
+            'FETCH', uid_set,
+            f'(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])'
+        )
+        if status != 'OK':
+            logger.error(f"Failed to fetch headers for {uid_set}")
+            return None
+
+        messages: Dict[int, Dict[str, Any]] = {}
+        groups: Dict[tuple, List[int]] = {}
+        for item in imap_protocol.parse_fetch_response(data):
+            uid = item.get("UID")
+            if uid is None:
+                continue
+            header_key = next((k for k in item if k.startswith("BODY[HEADER")), None)
+            headers = email.message_from_bytes(item.get(header_key) or b'')
+            parts = imap_protocol.walk_bodystructure(item.get("BODYSTRUCTURE") or [])
+            wanted = self._select_parts(parts)
+            messages[uid] = {"uid": uid, "headers": headers, "parts": wanted, "payloads": {}}
+            groups.setdefault(tuple(p["part"] for p in wanted.values()), []).append(uid)
+
+        for part_numbers, group_uids in groups.items():
+            if not part_numbers:
+                continue
+            items = ' '.join(f'BODY.PEEK[{number}]' for number in part_numbers)
+            status, data = mail.uid('FETCH', ','.join(str(uid) for uid in group_uids), f'(UID {items})')
+            if status != 'OK':
+                logger.error(f"Failed to fetch bodies for {group_uids}")
+                return None
+            for item in imap_protocol.parse_fetch_response(data):
+                if item.get("UID") in messages:
+                    messages[item["UID"]]["payloads"] = item
+
+        return messages
+
+    def _select_parts(self, parts: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Выбирает части, которые мы используем: текст письма и первое изображение"""
+        selected: Dict[str, Dict[str, Any]] = {}
+        for part in parts:
+            if part["type"] == "text/plain" and not part["filename"] and "text" not in selected:
+                selected["text"] = part
+            elif part["type"] == "text/html" and not part["filename"] and "html" not in selected:
+                selected["html"] = part
+            elif part["type"].startswith("image/") and "image" not in selected:
+                if part["size"] <= self.max_image_bytes * 4 // 3 + 1024:  # base64 раздувает размер
+                    selected["image"] = part
+
+        # HTML скачиваем только если у письма нет текстовой версии
+        if "text" in selected:
+            selected.pop("html", None)
+        return selected
+
+    def _part_bytes(self, parsed: Dict[str, Any], kind: str) -> Optional[bytes]:
+        part = parsed["parts"].get(kind)
+        if part is None:
+            return None
+        raw = parsed["payloads"].get(f'BODY[{part["part"]}]')
+        if raw is None:
+            return None
+        return imap_protocol.decode_transfer_encoding(bytes(raw), part["encoding"])
+
+    def _handle_email(self, parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """Разбирает письмо и ставит его в очередь входящих (обработку делает потребитель)"""
+        headers = parsed["headers"]
+
+        # Извлекаем данные
+        subject = self._decode_header(headers['Subject'])
+        from_email = email.utils.parseaddr(headers['From'])[1]
+        message_id = email_threading.normalize_message_id(headers['Message-ID'])
+        references = self._decode_header(headers['References'])
+
+        # Письмо уже обработано (например, повторное чтение после сбоя)
+        existing = email_threading.find_reference(message_id)
+        if existing:
+            return {"duplicate": True, "ticket_id": existing.ticket_id}
+
+        # Получаем текст письма
+        body = self._get_email_body(parsed)
+
+        # Автоответы, рассылки и возвраты решаются по заголовкам, без классификатора
+        verdict = prefilter.check_email_headers(headers)
+        if verdict and verdict.reason == "bounce":
+            prefilter.record_bounce(*prefilter.parse_bounce(headers, body))
+
+        # Получаем вложения (изображения)
+        image_data = self._part_bytes(parsed, "image")
+        if image_data and len(image_data) > self.max_image_bytes:
+            image_data = None
+
+        payload = {
+            "text": body or subject,
+            "image_base64": base64.b64encode(image_data).decode("ascii") if image_data else None,
+            "external_id": message_id,
+            "subject": subject,
+            "from": from_email,
+            "in_reply_to": self._decode_header(headers['In-Reply-To']),
+            "references": references,
+            "mailbox_address": self.email_address,
+            "metadata": {
+                "subject": subject,
+                "from": from_email,
+                "mailbox": self.name,
+                "department": self.department,
+            },
+        }
+        idempotency_key = f"email:{message_id}" if message_id else None
+
+        if verdict:
+            verdict = prefilter.screen(Channel.CHANNEL_EMAIL, from_email.lower(), payload, idempotency_key, verdict=verdict)
+            if not verdict.accepted:
+                return {"filtered": verdict.reason}
+
+        event, created = inbound_bus.publish(
+            Channel.CHANNEL_EMAIL, from_email.lower(), payload, idempotency_key, screen=verdict is None
+        )
+        if event is None:
+            return {"filtered": "prefilter"}
+        return {"event_id": event.id, "duplicate": not created}
+
     def _decode_header(self, header: str) -> str:
         """Декодирует заголовок письма"""
         if not header:
             return ""
-        
+
         decoded = decode_header(header)
         result = []
-        
+
         for part, encoding in decoded:
             if isinstance(part, bytes):
                 result.append(part.decode(encoding or 'utf-8', errors='ignore'))
             else:
                 result.append(part)
-        
+
         return ''.join(result)
-    
-    def _get_email_body(self, msg: email.message.Message) -> str:
-        """Извлекает текст письма"""
-        body = ""
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                if content_type == "text/plain":
-                    try:
-                        body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                        break
-                    except:
-                        continue
-        else:
-            try:
-                body = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
-            except:
-                pass
-        
-        return body.strip()
-    
-    def _get_first_image(self, msg: email.message.Message) -> bytes:
-        """Извлекает первое изображение из вложений"""
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                if content_type.startswith('image/'):
-                    try:
-                        return part.get_payload(decode=True)
-                    except:
-                        continue
-        return None
-    
-    def _send_reply(self, to_email: str, original_subject: str, reply_text: str):
-        """Отправляет ответ на email"""
-        from django.core.mail import send_mail
-        
-        subject = f"Re: {original_subject}" if not original_subject.startswith("Re:") else original_subject
-        
-        try:
-            send_mail(
-                subject=subject,
-                message=reply_text,
-                from_email=self.email_address,
-                recipient_list=[to_email],
-                fail_silently=False,
-            )
-            logger.info(f"Reply sent to {to_email}")
-        except Exception as e:
-            logger.error(f"Failed to send reply to {to_email}: {e}")
+
+    def _get_email_body(self, parsed: Dict[str, Any]) -> str:
+        """Извлекает текст письма без цитат и подписи (HTML-письма переводятся в текст)"""
+        kind = "text" if "text" in parsed["parts"] else "html"
+        payload = self._part_bytes(parsed, kind)
+        if not payload:
+            return ""
+
+        part = parsed["parts"][kind]
+        normalized = normalize_email_body(payload, content_type=part["type"], charset=part.get("charset"))
+        return normalized["text"]
+
+
+def process_email_event(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Обработка письма из очереди входящих. Цепочка определяется здесь, а не при
+    чтении ящика: письма одного отправителя обрабатываются по порядку, поэтому
+    ответ на только что полученное письмо уже найдёт его тикет.
+    """
+    thread_ticket = email_threading.resolve_thread(payload.get("in_reply_to"), payload.get("references"))
+    result = ChannelHandler.process_event(
+        Channel.CHANNEL_EMAIL,
+        payload,
+        ticket_id=thread_ticket.id if thread_ticket else None,
+    )
+    email_threading.record_reference(payload.get("external_id"), result['ticket_id'])
+    return result
+
+
+def deliver_email_reply(payload: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """Ставит ответ в очередь исходящих писем (отправляет send_outbound_emails)"""
+    enqueue_reply(
+        to_email=payload["from"],
+        original_subject=payload.get("subject", ""),
+        body=result['reply'],
+        from_email=payload.get("mailbox_address", ""),
+        original_message_id=payload.get("external_id") or "",
+        original_references=payload.get("references", ""),
+        ticket=Ticket.objects.filter(id=result['ticket_id']).first(),
+    )
+    logger.info(f"Reply to {payload['from']} queued")
@@ -0,0 +1,209 @@
+"""
+Нормализация текста письма перед отправкой в LLM
+
+HTML превращается в текст, кодировка определяется по объявленной и по
+содержимому, цитаты предыдущей переписки и подписи (ru/kk/en) отрезаются,
+длина ограничивается. Сэкономленные токены считаются в метриках.
+"""
+import re
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from ..metrics import get_metrics
+
+metrics = get_metrics("email_normalizer")
+
+# Грубая оценка для Gemini: ~4 символа на токен
+CHARS_PER_TOKEN = 4
+
+FALLBACK_CHARSETS = ("utf-8", "cp1251", "koi8-r", "cp866")
+
+CYRILLIC_COMMON = set("оеаинтсрвлкмдпуяыьгзбчйхжшюцщэфъё")
+
+HTML_BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "h1", "h2", "h3", "h4", "h5", "h6",
+    "section", "article", "header", "footer", "pre", "hr",
+}
+HTML_SKIP_TAGS = {"script", "style", "head", "title", "blockquote"}
+# Элементы без закрывающего тега (HTML Living Standard): в стек пропуска не попадают
+HTML_VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+    "param", "source", "track", "wbr",
+}
+# Контейнеры с цитатой в Gmail, Outlook, Apple Mail, Mail.ru, Yandex
+HTML_QUOTE_MARKERS = ("gmail_quote", "divrplyfwdmsg", "appendonsend", "moz-cite-prefix", "yandex_quote", "mail_quote")
+
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r"^\s*(On|Le|Am)\b.{0,200}\b(wrote|a écrit|schrieb)\s*:\s*$", re.IGNORECASE),
+    re.compile(r"^.{0,200}\b(написал|написала|написал\(а\)|пишет)\s*:\s*$", re.IGNORECASE),
+    re.compile(r"^.{0,200}\b(жазды|жазған)\s*:\s*$", re.IGNORECASE),
+    re.compile(r"^\s*-{2,}\s*(Original Message|Исходное сообщение|Пересылаемое сообщение|Forwarded message|Бастапқы хат)\s*-{2,}", re.IGNORECASE),
+    re.compile(r"^\s*(From|От|Кімнен|Жіберуші)\s*:\s*.+$", re.IGNORECASE),
+    re.compile(r"^\s*_{10,}\s*$"),
+]
+
+# Только прощания: благодарность ("Рақмет, жауап беріңіз") часто продолжает сам вопрос
+SIGNATURE_PATTERNS = [
+    re.compile(r"^--\s?$"),
+    re.compile(r"^\s*(С уважением|С наилучшими пожеланиями|Всего доброго)\b", re.IGNORECASE),
+    re.compile(r"^\s*(Құрметпен|Ізгі тілекпен)\b", re.IGNORECASE),
+    re.compile(r"^\s*(Best regards|Kind regards|Regards|Best wishes|Cheers|Sincerely)\b", re.IGNORECASE),
+    re.compile(r"^\s*(Sent from my|Отправлено (с|из)|Get Outlook for|Жіберілді)\b", re.IGNORECASE),
+]
+
+
+class _HTMLToText(HTMLParser):
+    """Потоковый HTML -> текст: пропускает стили, скрипты и блоки цитат"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip_stack: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_stack:
+            if tag not in HTML_VOID_TAGS:
+                self._skip_stack.append(tag)
+            return
+
+        attr_text = " ".join(f"{v}" for k, v in attrs if k in ("class", "id") and v).lower()
+        if tag in HTML_SKIP_TAGS or any(marker in attr_text for marker in HTML_QUOTE_MARKERS):
+            if tag not in HTML_VOID_TAGS:
+                self._skip_stack.append(tag)
+            return
+
+        if tag in HTML_BLOCK_TAGS:
+            self.parts.append("\n")
+        if tag == "li":
+            self.parts.append("- ")
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/>: у пустого элемента нет конца, который снял бы тег со стека пропуска;
+        # <div/> в XHTML-письмах - открытый и сразу закрытый элемент
+        self.handle_starttag(tag, attrs)
+        if tag not in HTML_VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in HTML_VOID_TAGS:
+            return
+        if self._skip_stack:
+            # Незакрытые вложенные теги (<p> без </p>) закрываются вместе с внешним
+            if tag in self._skip_stack:
+                index = len(self._skip_stack) - 1 - self._skip_stack[::-1].index(tag)
+                del self._skip_stack[index:]
+            return
+        if tag in HTML_BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip_stack:
+            self.parts.append(data)
+
+    def text(self) -> str:
+        text = "".join(self.parts).replace("\xa0", " ")
+        text = re.sub(r"[ \t\r\f\v]+", " ", text)
+        return re.sub(r"\n\s*\n\s*\n+", "\n\n", text)
+
+
+def html_to_text(html: str, chunk_size: int = 64 * 1024) -> str:
+    parser = _HTMLToText()
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+    parser.close()
+    return parser.text()
+
+
+def _cyrillic_score(text: str) -> float:
+    """Доля "обычных" букв: в настоящем тексте кириллица в основном строчная"""
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return 0.0
+    return sum(1 for ch in letters if ch in CYRILLIC_COMMON or ch.isascii()) / len(letters)
+
+
+def decode_bytes(payload: bytes, declared: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Декодирует текст: объявленная кодировка, если она подходит, иначе
+    кандидат с наиболее правдоподобным текстом. Возвращает (текст, кодировка).
+    """
+    if declared:
+        try:
+            return payload.decode(declared), declared.lower()
+        except (LookupError, UnicodeDecodeError):
+            pass
+
+    try:
+        return payload.decode("utf-8"), "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    sample = payload[:4096]
+    best_charset, best_score = "utf-8", -1.0
+    for charset in FALLBACK_CHARSETS[1:]:
+        try:
+            score = _cyrillic_score(sample.decode(charset))
+        except UnicodeDecodeError:
+            continue
+        if score > best_score:
+            best_charset, best_score = charset, score
+    return payload.decode(best_charset, errors="replace"), best_charset
+
+
+def _strip_history(lines: Iterable[str], max_chars: int) -> List[str]:
+    """Оставляет новый текст письма: до цитаты, без подписи, не длиннее max_chars"""
+    kept: List[str] = []
+    size = 0
+    has_content = False
+    for line in lines:
+        stripped = line.rstrip()
+        if stripped.lstrip().startswith(">"):
+            # Цитата: всё дальнейшее - история переписки
+            break
+        if has_content and any(pattern.match(stripped) for pattern in QUOTE_HEADER_PATTERNS):
+            break
+        if has_content and any(pattern.match(stripped) for pattern in SIGNATURE_PATTERNS):
+            break
+        has_content = has_content or bool(stripped.strip())
+        kept.append(stripped)
+        size += len(stripped) + 1
+        if size >= max_chars:
+            break
+    return kept
+
+
+def normalize_email_body(
+    payload: bytes,
+    content_type: str = "text/plain",
+    charset: Optional[str] = None,
+    max_chars: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Возвращает {"text", "charset", "tokens_before", "tokens_after"}.
+    tokens_before - оценка для исходного текста, tokens_after - для результата.
+    """
+    max_chars = max_chars or getattr(settings, "EMAIL_BODY_MAX_CHARS", 4000)
+
+    text, used_charset = decode_bytes(payload, charset)
+    original_length = len(text)
+    if content_type == "text/html":
+        text = html_to_text(text)
+
+    lines = _strip_history(text.splitlines(), max_chars)
+    result = "\n".join(lines).strip()
+    result = re.sub(r"\n{3,}", "\n\n", result)[:max_chars]
+
+    tokens_before = original_length // CHARS_PER_TOKEN
+    tokens_after = len(result) // CHARS_PER_TOKEN
+    metrics.incr("bodies")
+    metrics.incr("tokens_before", tokens_before)
+    metrics.incr("tokens_saved", max(tokens_before - tokens_after, 0))
+
+    return {
+        "text": result,
+        "charset": used_charset,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+    }
@@ -0,0 +1,217 @@
+"""
+Очередь исходящих писем
+
+Обработка входящей почты только ставит ответ в очередь (OutboundEmail), а
+отправитель забирает письма пачками и шлёт их через одно SMTP-соединение,
+повторяя неудачные попытки с экспоненциальной задержкой. Письма получают
+In-Reply-To/References, поэтому ответы попадают в ту же цепочку у клиента.
+"""
+import logging
+import time
+from datetime import timedelta
+from email.utils import make_msgid
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from ..metrics import get_metrics
+from ..models import OutboundEmail, Ticket
+from .email_threading import record_reference
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("email_outbox")
+
+
+def reply_subject(original_subject: str) -> str:
+    original_subject = original_subject or ""
+    return original_subject if original_subject.lower().startswith("re:") else f"Re: {original_subject}"
+
+
+def enqueue_email(
+    to_email: str,
+    subject: str,
+    body: str,
+    from_email: str = "",
+    in_reply_to: str = "",
+    references: str = "",
+    ticket: Optional[Ticket] = None,
+) -> OutboundEmail:
+    """Ставит письмо в очередь и сразу возвращает управление"""
+    domain = (from_email or settings.DEFAULT_FROM_EMAIL).rsplit("@", 1)[-1] or None
+    outbound = OutboundEmail.objects.create(
+        ticket=ticket,
+        to_email=to_email,
+        from_email=from_email,
+        subject=subject[:255],
+        body=body,
+        message_id=make_msgid(domain=domain),
+        in_reply_to=in_reply_to or "",
+        references=" ".join((references or "").split()),
+    )
+    if ticket is not None:
+        # Ответ клиента на это письмо найдёт тикет по In-Reply-To
+        record_reference(outbound.message_id, ticket.id)
+    metrics.incr("enqueued")
+    return outbound
+
+
+def enqueue_reply(
+    to_email: str,
+    original_subject: str,
+    body: str,
+    from_email: str = "",
+    original_message_id: str = "",
+    original_references: str = "",
+    ticket: Optional[Ticket] = None,
+) -> OutboundEmail:
+    """Ответ на входящее письмо: тема "Re: ...", In-Reply-To и References по RFC 5322"""
+    references = " ".join(filter(None, [original_references or "", original_message_id or ""]))
+    return enqueue_email(
+        to_email=to_email,
+        subject=reply_subject(original_subject),
+        body=body,
+        from_email=from_email,
+        in_reply_to=original_message_id or "",
+        references=references,
+        ticket=ticket,
+    )
+
+
+class EmailOutboxSender:
+    """Отправляет письма из очереди через переиспользуемое SMTP-соединение"""
+
+    def __init__(self, batch_size: Optional[int] = None, connection=None):
+        self.batch_size = batch_size or getattr(settings, "EMAIL_OUTBOX_BATCH_SIZE", 50)
+        self.max_attempts = getattr(settings, "EMAIL_OUTBOX_MAX_ATTEMPTS", 6)
+        self.retry_base = getattr(settings, "EMAIL_OUTBOX_RETRY_BASE", 30)
+        self.lock_seconds = getattr(settings, "EMAIL_OUTBOX_LOCK_SECONDS", 300)
+        self.poll_interval = getattr(settings, "EMAIL_OUTBOX_POLL_INTERVAL", 2)
+        self.connection = connection or get_connection(fail_silently=False)
+        self._opened = False
+
+    def _claim_batch(self) -> List[OutboundEmail]:
+        """
+        Забирает пачку писем, готовых к отправке. Блокировка - условный UPDATE
+        по locked_until, поэтому несколько отправителей не шлют одно письмо дважды.
+        """
+        now = timezone.now()
+        candidates = list(
+            OutboundEmail.objects.filter(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by("next_attempt_at")
+            .values_list("id", "locked_until")[:self.batch_size]
+        )
+        lock_until = now + timedelta(seconds=self.lock_seconds)
+        claimed_ids = []
+        for outbound_id, previous_lock in candidates:
+            claimed = OutboundEmail.objects.filter(
+                id=outbound_id,
+                status=OutboundEmail.STATUS_PENDING,
+                locked_until=previous_lock,
+            ).update(locked_until=lock_until)
+            if claimed:
+                claimed_ids.append(outbound_id)
+        return list(OutboundEmail.objects.filter(id__in=claimed_ids).order_by("next_attempt_at"))
+
+    def _build_message(self, outbound: OutboundEmail) -> EmailMessage:
+        headers = {"Message-ID": outbound.message_id}
+        if outbound.in_reply_to:
+            headers["In-Reply-To"] = outbound.in_reply_to
+        if outbound.references:
+            headers["References"] = outbound.references
+        return EmailMessage(
+            subject=outbound.subject,
+            body=outbound.body,
+            from_email=outbound.from_email or None,
+            to=[outbound.to_email],
+            headers=headers,
+            connection=self.connection,
+        )
+
+    def _ensure_open(self) -> None:
+        if not self._opened:
+            self.connection.open()
+            self._opened = True
+
+    def close(self) -> None:
+        if self._opened:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self._opened = False
+
+    def send_pending(self) -> int:
+        """Отправляет одну пачку, возвращает число успешно отправленных писем"""
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+
+        sent = 0
+        for outbound in batch:
+            started = time.monotonic()
+            try:
+                self._ensure_open()
+                self.connection.send_messages([self._build_message(outbound)])
+            except Exception as e:
+                # Соединение могло оборваться - следующая попытка откроет новое
+                self.close()
+                self._mark_failed(outbound, e)
+                continue
+            finally:
+                metrics.observe("send_seconds", time.monotonic() - started)
+
+            OutboundEmail.objects.filter(id=outbound.id).update(
+                status=OutboundEmail.STATUS_SENT,
+                sent_at=timezone.now(),
+                attempts=outbound.attempts + 1,
+                locked_until=None,
+                last_error="",
+            )
+            metrics.incr("sent")
+            sent += 1
+
+        logger.info(f"Email outbox: sent {sent}/{len(batch)}")
+        return sent
+
+    def _mark_failed(self, outbound: OutboundEmail, error: Exception) -> None:
+        attempts = outbound.attempts + 1
+        if attempts >= self.max_attempts:
+            status = OutboundEmail.STATUS_FAILED
+            next_attempt_at = outbound.next_attempt_at
+            metrics.incr("failed")
+            logger.error(f"Giving up on email {outbound.id} to {outbound.to_email}: {error}")
+        else:
+            status = OutboundEmail.STATUS_PENDING
+            next_attempt_at = timezone.now() + timedelta(seconds=self.retry_base * 2 ** (attempts - 1))
+            metrics.incr("retried")
+            logger.warning(f"Failed to send email {outbound.id} (attempt {attempts}): {error}")
+
+        OutboundEmail.objects.filter(id=outbound.id).update(
+            status=status,
+            attempts=attempts,
+            next_attempt_at=next_attempt_at,
+            locked_until=None,
+            last_error=str(error)[:1000],
+        )
+
+    def run(self, stop_event) -> None:
+        """Отправляет письма до stop_event; SMTP-соединение держится открытым между пачками"""
+        try:
+            while not stop_event.is_set():
+                try:
+                    sent = self.send_pending()
+                except Exception as e:
+                    logger.error(f"Email outbox error: {e}")
+                    self.close()
+                    sent = 0
+                if not sent:
+                    # Очередь пуста - закрываем соединение, чтобы сервер не рвал его по таймауту
+                    self.close()
+                    stop_event.wait(self.poll_interval)
+        finally:
+            self.close()
@@ -0,0 +1,67 @@
+"""
+Привязка писем к тикетам по цепочке Message-ID / In-Reply-To / References
+"""
+import re
+from typing import List, Optional
+
+from django.db import IntegrityError, transaction
+
+from ..models import EmailReference, Ticket
+
+MESSAGE_ID_RE = re.compile(r"<[^<>\s]+>")
+
+# Длинные цепочки References не нужны целиком: хватает ближайших предков
+MAX_REFERENCES = 20
+
+
+def parse_message_ids(value: Optional[str]) -> List[str]:
+    """Извлекает Message-ID в угловых скобках из заголовка"""
+    if not value:
+        return []
+    return MESSAGE_ID_RE.findall(value)
+
+
+def normalize_message_id(value: Optional[str]) -> str:
+    ids = parse_message_ids(value)
+    if ids:
+        return ids[0]
+    return (value or "").strip()[:255]
+
+
+def resolve_thread(in_reply_to: Optional[str], references: Optional[str]) -> Optional[Ticket]:
+    """
+    Находит тикет цепочки: сначала по In-Reply-To, затем по References от последнего к первому.
+    Один запрос по уникальному индексу message_id.
+    """
+    candidates = parse_message_ids(in_reply_to) + list(reversed(parse_message_ids(references)))
+    candidates = list(dict.fromkeys(candidates))[:MAX_REFERENCES]
+    if not candidates:
+        return None
+
+    found = {
+        ref.message_id: ref.ticket
+        for ref in EmailReference.objects.filter(message_id__in=candidates).select_related("ticket")
+    }
+    for message_id in candidates:
+        if message_id in found:
+            return found[message_id]
+    return None
+
+
+def find_reference(message_id: Optional[str]) -> Optional[EmailReference]:
+    message_id = normalize_message_id(message_id)
+    if not message_id:
+        return None
+    return EmailReference.objects.filter(message_id=message_id).first()
+
+
+def record_reference(message_id: Optional[str], ticket_id: int) -> None:
+    """Запоминает, что письмо с этим Message-ID относится к тикету"""
+    message_id = normalize_message_id(message_id)
+    if not message_id:
+        return
+    try:
+        with transaction.atomic():
+            EmailReference.objects.create(message_id=message_id, ticket_id=ticket_id)
+    except IntegrityError:
+        pass
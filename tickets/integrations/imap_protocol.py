@@ -0,0 +1,235 @@
+"""
+Вспомогательные функции IMAP: разбор ответов FETCH, BODYSTRUCTURE и IDLE
+
+imaplib возвращает ответы FETCH "как есть", поэтому здесь небольшой
+разборщик s-выражений IMAP (RFC 3501) и команда IDLE (RFC 2177),
+которой нет в imaplib до Python 3.14.
+"""
+import base64
+import imaplib
+import quopri
+import select
+import socket
+import ssl
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+Token = Union[bytes, list, None]
+
+
+class _String(bytes):
+    """Строковое значение (quoted или literal {n}), а не синтаксис ответа"""
+
+
+def _tokenize(data: bytes, literals: List[bytes], out: List[Any]) -> None:
+    """Разбивает строку ответа на токены; {n} заменяется очередным literal"""
+    i = 0
+    length = len(data)
+    while i < length:
+        ch = data[i:i + 1]
+        if ch in (b" ", b"\r", b"\n"):
+            i += 1
+        elif ch in (b"(", b")"):
+            out.append(ch)
+            i += 1
+        elif ch == b'"':
+            i += 1
+            buf = bytearray()
+            while i < length and data[i:i + 1] != b'"':
+                if data[i:i + 1] == b"\\":
+                    i += 1
+                buf += data[i:i + 1]
+                i += 1
+            i += 1
+            out.append(_String(buf))
+        elif ch == b"{":
+            end = data.index(b"}", i)
+            out.append(_String(literals.pop(0)) if literals else _String(b""))
+            i = end + 1
+        else:
+            start = i
+            depth = 0
+            while i < length:
+                c = data[i:i + 1]
+                if c == b"[":
+                    depth += 1
+                elif c == b"]":
+                    depth -= 1
+                elif depth == 0 and c in (b" ", b"(", b")"):
+                    break
+                i += 1
+            atom = data[start:i]
+            out.append(None if atom.upper() == b"NIL" else atom)
+
+
+def _build(tokens: List[Any], pos: int) -> Tuple[list, int]:
+    result = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        if token == b"(" and not isinstance(token, _String):
+            child, pos = _build(tokens, pos + 1)
+            result.append(child)
+        elif token == b")" and not isinstance(token, _String):
+            return result, pos + 1
+        else:
+            result.append(token)
+            pos += 1
+    return result, pos
+
+
+def parse_fetch_response(data: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Разбирает ответ imaplib на UID FETCH в список словарей вида
+    {"UID": 101, "BODYSTRUCTURE": [...], "BODY[1]": b"..."}
+    """
+    tokens: List[Any] = []
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            _tokenize(item[0], [item[1]], tokens)
+        else:
+            _tokenize(item, [], tokens)
+
+    tree, _ = _build(tokens, 0)
+
+    messages = []
+    for node in tree:
+        if not isinstance(node, list):
+            continue  # номер сообщения
+        fields: Dict[str, Any] = {}
+        for key, value in zip(node[0::2], node[1::2]):
+            name = key.decode("ascii", "replace").upper() if isinstance(key, bytes) else str(key)
+            # BODY.PEEK[1] возвращается как BODY[1]
+            fields[name.replace("BODY.PEEK[", "BODY[")] = value
+        if "UID" in fields:
+            fields["UID"] = int(fields["UID"])
+        messages.append(fields)
+    return messages
+
+
+def _text(value: Token) -> str:
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return ""
+
+
+def _params(value: Token) -> Dict[str, str]:
+    if not isinstance(value, list):
+        return {}
+    return {_text(k).lower(): _text(v) for k, v in zip(value[0::2], value[1::2])}
+
+
+def walk_bodystructure(structure: list, prefix: str = "") -> List[Dict[str, Any]]:
+    """
+    Возвращает плоский список листовых частей письма:
+    [{"part": "1.2", "type": "text/html", "charset": "utf-8", "encoding": "base64",
+      "size": 1234, "filename": None}, ...]
+    """
+    if not structure:
+        return []
+
+    if isinstance(structure[0], list):
+        parts = []
+        index = 1
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            number = f"{prefix}.{index}" if prefix else str(index)
+            parts.extend(walk_bodystructure(child, number))
+            index += 1
+        return parts
+
+    maintype = _text(structure[0]).lower()
+    subtype = _text(structure[1]).lower()
+    params = _params(structure[2]) if len(structure) > 2 else {}
+    encoding = _text(structure[5]).lower() if len(structure) > 5 else "7bit"
+    try:
+        size = int(structure[6]) if len(structure) > 6 and structure[6] is not None else 0
+    except (TypeError, ValueError):
+        size = 0
+
+    # Disposition для text/* стоит на 10-й позиции, для остальных - на 9-й
+    filename = params.get("name")
+    for item in structure[7:]:
+        if isinstance(item, list) and len(item) == 2 and isinstance(item[0], bytes):
+            disposition_params = _params(item[1])
+            filename = disposition_params.get("filename") or filename
+
+    return [{
+        "part": prefix or "1",
+        "type": f"{maintype}/{subtype}",
+        "charset": params.get("charset"),
+        "encoding": encoding,
+        "size": size,
+        "filename": filename,
+    }]
+
+
+def decode_transfer_encoding(payload: bytes, encoding: str) -> bytes:
+    """Снимает Content-Transfer-Encoding (base64 / quoted-printable)"""
+    encoding = (encoding or "").lower()
+    try:
+        if encoding == "base64":
+            return base64.b64decode(payload, validate=False)
+        if encoding == "quoted-printable":
+            return quopri.decodestring(payload)
+    except (ValueError, TypeError):
+        return b""
+    return payload
+
+
+def _buffered(mail: imaplib.IMAP4) -> bool:
+    """
+    Есть ли уже полученные, но не прочитанные данные: в буфере mail.file (imaplib
+    читает через буферизованный файл) или в TLS-буфере сокета. select() видит только
+    данные в самом сокете, поэтому строку, прочитанную в буфер вместе с ответом "+",
+    без этой проверки заметили бы лишь по таймауту IDLE.
+    """
+    if getattr(mail.sock, "pending", lambda: 0)():
+        return True
+    timeout = mail.sock.gettimeout()
+    mail.sock.settimeout(0)
+    try:
+        # peek() не читает сокет, если в буфере что-то есть; иначе - неблокирующее чтение
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError, socket.timeout):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+
+def idle(mail: imaplib.IMAP4, timeout: float, stop_event=None) -> bool:
+    """
+    Выполняет IDLE до появления новых писем или истечения timeout.
+    Возвращает True, если сервер сообщил о новых письмах.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    response = mail.readline()
+    if not response.startswith(b"+"):
+        raise imaplib.IMAP4.error(f"IDLE not accepted: {response!r}")
+
+    has_news = False
+    deadline = time.monotonic() + timeout
+    try:
+        while not has_news and time.monotonic() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                break
+            if not _buffered(mail):
+                ready, _, _ = select.select([mail.sock], [], [], min(1.0, max(deadline - time.monotonic(), 0)))
+                if not ready:
+                    continue
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            if b"EXISTS" in line or b"RECENT" in line:
+                has_news = True
+    finally:
+        mail.send(b"DONE\r\n")
+        while True:
+            line = mail.readline()
+            if not line or line.startswith(tag):
+                break
+
+    return has_news
@@ -0,0 +1,148 @@
+"""
+Параллельный приём почты из нескольких ящиков
+
+Ящики описываются в Channel(name="email").config:
+
+    {
+        "mailboxes": [
+            {"name": "tech", "address": "tech@telecom.kz", "password_env": "TECH_MAIL_PASSWORD",
+             "server": "imap.telecom.kz", "port": 993, "folder": "INBOX", "department": "technical"},
+            {"name": "billing", "address": "billing@telecom.kz", "password_env": "BILLING_MAIL_PASSWORD",
+             "department": "financial"}
+        ]
+    }
+
+На каждый ящик держится своё IMAP-соединение (поток слушателя) - только на
+узле, который держит аренду ящика (WorkerLease "email:<ящик>"), а разобранные
+письма обрабатываются общим ограниченным пулом. Когда пул занят, слушатели
+ждут освобождения места и не читают ящик дальше (backpressure).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from ..leases import LeaderLease
+from ..metrics import get_metrics
+from ..models import Channel
+from .email_integration import EmailIntegration
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("email")
+
+
+def load_mailboxes() -> List[Dict[str, Any]]:
+    """Ящики из конфигурации email-канала; без неё - один ящик из settings"""
+    channel = Channel.objects.filter(name=Channel.CHANNEL_EMAIL, is_active=True).first()
+    mailboxes = (channel.config or {}).get("mailboxes") if channel else None
+    if mailboxes:
+        return [mailbox for mailbox in mailboxes if mailbox.get("enabled", True)]
+    return [{"name": "default"}]
+
+
+class MailboxSupervisor:
+    """Запускает слушателей ящиков и общий пул обработки писем"""
+
+    def __init__(
+        self,
+        mailboxes: Optional[List[Dict[str, Any]]] = None,
+        workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+    ):
+        self.mailboxes = mailboxes if mailboxes is not None else load_mailboxes()
+        self.workers = workers or getattr(settings, "EMAIL_PROCESSING_WORKERS", 8)
+        self.queue_size = queue_size if queue_size is not None else getattr(settings, "EMAIL_PROCESSING_QUEUE", 16)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="email-worker")
+        # Ограничивает число писем "в работе + в очереди" пула
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self.started_at = time.monotonic()
+
+    def submit(self, fn: Callable[..., Any], *args, mailbox: str = "default") -> Future:
+        """Ставит задачу в пул; блокируется, пока в пуле нет свободного места"""
+        if not self._slots.acquire(blocking=False):
+            metrics.incr("backpressure_waits", mailbox=mailbox)
+            started = time.monotonic()
+            self._slots.acquire()
+            metrics.observe("backpressure_seconds", time.monotonic() - started, mailbox=mailbox)
+
+        self._change_in_flight(1)
+        future = self.executor.submit(self._run, fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    @staticmethod
+    def _run(fn: Callable[..., Any], *args) -> Any:
+        close_old_connections()
+        try:
+            return fn(*args)
+        finally:
+            close_old_connections()
+
+    def _release(self, _future: Future) -> None:
+        self._change_in_flight(-1)
+        self._slots.release()
+
+    def _change_in_flight(self, delta: int) -> None:
+        with self._in_flight_lock:
+            self._in_flight += delta
+            metrics.gauge("in_flight", self._in_flight)
+
+    def _listen(self, mailbox: Dict[str, Any], stop_event: threading.Event) -> None:
+        name = mailbox.get("name", "default")
+        integration = EmailIntegration(
+            mailbox,
+            submit=lambda fn, *args: self.submit(fn, *args, mailbox=name),
+        )
+        # Ящик слушает только один узел; остальные ждут и подхватывают его при сбое
+        lease = LeaderLease(f"email:{integration.mailbox_key}")
+        integration.fence = lease.check
+        try:
+            lease.run_while_leader(stop_event, integration.listen)
+        finally:
+            close_old_connections()
+
+    def start(self, stop_event: threading.Event) -> None:
+        for mailbox in self.mailboxes:
+            thread = threading.Thread(
+                target=self._listen,
+                args=(mailbox, stop_event),
+                name=f"mailbox-{mailbox.get('name', 'default')}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Mailbox supervisor started: {len(self._threads)} mailboxes, {self.workers} workers")
+
+    def run(self, stop_event: threading.Event) -> None:
+        """Запускает слушателей и ждёт stop_event, затем дожидается текущих писем"""
+        self.start(stop_event)
+        stop_event.wait()
+        for thread in self._threads:
+            thread.join(timeout=30)
+        self.executor.shutdown(wait=True)
+
+    def status(self) -> Dict[str, Any]:
+        """Пропускная способность по ящикам с момента запуска"""
+        uptime = max(time.monotonic() - self.started_at, 1e-9)
+        counters = metrics.snapshot()["counters"]
+        mailboxes = {}
+        for mailbox in self.mailboxes:
+            name = mailbox.get("name", "default")
+            processed = counters.get(f"processed{{mailbox={name}}}", 0)
+            mailboxes[name] = {
+                "processed": processed,
+                "failed": counters.get(f"failed{{mailbox={name}}}", 0),
+                "per_second": round(processed / uptime, 3),
+                "backpressure_waits": counters.get(f"backpressure_waits{{mailbox={name}}}", 0),
+            }
+        with self._in_flight_lock:
+            in_flight = self._in_flight
+        return {"uptime_seconds": int(uptime), "in_flight": in_flight, "mailboxes": mailboxes}
@@ -0,0 +1,355 @@
+"""
+Общий клиент Telegram Bot API: пул соединений, лимиты отправки, повторы
+
+Используется и webhook-обработчиком, и polling-скриптом, чтобы оба режима
+соблюдали лимиты Telegram (30 сообщений/с на бота, 1 сообщение/с на чат)
+и переиспользовали keep-alive соединения.
+"""
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from ..metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("telegram")
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Резервирует токен и возвращает, сколько секунд нужно подождать.
+        Запас может уйти в минус - так параллельные отправители встают в очередь.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> float:
+        """Блокирует поток до появления токена, возвращает время ожидания"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    @property
+    def idle(self) -> bool:
+        with self._lock:
+            refilled = self._tokens + (time.monotonic() - self._updated) * self.rate
+            return refilled >= self.capacity
+
+
+# Тег или HTML-сущность: внутри них резать нельзя
+_HTML_TOKEN = re.compile(r"<[^<>]*>|&#?\w+;")
+_HTML_TAG = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^<>]*?(/?)>")
+
+
+def _cut_position(window: str, limit: int) -> int:
+    cut = -1
+    for separator in ("\n\n", "\n", " "):
+        cut = window.rfind(separator)
+        if cut > limit // 2:
+            break
+    return cut if cut > 0 else limit
+
+
+def _outside_markup(text: str, cut: int) -> int:
+    """Сдвигает позицию разреза к началу тега или сущности, если она попала внутрь"""
+    for match in _HTML_TOKEN.finditer(text, max(0, cut - 4096)):
+        if match.start() >= cut:
+            break
+        if match.start() < cut < match.end():
+            return match.start()
+    return cut
+
+
+def _open_tags(fragment: str) -> List[tuple]:
+    """Незакрытые в fragment теги: [(имя, открывающий тег), ...] от внешнего к внутреннему"""
+    stack: List[tuple] = []
+    for match in _HTML_TAG.finditer(fragment):
+        closing, name, self_closing = match.group(1), match.group(2).lower(), match.group(3)
+        if self_closing:
+            continue
+        if not closing:
+            stack.append((name, match.group(0)))
+            continue
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index][0] == name:
+                del stack[index]
+                break
+    return stack
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH, html: bool = False) -> List[str]:
+    """
+    Делит длинный текст на части не длиннее limit.
+    Старается резать по абзацам, затем по строкам, затем по пробелам.
+    С html=True (parse_mode=HTML) не режет теги и сущности: открытые на границе
+    теги закрываются в конце части и открываются заново в начале следующей.
+    """
+    text = text or ""
+    if len(text) <= limit:
+        return [text]
+
+    chunks = []
+    rest = text
+    while len(rest) > limit:
+        if not html:
+            cut = _cut_position(rest[:limit], limit)
+            chunks.append(rest[:cut].rstrip())
+            rest = rest[cut:].lstrip()
+            continue
+
+        budget = limit
+        while True:
+            cut = _outside_markup(rest, _cut_position(rest[:budget], budget))
+            if cut <= 0:
+                cut = budget
+            head = rest[:cut].rstrip()
+            stack = _open_tags(head)
+            closing = "".join(f"</{name}>" for name, _ in reversed(stack))
+            overflow = len(head) + len(closing) - limit
+            if overflow <= 0 or budget <= limit // 2:
+                break
+            budget -= overflow
+        chunks.append(head + closing)
+        rest = "".join(tag for _, tag in stack) + rest[cut:].lstrip()
+    if rest:
+        chunks.append(rest)
+    return chunks
+
+
+class TelegramBotClient:
+    """Потокобезопасный клиент Bot API с общими лимитами на процесс"""
+
+    def __init__(
+        self,
+        token: str,
+        pool_size: int = 16,
+        global_rate: float = 30,
+        per_chat_rate: float = 1,
+        max_retries: int = 3,
+        timeout: float = 10,
+        max_tracked_chats: int = 10000,
+    ):
+        self.token = token
+        self.api_url = f"https://api.telegram.org/bot{token}"
+        self.file_url = f"https://api.telegram.org/file/bot{token}"
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.per_chat_rate = per_chat_rate
+        self.max_tracked_chats = max_tracked_chats
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        self._chat_lock = threading.Lock()
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(self.token)
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        with self._chat_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.per_chat_rate, 1)
+                self._chat_buckets[chat_id] = bucket
+                # Не даём словарю расти бесконечно: выбрасываем простаивающие чаты
+                while len(self._chat_buckets) > self.max_tracked_chats:
+                    oldest_id, oldest = next(iter(self._chat_buckets.items()))
+                    if not oldest.idle:
+                        break
+                    del self._chat_buckets[oldest_id]
+            else:
+                self._chat_buckets.move_to_end(chat_id)
+            return bucket
+
+    def _throttle(self, chat_id: Any) -> None:
+        waited = 0.0
+        if chat_id is not None:
+            waited += self._chat_bucket(chat_id).acquire()
+        waited += self._global_bucket.acquire()
+        if waited:
+            metrics.observe("throttle_wait_seconds", waited)
+
+    def call(
+        self,
+        method: str,
+        payload: Optional[Dict[str, Any]] = None,
+        chat_id: Any = None,
+        timeout: Optional[float] = None,
+    ) -> Optional[Any]:
+        """
+        Вызывает метод Bot API и возвращает поле result.
+        Если передан chat_id, вызов проходит через лимиты отправки.
+        429 ждёт retry_after, сетевые ошибки и 5xx повторяются с backoff.
+        """
+        if not self.token:
+            logger.warning("Telegram bot token not configured")
+            return None
+
+        request_timeout = timeout or self.timeout
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                self._throttle(chat_id)
+
+            started = time.monotonic()
+            try:
+                response = self.session.post(
+                    f"{self.api_url}/{method}",
+                    json=payload or {},
+                    timeout=request_timeout,
+                )
+            except requests.RequestException as e:
+                metrics.incr("errors", method=method, reason="network")
+                logger.warning(f"Telegram {method} failed (attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries:
+                    time.sleep(min(2 ** attempt, 30))
+                    continue
+                return None
+            finally:
+                metrics.observe("request_seconds", time.monotonic() - started, method=method)
+
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+
+            if response.status_code == 200 and data.get("ok"):
+                metrics.incr("requests", method=method)
+                return data.get("result")
+
+            if response.status_code == 429:
+                retry_after = (data.get("parameters") or {}).get("retry_after", 1)
+                metrics.incr("rate_limited", method=method)
+                logger.warning(f"Telegram {method} rate limited, retry after {retry_after}s")
+                if attempt < self.max_retries:
+                    time.sleep(retry_after)
+                    continue
+            elif response.status_code >= 500 and attempt < self.max_retries:
+                metrics.incr("errors", method=method, reason="server")
+                time.sleep(min(2 ** attempt, 30))
+                continue
+
+            metrics.incr("errors", method=method, reason=str(response.status_code))
+            logger.error(f"Telegram {method} error {response.status_code}: {data.get('description', response.text[:200])}")
+            return None
+
+        return None
+
+    def send_message(self, chat_id: Any, text: str, parse_mode: Optional[str] = None) -> bool:
+        """Отправляет сообщение, при необходимости разбивая его на части по 4096 символов"""
+        return self.send_message_ids(chat_id, text, parse_mode) is not None
+
+    def send_message_ids(self, chat_id: Any, text: str, parse_mode: Optional[str] = None) -> Optional[List[int]]:
+        """То же, что send_message, но возвращает message_id отправленных частей (None при ошибке)"""
+        chunks = split_message(text, html=parse_mode == "HTML")
+        if len(chunks) > 1:
+            metrics.incr("split_messages")
+
+        message_ids = []
+        for chunk in chunks:
+            payload: Dict[str, Any] = {"chat_id": chat_id, "text": chunk}
+            if parse_mode:
+                payload["parse_mode"] = parse_mode
+            result = self.call("sendMessage", payload, chat_id=chat_id)
+            if result is None:
+                metrics.incr("send_failed")
+                return None
+            message_ids.append(result.get("message_id") if isinstance(result, dict) else None)
+            metrics.incr("messages_sent")
+        return message_ids
+
+    def get_updates(self, offset: Optional[int] = None, timeout: int = 30) -> List[Dict[str, Any]]:
+        """Long polling getUpdates"""
+        payload: Dict[str, Any] = {"timeout": timeout}
+        if offset is not None:
+            payload["offset"] = offset
+        result = self.call("getUpdates", payload, timeout=timeout + 5)
+        return result or []
+
+    def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        return self.call("getFile", {"file_id": file_id})
+
+    def download_file(self, file_path: str, max_bytes: Optional[int] = None) -> Optional[bytes]:
+        """Скачивает файл по file_path, прерывая загрузку при превышении max_bytes"""
+        started = time.monotonic()
+        try:
+            with self.session.get(f"{self.file_url}/{file_path}", timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    metrics.incr("errors", method="download", reason=str(response.status_code))
+                    return None
+
+                declared = int(response.headers.get("Content-Length") or 0)
+                if max_bytes and declared > max_bytes:
+                    metrics.incr("download_too_large")
+                    return None
+
+                chunks = []
+                size = 0
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    size += len(chunk)
+                    if max_bytes and size > max_bytes:
+                        metrics.incr("download_too_large")
+                        return None
+                    chunks.append(chunk)
+        except requests.RequestException as e:
+            metrics.incr("errors", method="download", reason="network")
+            logger.error(f"Failed to download Telegram file: {e}")
+            return None
+        finally:
+            metrics.observe("request_seconds", time.monotonic() - started, method="download")
+
+        metrics.incr("downloaded_bytes", size)
+        return b"".join(chunks)
+
+    def set_webhook(self, webhook_url: str) -> bool:
+        return self.call("setWebhook", {"url": webhook_url}) is not None
+
+
+_client: Optional[TelegramBotClient] = None
+_client_lock = threading.Lock()
+
+
+def get_telegram_client() -> TelegramBotClient:
+    """Общий на процесс клиент: лимиты и пул соединений действуют для всех потоков"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TelegramBotClient(
+                token=getattr(settings, "TELEGRAM_BOT_TOKEN", ""),
+                pool_size=getattr(settings, "TELEGRAM_POOL_SIZE", 16),
+                global_rate=getattr(settings, "TELEGRAM_GLOBAL_RATE", 30),
+                per_chat_rate=getattr(settings, "TELEGRAM_PER_CHAT_RATE", 1),
+                max_retries=getattr(settings, "TELEGRAM_MAX_RETRIES", 3),
+            )
+        return _client
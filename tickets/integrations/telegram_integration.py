@@ -1,14 +1,16 @@
 """
 Интеграция с Telegram Bot для приёма обращений
 """
-import requests
 import logging
 from typing import Dict, Any, Optional
-from django.conf import settings
 from django.http import JsonResponse, HttpRequest
 from django.views.decorators.csrf import csrf_exempt
+from .. import inbound_bus
 from ..channel_handler import ChannelHandler
-from ..models import Channel
+from ..models import Channel, Message, Ticket
+from ..outbound_dispatcher import enqueue_outbound
+from .telegram_client import get_telegram_client
+from .telegram_media import TelegramMediaFetcher
 
 logger = logging.getLogger(__name__)
 
@@ -17,59 +19,29 @@ class TelegramIntegration:
     """Обработчик Telegram Bot webhook"""
     
     def __init__(self):
-        self.bot_token = getattr(settings, 'TELEGRAM_BOT_TOKEN', '')
-        self.api_url = f"https://api.telegram.org/bot{self.bot_token}"
+        self.client = get_telegram_client()
+        self.bot_token = self.client.token
     
     def send_message(self, chat_id: int, text: str) -> bool:
-        """Отправляет сообщение в Telegram"""
+        """Отправляет сообщение в Telegram (длинные ответы делятся на части)"""
         if not self.bot_token:
             logger.warning("Telegram bot token not configured")
             return False
         
-        try:
-            response = requests.post(
-                f"{self.api_url}/sendMessage",
-                json={
-                    "chat_id": chat_id,
-                    "text": text,
-                    "parse_mode": "HTML"
-                },
-                timeout=10
-            )
-            return response.status_code == 200
-        except Exception as e:
-            logger.error(f"Failed to send Telegram message: {e}")
-            return False
+        return self.client.send_message(chat_id, text, parse_mode="HTML")
     
     def download_photo(self, file_id: str) -> Optional[bytes]:
         """Скачивает фото из Telegram"""
         if not self.bot_token:
             return None
         
-        try:
-            # Получаем информацию о файле
-            response = requests.get(
-                f"{self.api_url}/getFile",
-                params={"file_id": file_id},
-                timeout=10
-            )
-            
-            if response.status_code != 200:
-                return None
-            
-            file_path = response.json()['result']['file_path']
-            
-            # Скачиваем файл
-            file_url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
-            file_response = requests.get(file_url, timeout=10)
-            
-            if file_response.status_code == 200:
-                return file_response.content
-            
-        except Exception as e:
-            logger.error(f"Failed to download Telegram photo: {e}")
+        # Получаем информацию о файле
+        file_info = self.client.get_file(file_id)
+        if not file_info or 'file_path' not in file_info:
+            return None
         
-        return None
+        # Скачиваем файл
+        return self.client.download_file(file_info['file_path'])
     
     def set_webhook(self, webhook_url: str) -> bool:
         """Устанавливает webhook URL для бота"""
@@ -77,16 +49,70 @@ class TelegramIntegration:
             logger.warning("Telegram bot token not configured")
             return False
         
-        try:
-            response = requests.post(
-                f"{self.api_url}/setWebhook",
-                json={"url": webhook_url},
-                timeout=10
-            )
-            return response.status_code == 200
-        except Exception as e:
-            logger.error(f"Failed to set Telegram webhook: {e}")
-            return False
+        return self.client.set_webhook(webhook_url)
+
+
+def publish_update(update: Dict[str, Any]) -> bool:
+    """
+    Ставит апдейт Telegram в очередь входящих. Повторная доставка того же
+    update_id (ретрай webhook) не создаёт второе событие.
+    """
+    message = update.get('message') or update.get('edited_message')
+    if not message:
+        return False
+    
+    # Фото без подписи тоже обращение: классификатор смотрит на изображение
+    text = message.get('text') or message.get('caption') or ''
+    if not text and not message.get('photo'):
+        return False
+    
+    chat_id = message['chat']['id']
+    from_user = message.get('from', {})
+    user_id = from_user.get('id')
+    username = from_user.get('username', f"user_{user_id}")
+    full_name = f"{from_user.get('first_name', '')} {from_user.get('last_name', '')}".strip() or username
+    
+    _event, created = inbound_bus.publish(
+        Channel.CHANNEL_TELEGRAM,
+        str(user_id),
+        {
+            "text": text,
+            "external_id": str(chat_id),
+            "chat_id": chat_id,
+            "photo": message.get('photo') or [],
+            "metadata": {
+                "username": username,
+                "full_name": full_name,
+                "chat_id": chat_id,
+            },
+        },
+        idempotency_key=f"telegram:{update['update_id']}" if 'update_id' in update else None,
+    )
+    return created
+
+
+def process_telegram_event(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Обработка события из очереди: фото скачивается до классификации, затем тикет и ответ AI"""
+    image_data = TelegramMediaFetcher().download(payload['photo']) if payload.get('photo') else None
+    return ChannelHandler.process_event(Channel.CHANNEL_TELEGRAM, payload, image_data=image_data)
+
+
+def deliver_telegram_reply(payload: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """Ответ уходит через очередь доставки (OutboundDispatcher) с повторами"""
+    reply = result.get('reply') or "Извините, произошла ошибка при обработке запроса."
+    ticket = Ticket.objects.select_related('author').get(id=result['ticket_id'])
+    # Ответ AI размечен HTML, как при прямой отправке в webhook
+    enqueue_outbound(
+        ticket,
+        reply,
+        Message.objects.filter(id=result.get('bot_message_id')).first(),
+        parse_mode="HTML",
+    )
+
+
+def notify_telegram_failure(payload: Dict[str, Any]) -> None:
+    """Сообщение не удалось обработать за все попытки - предупреждаем пользователя"""
+    TelegramIntegration().send_message(payload['chat_id'], "Извините, возникла техническая ошибка. Попробуйте позже.")
 
 
 @csrf_exempt
@@ -94,6 +120,9 @@ def telegram_webhook(request: HttpRequest) -> JsonResponse:
     """
     Webhook endpoint для Telegram Bot
     URL: /tickets/api/telegram/webhook/
+    
+    Апдейт только записывается в очередь входящих, ответ отправляет потребитель
+    (manage.py process_inbound), поэтому Telegram получает 200 сразу.
     """
     if request.method != 'POST':
         return JsonResponse({"error": "Method not allowed"}, status=405)
@@ -101,51 +130,7 @@ def telegram_webhook(request: HttpRequest) -> JsonResponse:
     try:
         import json
         data = json.loads(request.body)
-        
-        # Проверяем наличие сообщения
-        if 'message' not in data:
-            return JsonResponse({"ok": True})
-        
-        message = data['message']
-        chat_id = message['chat']['id']
-        user_id = message['from']['id']
-        username = message['from'].get('username', f"user_{user_id}")
-        full_name = f"{message['from'].get('first_name', '')} {message['from'].get('last_name', '')}".strip()
-        
-        # Получаем текст сообщения
-        text = message.get('text', message.get('caption', ''))
-        
-        if not text:
-            return JsonResponse({"ok": True})
-        
-        # Получаем фото если есть
-        image_data = None
-        if 'photo' in message:
-            # Берём фото наибольшего размера
-            photo = message['photo'][-1]
-            file_id = photo['file_id']
-            
-            telegram = TelegramIntegration()
-            image_data = telegram.download_photo(file_id)
-        
-        # Обрабатываем через единый обработчик
-        result = ChannelHandler.process_incoming_message(
-            channel=Channel.CHANNEL_TELEGRAM,
-            user_identifier=str(user_id),
-            text=text,
-            image_data=image_data,
-            external_id=str(chat_id),
-            metadata={
-                "username": username,
-                "full_name": full_name,
-                "chat_id": chat_id,
-            }
-        )
-        
-        # Отправляем ответ в Telegram
-        telegram = TelegramIntegration()
-        telegram.send_message(chat_id, result['reply'])
-        
+        publish_update(data)
         return JsonResponse({"ok": True})
         
     except Exception as e:
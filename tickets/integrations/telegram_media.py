@@ -0,0 +1,109 @@
+"""
+Загрузка фото из Telegram для классификации обращения
+
+Выбирает минимальный размер фото, достаточный для классификации, скачивает
+его через общий клиент с ограничением по размеру и кэширует по file_unique_id.
+Вызывается потребителем очереди входящих до обработки сообщения, поэтому
+webhook не ждёт загрузки, а классификатор получает изображение.
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError
+
+from ..metrics import get_metrics
+from ..models import TelegramMedia
+from .telegram_client import TelegramBotClient, get_telegram_client
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("telegram_media")
+
+
+def select_photo_size(sizes: List[Dict[str, Any]], target_side: int) -> Optional[Dict[str, Any]]:
+    """
+    Возвращает самый маленький PhotoSize, у которого меньшая сторона не меньше target_side.
+    Если такого нет - самый большой из доступных.
+    """
+    if not sizes:
+        return None
+
+    def area(size: Dict[str, Any]) -> int:
+        return size.get("width", 0) * size.get("height", 0)
+
+    suitable = [
+        size for size in sizes
+        if min(size.get("width", 0), size.get("height", 0)) >= target_side
+    ]
+    if suitable:
+        return min(suitable, key=area)
+    return max(sizes, key=area)
+
+
+class TelegramMediaFetcher:
+    """Скачивает и кэширует фото из Telegram"""
+
+    def __init__(self, client: Optional[TelegramBotClient] = None):
+        self.client = client or get_telegram_client()
+        self.target_side = getattr(settings, "TELEGRAM_PHOTO_TARGET_SIDE", 800)
+        self.max_bytes = getattr(settings, "TELEGRAM_MEDIA_MAX_BYTES", 5 * 1024 * 1024)
+
+    def fetch(self, photo: Dict[str, Any]) -> Optional[TelegramMedia]:
+        """Возвращает закэшированный файл или скачивает его"""
+        unique_id = photo.get("file_unique_id") or photo["file_id"]
+
+        cached = TelegramMedia.objects.filter(file_unique_id=unique_id).first()
+        if cached:
+            metrics.incr("cache_hits")
+            return cached
+        metrics.incr("cache_misses")
+
+        if photo.get("file_size") and photo["file_size"] > self.max_bytes:
+            metrics.incr("skipped_too_large")
+            return None
+
+        file_info = self.client.get_file(photo["file_id"])
+        if not file_info or "file_path" not in file_info:
+            return None
+
+        content = self.client.download_file(file_info["file_path"], max_bytes=self.max_bytes)
+        if content is None:
+            return None
+
+        extension = file_info["file_path"].rsplit(".", 1)[-1] if "." in file_info["file_path"] else "jpg"
+        media = TelegramMedia(
+            file_unique_id=unique_id,
+            file_id=photo["file_id"],
+            width=photo.get("width"),
+            height=photo.get("height"),
+            size=len(content),
+        )
+        try:
+            media.file.save(f"{unique_id}.{extension}", ContentFile(content), save=True)
+        except IntegrityError:
+            # Тот же файл параллельно скачал другой поток
+            media.file.delete(save=False)
+            return TelegramMedia.objects.filter(file_unique_id=unique_id).first()
+
+        metrics.incr("downloaded")
+        return media
+
+    def download(self, sizes: List[Dict[str, Any]]) -> Optional[bytes]:
+        """Содержимое подходящего размера фото (из кэша или скачанное) или None"""
+        photo = select_photo_size(sizes, self.target_side)
+        if photo is None:
+            return None
+        try:
+            media = self.fetch(photo)
+            if media is None:
+                metrics.incr("fetch_failed")
+                return None
+            with media.file.open("rb") as f:
+                return f.read()
+        except Exception as e:
+            # Без фото сообщение всё равно обрабатывается - по тексту
+            metrics.incr("fetch_failed")
+            logger.error(f"Failed to fetch Telegram photo {photo.get('file_id')}: {e}")
+            return None
@@ -0,0 +1,74 @@
+"""
+Long polling Telegram (getUpdates) для окружений без публичного webhook
+
+Апдейты только записываются в очередь входящих (publish_update), ответы
+отправляет потребитель очереди. getUpdates вызывает только узел, который держит
+аренду "telegram:poller"; offset хранится в состоянии аренды, поэтому резервный
+узел продолжает с того же места.
+"""
+import logging
+from typing import Optional
+
+from django.db import close_old_connections
+
+from ..leases import LeaderLease
+from .telegram_client import TelegramBotClient, get_telegram_client
+from .telegram_integration import publish_update
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramPoller:
+    """Читает апдейты бота и складывает их в очередь входящих"""
+
+    LEASE_NAME = "telegram:poller"
+
+    def __init__(self, client: Optional[TelegramBotClient] = None, poll_timeout: int = 30):
+        self.client = client or get_telegram_client()
+        self.poll_timeout = poll_timeout
+        self.offset: Optional[int] = None
+        self.lease = LeaderLease(self.LEASE_NAME)
+
+    def poll_once(self) -> int:
+        """Один запрос getUpdates; возвращает число новых событий в очереди"""
+        published = 0
+        for update in self.client.get_updates(offset=self.offset, timeout=self.poll_timeout):
+            try:
+                if publish_update(update):
+                    published += 1
+            except Exception as e:
+                # offset не сдвигаем: Telegram отдаст этот апдейт снова
+                logger.error(f"Failed to store Telegram update {update.get('update_id')}: {e}")
+                break
+            self.offset = update["update_id"] + 1
+        return published
+
+    def run(self, stop_event) -> None:
+        """Ждёт аренду роли и опрашивает Telegram, пока она удерживается, до stop_event"""
+        if not self.client.is_configured:
+            raise RuntimeError("TELEGRAM_BOT_TOKEN is not configured")
+
+        try:
+            self.lease.run_while_leader(stop_event, self._poll_as_leader)
+        finally:
+            close_old_connections()
+
+    def _poll_as_leader(self, leader_stop) -> None:
+        self.offset = self.lease.load_state().get("offset")
+        logger.info(f"Telegram poller is leader (offset {self.offset})")
+        while not leader_stop.is_set():
+            close_old_connections()
+            previous_offset = self.offset
+            try:
+                published = self.poll_once()
+                if published:
+                    logger.info(f"Telegram poller: {published} updates queued")
+            except Exception as e:
+                logger.error(f"Telegram poller error: {e}")
+                leader_stop.wait(5)
+                continue
+            if self.offset != previous_offset:
+                # Запись с устаревшим fencing token отклоняется (LeaseLost)
+                self.lease.save_state({"offset": self.offset})
+            # Небольшая пауза, чтобы не крутить цикл слишком часто
+            leader_stop.wait(1)
@@ -0,0 +1,147 @@
+"""
+Клиент WhatsApp Cloud API: пул соединений, лимит отправки, повторы
+
+Отправка идёт через POST {WHATSAPP_API_BASE}/{phone_number_id}/messages.
+Для локальной проверки WHATSAPP_API_BASE можно направить на стенд
+(python manage.py whatsapp_standin).
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from ..metrics import get_metrics
+from .telegram_client import TokenBucket, split_message
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("whatsapp")
+
+MAX_TEXT_LENGTH = 4096
+
+# Коды ошибок Cloud API, после которых имеет смысл повторить запрос позже
+RETRYABLE_ERROR_CODES = {4, 80007, 130429, 131016, 131048, 131056}
+
+
+class WhatsAppError(Exception):
+    def __init__(self, message: str, code: Optional[int] = None, retryable: bool = False):
+        super().__init__(message)
+        self.code = code
+        self.retryable = retryable
+
+
+class WhatsAppClient:
+    """Потокобезопасный клиент Cloud API с общим лимитом на процесс"""
+
+    def __init__(
+        self,
+        token: str,
+        phone_number_id: str,
+        api_base: str = "https://graph.facebook.com/v19.0",
+        pool_size: int = 32,
+        rate: float = 80,
+        max_retries: int = 3,
+        timeout: float = 10,
+    ):
+        self.token = token
+        self.phone_number_id = phone_number_id
+        self.messages_url = f"{api_base.rstrip('/')}/{phone_number_id}/messages"
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._bucket = TokenBucket(rate, rate)
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(self.token and self.phone_number_id)
+
+    def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST с повторами: 429/5xx/сетевые ошибки - с backoff, остальные ошибки сразу"""
+        for attempt in range(self.max_retries + 1):
+            waited = self._bucket.acquire()
+            if waited:
+                metrics.observe("throttle_wait_seconds", waited)
+
+            started = time.monotonic()
+            try:
+                response = self.session.post(self.messages_url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                metrics.incr("errors", reason="network")
+                if attempt < self.max_retries:
+                    time.sleep(min(2 ** attempt, 30))
+                    continue
+                raise WhatsAppError(f"network error: {e}", retryable=True)
+            finally:
+                metrics.observe("request_seconds", time.monotonic() - started)
+
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+
+            if response.status_code == 200:
+                metrics.incr("requests")
+                return data
+
+            error = data.get("error") or {}
+            code = error.get("code")
+            retryable = response.status_code == 429 or response.status_code >= 500 or code in RETRYABLE_ERROR_CODES
+            metrics.incr("errors", reason=str(code or response.status_code))
+            if retryable and attempt < self.max_retries:
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            raise WhatsAppError(
+                f"WhatsApp API error {response.status_code}: {error.get('message', response.text[:200])}",
+                code=code,
+                retryable=retryable,
+            )
+
+        raise WhatsAppError("retries exhausted", retryable=True)
+
+    def send_text(self, to: str, text: str) -> List[str]:
+        """Отправляет текст (длинный - частями), возвращает wamid отправленных сообщений"""
+        if not self.is_configured:
+            raise WhatsAppError("WhatsApp is not configured")
+
+        message_ids = []
+        for chunk in split_message(text, MAX_TEXT_LENGTH):
+            data = self._post({
+                "messaging_product": "whatsapp",
+                "recipient_type": "individual",
+                "to": to,
+                "type": "text",
+                "text": {"body": chunk},
+            })
+            message_ids.extend(message["id"] for message in data.get("messages", []) if message.get("id"))
+            metrics.incr("messages_sent")
+        return message_ids
+
+
+_client: Optional[WhatsAppClient] = None
+_client_lock = threading.Lock()
+
+
+def get_whatsapp_client() -> WhatsAppClient:
+    """Общий на процесс клиент: лимит и пул соединений действуют для всех потоков"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = WhatsAppClient(
+                token=getattr(settings, "WHATSAPP_TOKEN", ""),
+                phone_number_id=getattr(settings, "WHATSAPP_PHONE_NUMBER_ID", ""),
+                api_base=getattr(settings, "WHATSAPP_API_BASE", "https://graph.facebook.com/v19.0"),
+                pool_size=getattr(settings, "WHATSAPP_POOL_SIZE", 32),
+                rate=getattr(settings, "WHATSAPP_RATE", 80),
+                max_retries=getattr(settings, "WHATSAPP_MAX_RETRIES", 3),
+            )
+        return _client
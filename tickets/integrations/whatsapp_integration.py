@@ -0,0 +1,288 @@
+"""
+Интеграция с WhatsApp Cloud API
+
+Webhook принимает пакеты из нескольких entry/changes: входящие сообщения
+одним INSERT записываются в очередь входящих (inbound_bus.publish_many), а
+статусы доставки (sent/delivered/read/failed) - одним событием той же очереди
+до ответа 200; потребитель применяет их к OutboundMessage пакетными UPDATE.
+Подпись X-Hub-Signature-256 проверяется по WHATSAPP_APP_SECRET, без него
+webhook отклоняется.
+"""
+import hashlib
+import hmac
+import json
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+from django.db.models import Case, CharField, DateTimeField, F, Value, When
+from django.db.models.functions import Coalesce
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from .. import inbound_bus
+from ..channel_handler import ChannelHandler
+from ..metrics import get_metrics
+from ..models import Channel, Message, OutboundMessage, OutboundMessagePart, Ticket
+from ..outbound_dispatcher import enqueue_outbound
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("whatsapp")
+
+# Статус может только расти: поздний "delivered" не затирает "read"
+STATUS_RANKS = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+
+def verify_signature(body: bytes, signature_header: str, app_secret: str) -> bool:
+    """Проверяет X-Hub-Signature-256: sha256=<hex HMAC тела запроса>"""
+    if not signature_header or not signature_header.startswith("sha256="):
+        return False
+    expected = hmac.new(app_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len("sha256="):])
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    message_type = message.get("type")
+    if message_type == "text":
+        return (message.get("text") or {}).get("body", "")
+    if message_type in ("image", "video", "document"):
+        return (message.get(message_type) or {}).get("caption", "")
+    if message_type == "button":
+        return (message.get("button") or {}).get("text", "")
+    if message_type == "interactive":
+        interactive = message.get("interactive") or {}
+        reply = interactive.get("button_reply") or interactive.get("list_reply") or {}
+        return reply.get("title", "")
+    return ""
+
+
+def parse_webhook(data: Dict[str, Any]) -> Tuple[List[Tuple[str, Dict[str, Any], str]], List[Dict[str, Any]]]:
+    """
+    Разбирает webhook: возвращает (сообщения для publish_many, статусы).
+    Сообщения упорядочены по timestamp, чтобы очередь сохранила порядок диалога.
+    """
+    messages: List[Tuple[int, str, Dict[str, Any], str]] = []
+    statuses: List[Dict[str, Any]] = []
+
+    for entry in data.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            names = {
+                contact.get("wa_id"): (contact.get("profile") or {}).get("name", "")
+                for contact in value.get("contacts") or []
+            }
+            phone_number_id = (value.get("metadata") or {}).get("phone_number_id", "")
+
+            for message in value.get("messages") or []:
+                text = _message_text(message)
+                wa_id = message.get("from")
+                if not text or not wa_id:
+                    metrics.incr("skipped_messages", type=message.get("type", "unknown"))
+                    continue
+                messages.append((
+                    int(message.get("timestamp") or 0),
+                    wa_id,
+                    {
+                        "text": text,
+                        "external_id": wa_id,
+                        "wa_message_id": message.get("id"),
+                        "metadata": {
+                            "full_name": names.get(wa_id) or wa_id,
+                            "phone": wa_id,
+                            "phone_number_id": phone_number_id,
+                        },
+                    },
+                    f"whatsapp:{message.get('id')}" if message.get("id") else None,
+                ))
+
+            statuses.extend(value.get("statuses") or [])
+
+    messages.sort(key=lambda item: item[0])
+    return [(wa_id, payload, key) for _, wa_id, payload, key in messages], statuses
+
+
+def _timestamp(value: Any) -> datetime:
+    try:
+        return datetime.fromtimestamp(int(value), tz=dt_timezone.utc)
+    except (TypeError, ValueError):
+        return datetime.now(tz=dt_timezone.utc)
+
+
+def _case(values: Dict[str, Any], output_field) -> Case:
+    return Case(
+        *[When(provider_message_id=key, then=Value(value)) for key, value in values.items()],
+        output_field=output_field,
+    )
+
+
+def _merge_statuses(statuses: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Статусы одного сообщения сливаются в самый "старший" с временем каждого этапа"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for status in statuses:
+        wamid, name = status.get("id"), status.get("status")
+        if not wamid or name not in STATUS_RANKS:
+            continue
+        item = merged.setdefault(wamid, {"status": name, "timestamps": {}, "error": ""})
+        item["timestamps"].setdefault(name, _timestamp(status.get("timestamp")))
+        if STATUS_RANKS[name] > STATUS_RANKS[item["status"]]:
+            item["status"] = name
+        if name == "failed":
+            errors = status.get("errors") or [{}]
+            item["error"] = f"{errors[0].get('code', '')} {errors[0].get('title', '')}".strip()
+    return merged
+
+
+def _by_message(statuses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Статус части длинного сообщения относится к сообщению: wamid части -> wamid первой части"""
+    wamids = {status.get("id") for status in statuses if status.get("id")}
+    primary = dict(
+        OutboundMessagePart.objects.filter(provider_message_id__in=wamids)
+        .exclude(outbound__provider_message_id="")
+        .values_list("provider_message_id", "outbound__provider_message_id")
+    )
+    return [dict(status, id=primary.get(status.get("id"), status.get("id"))) for status in statuses]
+
+
+class UnmatchedStatuses(Exception):
+    """Статус пришёл раньше, чем диспетчер сохранил provider_message_id: событие повторяется"""
+
+
+def apply_statuses(statuses: List[Dict[str, Any]]) -> int:
+    """
+    Применяет статусы одного webhook: на каждый вид статуса - один UPDATE с
+    CASE по provider_message_id. Возвращает число затронутых строк.
+
+    Статус сообщения, которого ещё нет в OutboundMessage, поднимает
+    UnmatchedStatuses, и очередь входящих повторит событие с задержкой
+    (повтор уже применённых статусов ничего не меняет - статус не понижается).
+    Статусы старше WHATSAPP_STATUS_MATCH_WINDOW секунд без сообщения - чужие
+    (отправлены не через диспетчер) и отбрасываются.
+    """
+    pending = _merge_statuses(_by_message(statuses))
+    if not pending:
+        return 0
+
+    by_status: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for wamid, item in pending.items():
+        by_status.setdefault(item["status"], {})[wamid] = item
+
+    updated = 0
+    for name, items in by_status.items():
+        lower = [status for status, rank in STATUS_RANKS.items() if rank < STATUS_RANKS[name]] + [""]
+        rows = OutboundMessage.objects.filter(provider_message_id__in=list(items), provider_status__in=lower)
+        fields: Dict[str, Any] = {"provider_status": name}
+        delivered = {
+            wamid: item["timestamps"].get("delivered") or item["timestamps"].get("read")
+            for wamid, item in items.items()
+            if "delivered" in item["timestamps"] or "read" in item["timestamps"]
+        }
+        if delivered:
+            fields["delivered_at"] = Coalesce(F("delivered_at"), _case(delivered, DateTimeField()))
+        read = {wamid: item["timestamps"]["read"] for wamid, item in items.items() if "read" in item["timestamps"]}
+        if read:
+            fields["read_at"] = Coalesce(F("read_at"), _case(read, DateTimeField()))
+        if name == "failed":
+            fields["status"] = OutboundMessage.STATUS_FAILED
+            fields["last_error"] = _case({wamid: item["error"] for wamid, item in items.items()}, CharField())
+        updated += rows.update(**fields)
+
+    metrics.incr("status_updates", updated)
+    metrics.observe("status_batch_size", len(pending))
+
+    known = set(
+        OutboundMessage.objects.filter(provider_message_id__in=list(pending)).values_list("provider_message_id", flat=True)
+    )
+    unmatched = [wamid for wamid in pending if wamid not in known]
+    if unmatched:
+        window = getattr(settings, "WHATSAPP_STATUS_MATCH_WINDOW", 60)
+        cutoff = datetime.now(tz=dt_timezone.utc) - timedelta(seconds=window)
+        recent = [wamid for wamid in unmatched if max(pending[wamid]["timestamps"].values()) >= cutoff]
+        metrics.incr("unmatched_statuses", len(unmatched) - len(recent))
+        if recent:
+            raise UnmatchedStatuses(f"{len(recent)} WhatsApp statuses for unknown messages, e.g. {recent[0]}")
+    return updated
+
+
+def publish_statuses(statuses: List[Dict[str, Any]], body: bytes) -> bool:
+    """
+    Записывает статусы webhook в очередь входящих до ответа Cloud API: статусы
+    переживают перезапуск и сбой применения. Каждый webhook - отдельный
+    диалог очереди, чтобы повторы одного не задерживали остальные; повторная
+    доставка того же тела отсекается по его хэшу.
+    """
+    digest = hashlib.sha256(body).hexdigest()
+    _event, created = inbound_bus.publish(
+        Channel.CHANNEL_WHATSAPP,
+        f"status:{digest}",
+        {"statuses": statuses},
+        idempotency_key=f"whatsapp-status:{digest}",
+        screen=False,
+    )
+    metrics.incr("statuses_received", len(statuses))
+    return created
+
+
+def process_whatsapp_event(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Событие очереди: статусы доставки или входящее сообщение"""
+    if "statuses" in payload:
+        return {"status_updates": apply_statuses(payload["statuses"])}
+    return ChannelHandler.process_event(Channel.CHANNEL_WHATSAPP, payload)
+
+
+def deliver_whatsapp_reply(payload: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """Ответ AI уходит через очередь доставки (OutboundDispatcher)"""
+    if 'ticket_id' not in result:
+        return
+    ticket = Ticket.objects.select_related('author').get(id=result['ticket_id'])
+    enqueue_outbound(ticket, result['reply'], Message.objects.filter(id=result.get('bot_message_id')).first())
+
+
+@csrf_exempt
+def whatsapp_webhook(request: HttpRequest) -> HttpResponse:
+    """
+    Webhook endpoint для WhatsApp Cloud API
+    URL: /tickets/api/whatsapp/webhook/
+
+    GET - подтверждение подписки (hub.verify_token), POST - сообщения и статусы.
+    """
+    if request.method == 'GET':
+        verify_token = getattr(settings, 'WHATSAPP_VERIFY_TOKEN', '')
+        if (
+            verify_token
+            and request.GET.get('hub.mode') == 'subscribe'
+            and hmac.compare_digest(request.GET.get('hub.verify_token', ''), verify_token)
+        ):
+            return HttpResponse(request.GET.get('hub.challenge', ''), content_type='text/plain')
+        return HttpResponse(status=403)
+
+    if request.method != 'POST':
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    # Без секрета подпись не проверить - webhook не принимается и при DEBUG
+    app_secret = getattr(settings, 'WHATSAPP_APP_SECRET', '')
+    if not app_secret:
+        logger.error("WHATSAPP_APP_SECRET is not configured, rejecting webhook")
+        return JsonResponse({"error": "Webhook is not configured"}, status=403)
+    if not verify_signature(request.body, request.headers.get('X-Hub-Signature-256', ''), app_secret):
+        metrics.incr("invalid_signatures")
+        return JsonResponse({"error": "Invalid signature"}, status=403)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    try:
+        messages, statuses = parse_webhook(data)
+        queued = inbound_bus.publish_many(Channel.CHANNEL_WHATSAPP, messages)
+        if statuses:
+            publish_statuses(statuses, request.body)
+    except Exception as e:
+        # 500 - Cloud API повторит доставку webhook, дубликаты отсекаются по wamid
+        logger.error(f"WhatsApp webhook error: {e}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+    metrics.incr("webhooks")
+    return JsonResponse({"ok": True, "queued": queued, "statuses": len(statuses)})
@@ -0,0 +1,211 @@
+"""
+Локальный стенд WhatsApp Cloud API для проверки без Meta
+
+- принимает POST /<version>/<phone_number_id>/messages и возвращает wamid,
+  как настоящий Cloud API (WHATSAPP_API_BASE=http://127.0.0.1:<port>/v19.0);
+- на каждое отправленное сообщение шлёт в webhook статусы sent/delivered/read,
+  собирая их в пакетные подписанные webhook'и;
+- умеет генерировать нагрузку: пакеты входящих сообщений от многих отправителей.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Сколько статусов и сообщений помещается в один webhook
+WEBHOOK_BATCH = 100
+
+
+def sign(body: bytes, app_secret: str) -> str:
+    return "sha256=" + hmac.new(app_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def new_wamid() -> str:
+    return f"wamid.{uuid.uuid4().hex}"
+
+
+def build_webhook(
+    phone_number_id: str,
+    messages: Optional[List[Tuple[str, str]]] = None,
+    statuses: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """Тело webhook в формате Cloud API: messages - список (wa_id, текст)"""
+    now = str(int(time.time()))
+    value: Dict[str, Any] = {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": phone_number_id, "phone_number_id": phone_number_id},
+    }
+    if messages:
+        value["contacts"] = [
+            {"wa_id": wa_id, "profile": {"name": f"Клиент {wa_id[-4:]}"}}
+            for wa_id in dict.fromkeys(wa_id for wa_id, _ in messages)
+        ]
+        value["messages"] = [
+            {"from": wa_id, "id": new_wamid(), "timestamp": now, "type": "text", "text": {"body": text}}
+            for wa_id, text in messages
+        ]
+    if statuses:
+        value["statuses"] = statuses
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": phone_number_id, "changes": [{"field": "messages", "value": value}]}],
+    }
+
+
+class WhatsAppStandIn:
+    """HTTP-сервер, изображающий Cloud API, и отправитель webhook'ов"""
+
+    def __init__(
+        self,
+        webhook_url: str,
+        app_secret: str = "",
+        host: str = "127.0.0.1",
+        port: int = 8790,
+        phone_number_id: str = "standin",
+        statuses: Tuple[str, ...] = ("sent", "delivered", "read"),
+        status_delay: float = 0.5,
+        error_rate: float = 0.0,
+    ):
+        self.webhook_url = webhook_url
+        self.app_secret = app_secret
+        self.phone_number_id = phone_number_id
+        self.statuses = statuses
+        self.status_delay = status_delay
+        self.error_rate = error_rate
+
+        self.sent: List[Dict[str, Any]] = []
+        self._status_queue: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._session = requests.Session()
+
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v19.0"
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                parts = self.path.strip("/").split("/")
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    payload = None
+                if len(parts) != 3 or parts[2] != "messages" or not payload:
+                    return self._reply(400, {"error": {"code": 100, "message": "Invalid request"}})
+                if not self.headers.get("Authorization", "").startswith("Bearer "):
+                    return self._reply(401, {"error": {"code": 190, "message": "Invalid OAuth access token"}})
+                if standin.error_rate and random.random() < standin.error_rate:
+                    return self._reply(429, {"error": {"code": 130429, "message": "Rate limit hit"}})
+                return self._reply(200, standin.accept(payload))
+
+            def _reply(self, status: int, data: Dict[str, Any]):
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("standin: " + format, *args)
+
+        return Handler
+
+    def accept(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Регистрирует отправку и планирует статусы для неё"""
+        wamid = new_wamid()
+        recipient = payload.get("to", "")
+        now = int(time.time())
+        with self._lock:
+            self.sent.append({"id": wamid, "to": recipient, "text": (payload.get("text") or {}).get("body", "")})
+            for offset, status in enumerate(self.statuses):
+                self._status_queue.append({
+                    "id": wamid,
+                    "status": status,
+                    "timestamp": str(now + offset),
+                    "recipient_id": recipient,
+                })
+        return {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": recipient, "wa_id": recipient}],
+            "messages": [{"id": wamid}],
+        }
+
+    def post_webhook(self, data: Dict[str, Any]) -> int:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.app_secret:
+            headers["X-Hub-Signature-256"] = sign(body, self.app_secret)
+        response = self._session.post(self.webhook_url, data=body, headers=headers, timeout=30)
+        return response.status_code
+
+    def flush_statuses(self) -> int:
+        with self._lock:
+            statuses, self._status_queue = self._status_queue, []
+        for start in range(0, len(statuses), WEBHOOK_BATCH):
+            batch = statuses[start:start + WEBHOOK_BATCH]
+            status_code = self.post_webhook(build_webhook(self.phone_number_id, statuses=batch))
+            if status_code != 200:
+                logger.warning(f"Status webhook returned {status_code}")
+        return len(statuses)
+
+    def _status_loop(self) -> None:
+        while not self._stop.wait(self.status_delay):
+            try:
+                self.flush_statuses()
+            except requests.RequestException as e:
+                logger.warning(f"Status webhook failed: {e}")
+
+    def load(self, total: int, senders: int = 100, batch_size: int = 50) -> Dict[str, float]:
+        """Шлёт total входящих сообщений от senders отправителей пакетами по batch_size"""
+        wa_ids = [f"7700{index:07d}" for index in range(senders)]
+        started = time.monotonic()
+        rejected = 0
+        for start in range(0, total, batch_size):
+            messages = [
+                (wa_ids[index % senders], f"Нагрузочное сообщение №{index}")
+                for index in range(start, min(start + batch_size, total))
+            ]
+            if self.post_webhook(build_webhook(self.phone_number_id, messages=messages)) != 200:
+                rejected += len(messages)
+        elapsed = time.monotonic() - started
+        return {
+            "messages": total,
+            "rejected": rejected,
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(total / elapsed, 1) if elapsed else 0.0,
+        }
+
+    def start(self) -> None:
+        for target in (self.server.serve_forever, self._status_loop):
+            thread = threading.Thread(target=target, name="whatsapp-standin", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            self.flush_statuses()
+        except requests.RequestException:
+            pass
@@ -0,0 +1,149 @@
+"""
+Определение языка сообщения (ru/kk/en) по символьным n-граммам
+
+Профили строятся один раз на процесс из небольших корпусов в tickets/data/langid
+(типичные обращения в поддержку, для казахского - в том числе без специальных
+букв, как часто пишут с телефона). Русский и казахский транслитом - отдельные
+профили ru-latn и kk-latn: в общем профиле с кириллицей латиница размывала бы
+его, а без них транслит похож только на английский.
+
+Определение - средний на n-грамму логарифм вероятности 1-3-грамм с аддитивным
+сглаживанием; уверенность - softmax по профилям с множителем CALIBRATION,
+вероятности профилей одного языка складываются. Среднее, а не сумма: softmax
+суммы по всему тексту уже на десятке букв даёт ~1.0 даже при почти равных
+языках. Короткие и неоднозначные тексты помечаются как ненадёжные, и
+вызывающий код оставляет язык, известный ранее. Проверка на отложенных
+примерах (samples.tsv): python manage.py check_langid.
+"""
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from .metrics import get_metrics
+
+metrics = get_metrics("langid")
+
+LANGUAGES = ("ru", "kk", "en")
+# Корпус <профиль>.txt; язык профиля - часть имени до дефиса
+PROFILES = ("ru", "kk", "en", "ru-latn", "kk-latn")
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "data", "langid")
+MAX_ORDER = 3
+# Для определения языка хватает начала сообщения
+MAX_CHARS = 300
+SMOOTHING = 0.5
+# Множитель среднего логарифма на n-грамму, подобран по samples.tsv: обычные
+# фразы на всех трёх языках (и транслит) проходят LANGID_MIN_CONFIDENCE=0.9,
+# одиночные общие слова ("internet", "router") - нет
+CALIBRATION = 4.0
+
+NON_LETTERS_RE = re.compile(r"[^\w]+|[\d_]+")
+
+
+class Detection:
+    """Результат определения: язык, уверенность (0..1) и достаточно ли её"""
+
+    def __init__(self, language: str, confidence: float, reliable: bool):
+        self.language = language
+        self.confidence = confidence
+        self.reliable = reliable
+
+    def __repr__(self) -> str:
+        return f"Detection({self.language}, {self.confidence:.3f}, reliable={self.reliable})"
+
+
+def _ngrams(text: str):
+    for word in NON_LETTERS_RE.sub(" ", text.lower()).split():
+        padded = f" {word} "
+        for order in range(1, MAX_ORDER + 1):
+            for start in range(len(padded) - order + 1):
+                gram = padded[start:start + order]
+                if gram != " ":
+                    yield gram
+
+
+class NgramProfile:
+    """Логарифмы вероятностей n-грамм одного языка; неизвестная n-грамма - сглаженная оценка"""
+
+    def __init__(self, counts: Counter, vocabulary_size: int):
+        total = sum(counts.values())
+        denominator = total + SMOOTHING * vocabulary_size
+        self.log_probs: Dict[str, float] = {
+            gram: math.log((count + SMOOTHING) / denominator) for gram, count in counts.items()
+        }
+        self.unknown = math.log(SMOOTHING / denominator)
+
+    def score(self, grams) -> float:
+        log_probs, unknown = self.log_probs, self.unknown
+        return sum(log_probs.get(gram, unknown) for gram in grams)
+
+
+class LanguageIdentifier:
+    """corpora: профиль -> текст; язык профиля - имя до дефиса (ru-latn -> ru)"""
+
+    def __init__(self, corpora: Dict[str, str]):
+        counts = {profile: Counter(_ngrams(text)) for profile, text in corpora.items()}
+        vocabulary = set().union(*counts.values())
+        self.profiles = {profile: NgramProfile(counts[profile], len(vocabulary)) for profile in counts}
+
+    def detect(self, text: str, min_letters: int = 8, min_confidence: float = 0.9) -> Optional[Detection]:
+        text = (text or "")[:MAX_CHARS]
+        grams = list(_ngrams(text))
+        letters = sum(1 for gram in grams if len(gram) == 1)
+        if not letters:
+            return None
+
+        scores = {name: profile.score(grams) / len(grams) for name, profile in self.profiles.items()}
+        top = max(scores.values())
+        weights = {name: math.exp(CALIBRATION * (score - top)) for name, score in scores.items()}
+        total = sum(weights.values())
+        by_language: Dict[str, float] = {}
+        for name, weight in weights.items():
+            language = name.split("-")[0]
+            by_language[language] = by_language.get(language, 0.0) + weight / total
+        best = max(by_language, key=by_language.get)
+        confidence = by_language[best]
+        return Detection(best, confidence, letters >= min_letters and confidence >= min_confidence)
+
+
+_identifier: Optional[LanguageIdentifier] = None
+_identifier_lock = threading.Lock()
+
+
+def get_identifier() -> LanguageIdentifier:
+    global _identifier
+    with _identifier_lock:
+        if _identifier is None:
+            corpora = {}
+            for profile in PROFILES:
+                with open(os.path.join(CORPUS_DIR, f"{profile}.txt"), encoding="utf-8") as f:
+                    corpora[profile] = f.read()
+            _identifier = LanguageIdentifier(corpora)
+        return _identifier
+
+
+def detect(text: str) -> Optional[Detection]:
+    """Язык текста или None, если в тексте нет букв"""
+    detection = get_identifier().detect(
+        text,
+        min_letters=getattr(settings, "LANGID_MIN_LETTERS", 8),
+        min_confidence=getattr(settings, "LANGID_MIN_CONFIDENCE", 0.9),
+    )
+    if detection:
+        metrics.incr("detected", language=detection.language, reliable=detection.reliable)
+    return detection
+
+
+def resolve_language(text: str, fallback: str) -> Detection:
+    """
+    Язык для ответа: определённый, если уверенность достаточна, иначе fallback
+    (язык пользователя) с нулевой уверенностью - язык не определён, а унаследован.
+    """
+    detection = detect(text)
+    if detection is None or not detection.reliable:
+        return Detection(fallback, 0.0, False)
+    return detection
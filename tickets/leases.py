@@ -0,0 +1,212 @@
+"""
+Аренды ролей воркеров в БД: один узел выполняет роль, остальные ждут
+
+Держатель продлевает аренду каждые LEASE_HEARTBEAT_SECONDS секунд. Если узел
+упал, аренда истекает через LEASE_TTL_SECONDS и её забирает резервный узел.
+Каждая смена держателя увеличивает fencing_token: запись состояния
+(save_state) со старым токеном отклоняется, поэтому "зависший" бывший лидер
+не перезапишет offset нового. Сроки считаются по часам узлов, поэтому TTL
+должен быть заметно больше возможного расхождения часов.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .metrics import get_metrics
+from .models import WorkerLease
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("leases")
+
+
+class LeaseLost(Exception):
+    """Аренда перешла другому узлу - текущую работу нужно прекратить"""
+
+
+def default_holder() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def acquire(name: str, holder: str, ttl: int) -> Optional[int]:
+    """Берёт свободную или просроченную аренду; возвращает новый fencing token или None"""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            WorkerLease.objects.create(
+                name=name,
+                holder=holder,
+                fencing_token=1,
+                expires_at=now + timedelta(seconds=ttl),
+                heartbeat_at=now,
+            )
+        return 1
+    except IntegrityError:
+        pass
+
+    taken = WorkerLease.objects.filter(name=name).filter(Q(expires_at__lte=now) | Q(holder=holder)).update(
+        holder=holder,
+        fencing_token=F("fencing_token") + 1,
+        expires_at=now + timedelta(seconds=ttl),
+        heartbeat_at=now,
+    )
+    if not taken:
+        return None
+    return WorkerLease.objects.filter(name=name, holder=holder).values_list("fencing_token", flat=True).first()
+
+
+def renew(name: str, holder: str, token: int, ttl: int) -> bool:
+    now = timezone.now()
+    return bool(
+        WorkerLease.objects.filter(name=name, holder=holder, fencing_token=token, expires_at__gt=now).update(
+            expires_at=now + timedelta(seconds=ttl),
+            heartbeat_at=now,
+        )
+    )
+
+
+def release(name: str, holder: str, token: int) -> None:
+    """Освобождает аренду сразу, чтобы резервный узел не ждал истечения TTL"""
+    WorkerLease.objects.filter(name=name, holder=holder, fencing_token=token).update(
+        expires_at=timezone.now(),
+    )
+
+
+def is_valid(name: str, holder: str, token: int) -> bool:
+    return WorkerLease.objects.filter(
+        name=name, holder=holder, fencing_token=token, expires_at__gt=timezone.now()
+    ).exists()
+
+
+def load_state(name: str) -> Dict[str, Any]:
+    return WorkerLease.objects.filter(name=name).values_list("state", flat=True).first() or {}
+
+
+def save_state(name: str, token: int, state: Dict[str, Any]) -> None:
+    """Записывает состояние роли только при текущем fencing token"""
+    if not WorkerLease.objects.filter(name=name, fencing_token=token).update(state=state):
+        raise LeaseLost(name)
+
+
+class LeaderLease:
+    """Аренда роли с фоновым продлением"""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: Optional[int] = None,
+        heartbeat: Optional[int] = None,
+        holder: Optional[str] = None,
+    ):
+        self.name = name
+        self.ttl = ttl or getattr(settings, "LEASE_TTL_SECONDS", 15)
+        self.heartbeat = heartbeat or getattr(settings, "LEASE_HEARTBEAT_SECONDS", 5)
+        self.holder = holder or default_holder()
+        self.token: Optional[int] = None
+
+    def acquire(self) -> bool:
+        self.token = acquire(self.name, self.holder, self.ttl)
+        if self.token is not None:
+            metrics.incr("acquired", lease=self.name)
+            logger.info(f"Lease {self.name} acquired by {self.holder} (token {self.token})")
+        return self.token is not None
+
+    def release(self) -> None:
+        if self.token is not None:
+            release(self.name, self.holder, self.token)
+            self.token = None
+
+    def is_valid(self) -> bool:
+        return self.token is not None and is_valid(self.name, self.holder, self.token)
+
+    def check(self) -> None:
+        """Проверка перед побочным эффектом (сохранение checkpoint, offset)"""
+        if not self.is_valid():
+            raise LeaseLost(self.name)
+
+    def load_state(self) -> Dict[str, Any]:
+        return load_state(self.name)
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        if self.token is None:
+            raise LeaseLost(self.name)
+        save_state(self.name, self.token, state)
+
+    def _heartbeat(self, stop_event: threading.Event, leader_stop: threading.Event) -> None:
+        last_renewed = time.monotonic()
+        try:
+            while not leader_stop.wait(0.5):
+                if stop_event.is_set():
+                    break
+                if time.monotonic() - last_renewed < self.heartbeat:
+                    continue
+                try:
+                    if not renew(self.name, self.holder, self.token, self.ttl):
+                        metrics.incr("lost", lease=self.name)
+                        logger.warning(f"Lease {self.name} lost by {self.holder}")
+                        break
+                    last_renewed = time.monotonic()
+                except Exception as e:
+                    # БД недоступна: роль отдаём до того, как аренда истечёт и её заберёт другой узел
+                    logger.warning(f"Lease {self.name} heartbeat failed: {e}")
+                    if time.monotonic() - last_renewed >= self.ttl - self.heartbeat:
+                        break
+        finally:
+            leader_stop.set()
+            close_old_connections()
+
+    def run_as_leader(
+        self,
+        target: Callable[[threading.Event], Any],
+        stop_event: Optional[threading.Event] = None,
+    ) -> bool:
+        """
+        Берёт аренду и выполняет target(leader_stop) с фоновым продлением.
+        leader_stop устанавливается при остановке или потере аренды.
+        Возвращает False, если аренду держит другой узел.
+        """
+        stop_event = stop_event or threading.Event()
+        try:
+            acquired = self.acquire()
+        except Exception as e:
+            logger.warning(f"Lease {self.name} acquire failed: {e}")
+            acquired = False
+        if not acquired:
+            return False
+
+        leader_stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(stop_event, leader_stop),
+            name=f"lease-{self.name}",
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            target(leader_stop)
+        except LeaseLost:
+            logger.warning(f"Lease {self.name} lost while working")
+        finally:
+            leader_stop.set()
+            heartbeat.join(timeout=5)
+            try:
+                self.release()
+            except Exception as e:
+                logger.warning(f"Lease {self.name} release failed: {e}")
+        return True
+
+    def run_while_leader(self, stop_event: threading.Event, target: Callable[[threading.Event], Any]) -> None:
+        """Резервный режим: ждёт аренду, работает, пока она удерживается, и снова ждёт"""
+        while not stop_event.is_set():
+            if not self.run_as_leader(target, stop_event):
+                stop_event.wait(self.heartbeat)
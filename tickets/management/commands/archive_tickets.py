@@ -0,0 +1,63 @@
+"""
+Management command: перенос старых закрытых тикетов в архив (tickets.archive)
+Запуск: python manage.py archive_tickets --days 180
+Только посчитать кандидатов: python manage.py archive_tickets --dry-run
+Состояние архива: python manage.py archive_tickets --stats
+
+После первого большого переноса на SQLite файл БД не уменьшается сам:
+--vacuum перестраивает его (блокирует БД на время работы).
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection
+from tickets import archive
+
+
+class Command(BaseCommand):
+    help = 'Переносит тикеты, закрытые больше N дней назад, в сжатые сегменты архива и удаляет их из БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Возраст закрытия, дней (ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Тикетов в одной порции (ARCHIVE_CHUNK_SIZE)')
+        parser.add_argument('--segment-size', type=int, default=None,
+                            help='Тикетов в одном сегменте (ARCHIVE_SEGMENT_TICKETS)')
+        parser.add_argument('--limit', type=int, default=None, help='Не больше стольких тикетов за запуск')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать кандидатов')
+        parser.add_argument('--stats', action='store_true', help='Показать сегменты архива и выйти')
+        parser.add_argument('--vacuum', action='store_true', help='VACUUM после переноса (только SQLite)')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            stats = archive.get_reader().stats()
+            self.stdout.write(
+                f'Сегментов: {stats["segments"]}, тикетов: {stats["tickets"]}, '
+                f'{stats["bytes"] / 1024 / 1024:.1f} МБ в {archive.get_reader().directory}'
+            )
+            return
+
+        result = archive.archive_closed_tickets(
+            older_than_days=options['days'],
+            chunk_size=options['chunk_size'],
+            segment_tickets=options['segment_size'],
+            limit=options['limit'],
+            dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f'Тикетов к переносу: {result["candidates"]}')
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'В архиве: {result["archived"]} тикетов в {result["segments"]} сегментах '
+            f'({result["bytes"] / 1024:.0f} КБ), удалено из БД: {result["deleted"]} за {result["seconds"]} с'
+        ))
+        if result['archived'] > result['deleted']:
+            self.stdout.write(self.style.WARNING(
+                f'{result["archived"] - result["deleted"]} тикетов изменились во время переноса и остались в БД'
+            ))
+
+        if options['vacuum']:
+            if connection.vendor != 'sqlite':
+                self.stdout.write(self.style.WARNING('--vacuum нужен только для SQLite, пропущено'))
+            else:
+                with connection.cursor() as cursor:
+                    cursor.execute('VACUUM')
+                self.stdout.write('VACUUM выполнен')
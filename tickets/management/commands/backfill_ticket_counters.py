@@ -0,0 +1,88 @@
+"""
+Management command: пересчёт счётчиков переписки на тикетах
+Запуск: python manage.py backfill_ticket_counters --chunk-size 1000
+
+Тикеты обрабатываются диапазонами id: для каждого диапазона один агрегирующий
+запрос по Message (GROUP BY ticket_id) и bulk_update, каждый диапазон - в своей
+транзакции. Строки тикетов блокируются (SELECT ... FOR UPDATE) до агрегации:
+приращения F() от новых сообщений ждут конца транзакции и ложатся поверх
+пересчитанных значений, а не затираются ими. Нужен после миграции, добавившей поля, и после bulk_create сообщений
+(например, benchmark_queries --seed), который сигналы не вызывает.
+
+Исправленным тикетам выставляется updated_at: это водяной знак витрин
+(tickets.rollups), следующий refresh_rollups пересчитает их часовые корзины.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from tickets.models import Message, Ticket
+from tickets.signals import OPERATOR_REPLY_Q
+
+COUNTER_FIELDS = ["message_count", "last_message_at", "first_bot_reply_at", "first_operator_reply_at"]
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает message_count, last_message_at и время первых ответов бота и оператора'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Тикетов в одном диапазоне')
+        parser.add_argument('--from-id', type=int, default=0, help='Начать с тикета с этим id')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        started = time.perf_counter()
+        last_id = options['from_id'] - 1
+        processed = changed = 0
+
+        while True:
+            ids = list(
+                Ticket.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            low, high = ids[0], ids[-1]
+
+            with transaction.atomic():
+                tickets = list(
+                    Ticket.objects.select_for_update()
+                    .filter(id__gte=low, id__lte=high)
+                    .order_by('id')
+                    .only('id', *COUNTER_FIELDS)
+                )
+                facts = {
+                    row['ticket_id']: row
+                    for row in (
+                        Message.objects.filter(ticket_id__gte=low, ticket_id__lte=high)
+                        .values('ticket_id')
+                        .annotate(
+                            message_count=Count('id'),
+                            last_message_at=Max('created_at'),
+                            first_bot_reply_at=Min('created_at', filter=Q(is_bot=True)),
+                            first_operator_reply_at=Min('created_at', filter=OPERATOR_REPLY_Q),
+                        )
+                        .order_by()
+                    )
+                }
+                now = timezone.now()
+                stale = []
+                for ticket in tickets:
+                    row = facts.get(ticket.id, {'message_count': 0})
+                    values = {field: row.get(field) for field in COUNTER_FIELDS}
+                    if any(getattr(ticket, field) != value for field, value in values.items()):
+                        for field, value in values.items():
+                            setattr(ticket, field, value)
+                        ticket.updated_at = now
+                        stale.append(ticket)
+                Ticket.objects.bulk_update(stale, [*COUNTER_FIELDS, 'updated_at'], batch_size=chunk_size)
+
+            processed += len(ids)
+            changed += len(stale)
+            last_id = high
+            self.stdout.write(f'  тикеты до #{high}: обработано {processed}, исправлено {changed}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано тикетов: {processed}, исправлено: {changed} за {time.perf_counter() - started:.1f} с'
+        ))
@@ -0,0 +1,204 @@
+"""
+Management command: планы и время горячих запросов на больших таблицах
+Запуск: python manage.py benchmark_queries --seed 1000000 --messages 4
+Только замер на уже засеянной базе: python manage.py benchmark_queries --repeat 200
+
+Засевает тикеты, сообщения и уведомления пакетами bulk_create (пользователи
+с префиксом bench_), выполняет ANALYZE и для каждого горячего запроса печатает
+план (EXPLAIN / EXPLAIN QUERY PLAN) и время: минимум, медиана, p95. План с
+полным сканированием (SCAN без индекса) помечается - так регрессия индексов
+видна сразу. Засевайте копию базы, а не рабочую.
+"""
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from tickets.models import Channel, Message, Notification, Ticket
+from core.models import User
+
+BENCH_PREFIX = "bench_"
+CHANNELS = [
+    Channel.CHANNEL_WEB,
+    Channel.CHANNEL_EMAIL,
+    Channel.CHANNEL_TELEGRAM,
+    Channel.CHANNEL_WHATSAPP,
+    Channel.CHANNEL_API,
+]
+
+
+class Command(BaseCommand):
+    help = 'Засевает большие таблицы и печатает планы и время горячих запросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Сколько тикетов засеять')
+        parser.add_argument('--messages', type=int, default=4, help='Сообщений на тикет')
+        parser.add_argument('--users', type=int, default=0, help='Клиентов (по умолчанию тикеты / 20)')
+        parser.add_argument('--operators', type=int, default=20, help='Операторов для уведомлений')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пакета bulk_create')
+        parser.add_argument('--repeat', type=int, default=50, help='Повторов каждого запроса')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self._seed(options)
+        if not User.objects.filter(username__startswith=BENCH_PREFIX + 'client_').exists():
+            raise CommandError('Нет данных для замера: запустите с --seed N')
+
+        rng = random.Random(42)
+        clients = list(
+            User.objects.filter(username__startswith=BENCH_PREFIX + 'client_').values_list('id', flat=True)[:1000]
+        )
+        operators = list(
+            User.objects.filter(username__startswith=BENCH_PREFIX + 'operator_').values_list('id', flat=True)
+        ) or clients
+        ticket_ids = list(
+            Ticket.objects.filter(author_id__in=clients[:200]).values_list('id', flat=True)[:1000]
+        )
+        external_ids = list(
+            Ticket.objects.filter(author_id__in=clients[:200], external_id__isnull=False)
+            .values_list('external_id', flat=True)[:1000]
+        )
+
+        # Каждый запрос - функция от генератора случайных чисел, возвращающая QuerySet
+        hot_queries = [
+            ('open ticket (author, channel, status)', lambda: Ticket.objects.filter(
+                author_id=rng.choice(clients),
+                channel=rng.choice(CHANNELS),
+                status__in=Ticket.OPEN_STATUSES,
+            ).order_by('-id')[:1]),
+            # Первая страница operator_ticket_list
+            ('operator queue', lambda: Ticket.objects.filter(
+                is_auto_solved=False,
+                status__in=Ticket.OPEN_STATUSES,
+            ).select_related('author').order_by('-created_at')[:getattr(settings, 'OPERATOR_TICKETS_PER_PAGE', 50)]),
+            ('ticket history (ticket, created_at)', lambda: Message.objects.filter(
+                ticket_id=rng.choice(ticket_ids),
+            ).order_by('created_at')),
+            ('unread notifications', lambda: Notification.objects.filter(
+                operator_id=rng.choice(operators),
+                is_read=False,
+            ).select_related('ticket')[:10]),
+            ('ticket by external_id', lambda: Ticket.objects.filter(
+                external_id=rng.choice(external_ids or ['-']),
+            )[:1]),
+        ]
+
+        self.stdout.write(
+            f'Тикетов: {Ticket.objects.count()}, сообщений: {Message.objects.count()}, '
+            f'уведомлений: {Notification.objects.count()}; повторов: {options["repeat"]}'
+        )
+        full_scans = []
+        for name, build in hot_queries:
+            plan = build().explain()
+            timings = []
+            for _ in range(options['repeat']):
+                queryset = build()
+                started = time.perf_counter()
+                list(queryset)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{name}'))
+            for line in plan.splitlines():
+                self.stdout.write(f'  {line}')
+            self.stdout.write(
+                f'  min {timings[0]:.3f} ms, median {statistics.median(timings):.3f} ms, p95 {p95:.3f} ms'
+            )
+            if self._is_full_scan(plan):
+                full_scans.append(name)
+
+        if full_scans:
+            self.stdout.write(self.style.WARNING('\nПолное сканирование таблицы: ' + ', '.join(full_scans)))
+        else:
+            self.stdout.write(self.style.SUCCESS('\nВсе горячие запросы используют индексы'))
+
+    @staticmethod
+    def _is_full_scan(plan: str) -> bool:
+        for line in plan.splitlines():
+            line = line.strip()
+            # SQLite: "SCAN tickets_ticket" без "USING ... INDEX"; PostgreSQL: "Seq Scan"
+            if 'Seq Scan' in line or ('SCAN ' in line and 'INDEX' not in line.upper()):
+                return True
+        return False
+
+    def _seed(self, options):
+        total = options['seed']
+        batch_size = options['batch_size']
+        users = options['users'] or max(1, total // 20)
+        started = time.perf_counter()
+        rng = random.Random(7)
+        tag = timezone.now().strftime('%Y%m%d%H%M%S')
+
+        with transaction.atomic():
+            User.objects.bulk_create(
+                [User(username=f'{BENCH_PREFIX}client_{tag}_{i}') for i in range(users)],
+                batch_size=batch_size,
+            )
+            User.objects.bulk_create(
+                [
+                    User(username=f'{BENCH_PREFIX}operator_{tag}_{i}', role=User.ROLE_OPERATOR)
+                    for i in range(options['operators'])
+                ],
+                batch_size=batch_size,
+            )
+        client_ids = list(
+            User.objects.filter(username__startswith=f'{BENCH_PREFIX}client_{tag}_').order_by('id')
+            .values_list('id', flat=True)
+        )
+        operator_ids = list(
+            User.objects.filter(username__startswith=f'{BENCH_PREFIX}operator_{tag}_').values_list('id', flat=True)
+        )
+
+        # Пара (автор, канал) повторяется каждые users * len(CHANNELS) тикетов; открытыми
+        # делаем только тикеты последнего такого блока - уникальный индекс открытых не нарушается
+        block = users * len(CHANNELS)
+        open_from = max(0, total - block)
+        for start in range(0, total, batch_size):
+            tickets = []
+            for i in range(start, min(total, start + batch_size)):
+                channel = CHANNELS[(i // users) % len(CHANNELS)]
+                is_open = i >= open_from and rng.random() < 0.5
+                tickets.append(Ticket(
+                    author_id=client_ids[i % users],
+                    channel=channel,
+                    external_id=f'<bench-{tag}-{i}@example.com>' if channel == Channel.CHANNEL_EMAIL else None,
+                    status=rng.choice(Ticket.OPEN_STATUSES) if is_open else Ticket.STATUS_CLOSED,
+                    is_auto_solved=not is_open and rng.random() < 0.6,
+                    subject=f'Bench ticket {i}',
+                    description='Нагрузочные данные benchmark_queries',
+                ))
+            with transaction.atomic():
+                created = Ticket.objects.bulk_create(tickets, batch_size=batch_size)
+                # SQLite и PostgreSQL возвращают первичные ключи из bulk_create
+                Message.objects.bulk_create(
+                    [
+                        Message(ticket_id=ticket.id, text=f'Сообщение {n}', is_bot=bool(n % 2))
+                        for ticket in created
+                        for n in range(options['messages'])
+                    ],
+                    batch_size=batch_size,
+                )
+                Notification.objects.bulk_create(
+                    [
+                        Notification(
+                            operator_id=rng.choice(operator_ids),
+                            ticket_id=ticket.id,
+                            message=f'Новая эскалация: тикет #{ticket.id}',
+                            is_read=ticket.status == Ticket.STATUS_CLOSED,
+                        )
+                        for ticket in created
+                        if ticket.status != Ticket.STATUS_NEW
+                    ],
+                    batch_size=batch_size,
+                )
+            self.stdout.write(f'  засеяно тикетов: {min(total, start + batch_size)}/{total}')
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(self.style.SUCCESS(
+            f'Засеяно {total} тикетов за {time.perf_counter() - started:.1f} с'
+        ))
@@ -1,19 +1,57 @@
 """
 Management command для проверки и обработки входящих email
 Запуск: python manage.py check_emails
+Постоянный режим (IMAP IDLE): python manage.py check_emails --idle
 """
+import threading
+
 from django.core.management.base import BaseCommand
 from tickets.integrations.email_integration import EmailIntegration
+from tickets.leases import LeaderLease
+from tickets.integrations.mailbox_supervisor import MailboxSupervisor, load_mailboxes
 
 
 class Command(BaseCommand):
     help = 'Проверяет и обрабатывает входящие email обращения'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--idle',
+            action='store_true',
+            help='Держать соединение открытым и получать письма через IMAP IDLE',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Размер пула обработки писем в режиме --idle',
+        )
+
     def handle(self, *args, **options):
+        if options['idle']:
+            supervisor = MailboxSupervisor(workers=options['workers'])
+            names = ', '.join(mailbox.get('name', 'default') for mailbox in supervisor.mailboxes)
+            self.stdout.write(f'Ожидание писем (IMAP IDLE): {names}')
+            stop_event = threading.Event()
+            try:
+                supervisor.run(stop_event)
+            except KeyboardInterrupt:
+                stop_event.set()
+                self.stdout.write('Остановка, ожидание обрабатываемых писем...')
+                supervisor.executor.shutdown(wait=True)
+            return
+
         self.stdout.write('Проверка входящих email...')
         
-        integration = EmailIntegration()
-        processed = integration.fetch_new_emails()
+        processed = []
+        for mailbox in load_mailboxes():
+            integration = EmailIntegration(mailbox)
+            # Ящик, который сейчас читает другой узел (или run_workers), пропускаем
+            lease = LeaderLease(f"email:{integration.mailbox_key}")
+            integration.fence = lease.check
+            fetched = lease.run_as_leader(lambda _leader_stop: processed.extend(integration.fetch_new_emails()))
+            if not fetched:
+                self.stdout.write(f'Ящик {integration.mailbox_key} обрабатывается другим узлом, пропуск')
         
         if processed:
             self.stdout.write(
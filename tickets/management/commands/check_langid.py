@@ -0,0 +1,55 @@
+"""
+Management command: проверка определения языка на отложенных примерах
+Запуск: python manage.py check_langid
+Свой набор (TSV: язык<TAB>текст): python manage.py check_langid --file samples.tsv
+
+Примеры не входят в корпуса профилей. Ошибка - пример, надёжно (reliable)
+определённый не тем языком: вызывающий код записал бы его в профиль клиента.
+Ненадёжные определения только считаются - язык тогда остаётся прежним.
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from tickets import langid
+
+
+class Command(BaseCommand):
+    help = 'Проверяет определение языка (tickets.langid) на примерах с известным языком'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=os.path.join(langid.CORPUS_DIR, 'samples.tsv'),
+            help='TSV: язык<TAB>текст (по умолчанию tickets/data/langid/samples.tsv)',
+        )
+
+    def handle(self, *args, **options):
+        identifier = langid.get_identifier()
+        wrong = unreliable = total = 0
+        with open(options['file'], encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                expected, text = line.rstrip('\n').split('\t', 1)
+                detection = identifier.detect(
+                    text,
+                    min_letters=getattr(settings, 'LANGID_MIN_LETTERS', 8),
+                    min_confidence=getattr(settings, 'LANGID_MIN_CONFIDENCE', 0.9),
+                )
+                total += 1
+                if detection is None or not detection.reliable:
+                    unreliable += 1
+                    mark = '?'
+                elif detection.language != expected:
+                    wrong += 1
+                    mark = '!'
+                else:
+                    mark = ' '
+                found = f'{detection.language} {detection.confidence:.3f}' if detection else '-'
+                self.stdout.write(f'{mark} {expected} -> {found:10} {text[:60]}')
+
+        summary = f'Примеров: {total}, ненадёжных: {unreliable}, ошибок: {wrong}'
+        if wrong:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
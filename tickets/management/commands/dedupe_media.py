@@ -0,0 +1,68 @@
+"""
+Management command: перенос старых вложений (ticket_images/, telegram_media/) в
+контентно-адресуемое хранилище (tickets.media_store)
+Запуск: python manage.py dedupe_media
+Только посчитать: python manage.py dedupe_media --dry-run
+
+Одинаковые файлы схлопываются в один блоб, Message.image и TelegramMedia.file
+переписываются на новое имя, старый файл удаляется. Файлы, на которые ссылаются
+тикеты в архиве, остаются на месте.
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from tickets import media_store
+from tickets.archive import get_reader
+from tickets.models import Message, TelegramMedia
+
+
+class Command(BaseCommand):
+    help = 'Переносит вложения со старыми именами в контентно-адресуемое хранилище'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать файлы и объём')
+
+    def handle(self, *args, **options):
+        storage = media_store.media_storage()
+        names = set(Message.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True))
+        names |= set(TelegramMedia.objects.values_list('file', flat=True))
+        legacy = sorted(name for name in names if media_store.blob_hash(name) is None)
+        archived = {
+            message.get('image')
+            for record in get_reader().records()
+            for message in record['messages']
+            if message.get('image')
+        }
+
+        moved = missing = kept = 0
+        legacy_bytes = 0
+        blobs = set()
+        for name in legacy:
+            if not storage.exists(name):
+                missing += 1
+                continue
+            legacy_bytes += storage.size(name)
+            if options['dry_run']:
+                continue
+            with storage.open(name) as source:
+                new_name = storage.save(name, source)
+            blobs.add(new_name)
+            with transaction.atomic():
+                references = Message.objects.filter(image=name).update(image=new_name)
+                references += TelegramMedia.objects.filter(file=name).update(file=new_name)
+                media_store.adjust_references(new_name, references)
+            if name in archived:
+                kept += 1
+            else:
+                storage.delete(name)
+            moved += 1
+
+        if options['dry_run']:
+            self.stdout.write(f'Старых файлов: {len(legacy) - missing} ({legacy_bytes / 1024 / 1024:.1f} МБ), '
+                              f'отсутствуют на диске: {missing}')
+            return
+        unique_bytes = sum(storage.size(name) for name in blobs)
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {moved} ({legacy_bytes / 1024 / 1024:.1f} МБ) в {len(blobs)} блобов '
+            f'({unique_bytes / 1024 / 1024:.1f} МБ); отсутствуют на диске: {missing}, '
+            f'оставлены для архива: {kept}'
+        ))
@@ -0,0 +1,44 @@
+"""
+Management command для доставки ответов клиентам в их каналы (OutboundMessage)
+Запуск: python manage.py dispatch_outbound
+Однократная отправка накопленных сообщений: python manage.py dispatch_outbound --once
+"""
+import threading
+
+from django.core.management.base import BaseCommand
+from tickets.outbound_dispatcher import OutboundDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Доставляет ответы операторов и AI в каналы клиентов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Доставить всё, что готово к отправке, и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        dispatcher = OutboundDispatcher()
+
+        if options['once']:
+            total = 0
+            try:
+                while True:
+                    sent = dispatcher.dispatch_pending()
+                    if not sent:
+                        break
+                    total += sent
+            finally:
+                dispatcher.close()
+            self.stdout.write(self.style.SUCCESS(f'Доставлено сообщений: {total}'))
+            return
+
+        self.stdout.write('Доставка сообщений из очереди...')
+        stop_event = threading.Event()
+        try:
+            dispatcher.run(stop_event)
+        except KeyboardInterrupt:
+            stop_event.set()
+            self.stdout.write('Остановлено')
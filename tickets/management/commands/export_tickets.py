@@ -0,0 +1,64 @@
+"""
+Management command: выгрузка тикетов с сообщениями (tickets.export)
+Запуск: python manage.py export_tickets --format csv --from 2026-01-01 --output tickets.csv
+В stdout: python manage.py export_tickets --format jsonl --channel telegram | gzip > tickets.jsonl.gz
+Колоночный формат (нужен pyarrow): python manage.py export_tickets --format parquet -o tickets.parquet
+"""
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from tickets import export
+
+
+def _date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Дата в формате ГГГГ-ММ-ДД: {value!r}')
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка тикетов и сообщений в CSV, JSONL или Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', default='csv', choices=sorted(export.FORMATS), help='Формат (csv)')
+        parser.add_argument('--from', dest='date_from', default=None, help='Созданы с даты (ГГГГ-ММ-ДД)')
+        parser.add_argument('--to', dest='date_to', default=None, help='Созданы по дату включительно')
+        parser.add_argument('--category', default='', help='Только эта категория')
+        parser.add_argument('--channel', default='', help='Только этот канал')
+        parser.add_argument('--status', default='', help='Только этот статус')
+        parser.add_argument('--include-archived', action='store_true', help='Вместе с тикетами из архива')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Тикетов в порции (DB_ITERATOR_CHUNK_SIZE)')
+        parser.add_argument('-o', '--output', default='-', help='Файл (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        filters = export.Filters(
+            date_from=_date(options['date_from']) if options['date_from'] else None,
+            date_to=_date(options['date_to']) if options['date_to'] else None,
+            category=options['category'],
+            channel=options['channel'],
+            status=options['status'],
+        )
+        try:
+            chunks = export.export_tickets(
+                options['format'],
+                filters,
+                include_archived=options['include_archived'],
+                chunk_size=options['chunk_size'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+        self.stderr.write(f'Записано {written / 1024:.0f} КБ в {options["output"]}')
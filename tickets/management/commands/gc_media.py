@@ -0,0 +1,39 @@
+"""
+Management command: сборка мусора в хранилище вложений (tickets.media_store)
+Запуск: python manage.py gc_media
+С пересчётом счётчиков ссылок по БД и архиву тикетов: python manage.py gc_media --recount
+Посмотреть, что будет удалено: python manage.py gc_media --dry-run
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from tickets import media_store
+from tickets.models import MediaBlob
+
+
+class Command(BaseCommand):
+    help = 'Удаляет блобы вложений без ссылок и осиротевшие файлы хранилища'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true',
+                            help='Сначала пересчитать счётчики ссылок (Message, TelegramMedia, архив)')
+        parser.add_argument('--grace-hours', type=float, default=None,
+                            help='Не трогать блобы, менявшиеся за последние N часов (MEDIA_GC_GRACE_HOURS)')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет удалено')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            fixed = media_store.recount_references()
+            self.stdout.write(f'Исправлено счётчиков ссылок: {fixed}')
+
+        result = media_store.collect_garbage(grace_hours=options['grace_hours'], dry_run=options['dry_run'])
+        verb = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb}: блобов {result["blobs"]}, осиротевших файлов {result["orphans"]}, '
+            f'{result["bytes"] / 1024 / 1024:.1f} МБ'
+        ))
+
+        stats = MediaBlob.objects.aggregate(blobs=Count('id'), size=Sum('size'), refs=Sum('ref_count'))
+        self.stdout.write(
+            f'В хранилище: {stats["blobs"]} блобов, {(stats["size"] or 0) / 1024 / 1024:.1f} МБ, '
+            f'{stats["refs"] or 0} ссылок'
+        )
@@ -0,0 +1,65 @@
+"""
+Management command для обработки очереди входящих событий (email, Telegram, API)
+Запуск: python manage.py process_inbound --workers 4
+Однократная обработка накопленных событий: python manage.py process_inbound --once
+"""
+import threading
+
+from django.core.management.base import BaseCommand
+from tickets import inbound_bus
+from tickets.inbound_consumer import InboundConsumer
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает события из очереди входящих сообщений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать всё, что готово к обработке, и завершиться',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Число параллельных потребителей',
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            consumer = InboundConsumer()
+            total = 0
+            while True:
+                processed = consumer.process_batch()
+                if not processed:
+                    break
+                total += processed
+            depth = inbound_bus.depth()
+            self.stdout.write(self.style.SUCCESS(
+                f'Обработано событий: {total}, осталось в очереди: {depth["pending"]}'
+            ))
+            return
+
+        workers = max(options['workers'], 1)
+        self.stdout.write(f'Обработка очереди входящих ({workers} потребителей)...')
+        stop_event = threading.Event()
+        threads = [
+            threading.Thread(
+                target=InboundConsumer(name=f"worker-{i}").run,
+                args=(stop_event,),
+                name=f"inbound-{i}",
+                daemon=True,
+            )
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                stop_event.wait(1)
+        except KeyboardInterrupt:
+            stop_event.set()
+            for thread in threads:
+                thread.join(timeout=60)
+            self.stdout.write('Остановлено')
@@ -0,0 +1,32 @@
+"""
+Management command для обновления агрегатов дашборда
+Запуск: python manage.py refresh_rollups
+Пересчитать всё с нуля (после удаления тикетов): python manage.py refresh_rollups --rebuild
+Постоянно, без run_workers: python manage.py refresh_rollups --loop
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tickets import rollups
+
+
+class Command(BaseCommand):
+    help = 'Обновляет агрегаты тикетов (TicketRollup) по изменениям после водяного знака'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать все корзины с нуля')
+        parser.add_argument('--loop', action='store_true', help='Повторять каждые ROLLUP_INTERVAL секунд')
+
+    def handle(self, *args, **options):
+        result = rollups.refresh(rebuild=options['rebuild'])
+        self._report(result)
+        while options['loop']:
+            time.sleep(getattr(settings, 'ROLLUP_INTERVAL', 60))
+            self._report(rollups.refresh())
+
+    def _report(self, result):
+        self.stdout.write(self.style.SUCCESS(
+            f'Изменённых тикетов: {result["tickets"]}, часов пересчитано: {result["hours"]}, '
+            f'строк агрегатов: {result["rows"]} за {result["seconds"]} с'
+        ))
@@ -0,0 +1,61 @@
+"""
+Management command для запуска всех фоновых воркеров под одним супервизором
+Запуск: python manage.py run_workers
+Только выбранные роли: python manage.py run_workers --roles inbound,outbox --concurrency inbound=8
+Статус работающего супервизора: python manage.py run_workers --status
+"""
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from tickets.workers import ROLES, WorkerHost
+
+
+class Command(BaseCommand):
+    help = 'Запускает Telegram-поллер, почтовые ящики, потребителей очереди и отправку писем'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--roles',
+            default='',
+            help=f'Роли через запятую ({", ".join(ROLES)}); по умолчанию все включённые',
+        )
+        parser.add_argument(
+            '--concurrency',
+            action='append',
+            default=[],
+            metavar='ROLE=N',
+            help='Число экземпляров роли, например inbound=8 (можно указывать несколько раз)',
+        )
+        parser.add_argument(
+            '--status',
+            action='store_true',
+            help='Показать статус из WORKER_STATUS_FILE и выйти',
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            status_file = getattr(settings, 'WORKER_STATUS_FILE', '')
+            if not status_file or not os.path.exists(status_file):
+                raise CommandError('Файл статуса не найден: воркеры не запущены или WORKER_STATUS_FILE не задан')
+            with open(status_file, encoding='utf-8') as f:
+                self.stdout.write(json.dumps(json.load(f), ensure_ascii=False, indent=2))
+            return
+
+        roles = [role.strip() for role in options['roles'].split(',') if role.strip()] or None
+        for role in roles or []:
+            if role not in ROLES:
+                raise CommandError(f'Неизвестная роль: {role}')
+
+        concurrency = {}
+        for item in options['concurrency']:
+            role, _, count = item.partition('=')
+            if role not in ROLES or not count.isdigit():
+                raise CommandError(f'Неверное значение --concurrency: {item}')
+            concurrency[role] = int(count)
+
+        host = WorkerHost(roles=roles, concurrency=concurrency)
+        self.stdout.write('Запуск воркеров (Ctrl+C или SIGTERM для остановки)...')
+        host.run()
+        self.stdout.write('Остановлено')
@@ -0,0 +1,44 @@
+"""
+Management command для отправки писем из очереди OutboundEmail
+Запуск: python manage.py send_outbound_emails
+Однократная отправка накопленных писем: python manage.py send_outbound_emails --once
+"""
+import threading
+
+from django.core.management.base import BaseCommand
+from tickets.integrations.email_outbox import EmailOutboxSender
+
+
+class Command(BaseCommand):
+    help = 'Отправляет ответы из очереди исходящих писем'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Отправить всё, что готово к отправке, и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        sender = EmailOutboxSender()
+
+        if options['once']:
+            total = 0
+            try:
+                while True:
+                    sent = sender.send_pending()
+                    if not sent:
+                        break
+                    total += sent
+            finally:
+                sender.close()
+            self.stdout.write(self.style.SUCCESS(f'Отправлено писем: {total}'))
+            return
+
+        self.stdout.write('Отправка писем из очереди...')
+        stop_event = threading.Event()
+        try:
+            sender.run(stop_event)
+        except KeyboardInterrupt:
+            stop_event.set()
+            self.stdout.write('Остановлено')
@@ -0,0 +1,106 @@
+"""
+Management command: параллельная проверка переходов тикета
+Запуск: python manage.py stress_ticket_lifecycle --threads 16 --rounds 20
+
+В каждом раунде несколько потоков одновременно (через Barrier) создают тикет
+одного пользователя в Telegram и эскалируют его. Ожидается ровно один открытый
+тикет, одна успешная эскалация и одно уведомление; иначе команда завершается ошибкой.
+"""
+import threading
+import uuid
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection
+from tickets import ticket_lifecycle
+from tickets.channel_handler import ChannelHandler
+from tickets.metrics import get_metrics
+from tickets.models import Channel, Notification, Ticket
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочная проверка: один открытый тикет на пользователя и однократная эскалация'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Параллельных потоков в раунде')
+        parser.add_argument('--rounds', type=int, default=10, help='Число раундов')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданных пользователей и тикеты')
+
+    def _race(self, threads: int, target) -> Counter:
+        barrier = threading.Barrier(threads)
+        outcomes: Counter = Counter()
+        lock = threading.Lock()
+
+        def run():
+            try:
+                barrier.wait()
+                result = target()
+            except OperationalError as e:
+                # SQLite под параллельной записью может ответить "database is locked"
+                result = f"db_error: {e}"
+            finally:
+                connection.close()
+            with lock:
+                outcomes[result] += 1
+
+        workers = [threading.Thread(target=run) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return outcomes
+
+    def handle(self, *args, **options):
+        threads, rounds = options['threads'], options['rounds']
+        operator = User.objects.filter(role=User.ROLE_OPERATOR).first()
+        violations = []
+        db_errors = 0
+        created_users = []
+
+        for round_number in range(rounds):
+            user = User.objects.create(username=f"stress_{uuid.uuid4().hex[:12]}")
+            created_users.append(user.id)
+
+            def create():
+                ticket = ChannelHandler._get_or_create_ticket(
+                    user=user,
+                    channel=Channel.CHANNEL_TELEGRAM,
+                    external_id=None,
+                    text="Не работает интернет",
+                    image_data=None,
+                )
+                return ticket.id
+
+            outcomes = self._race(threads, create)
+            db_errors += sum(count for key, count in outcomes.items() if isinstance(key, str))
+            open_count = Ticket.objects.filter(
+                author=user, channel=Channel.CHANNEL_TELEGRAM, status__in=Ticket.OPEN_STATUSES
+            ).count()
+            ticket_ids = {key for key in outcomes if isinstance(key, int)}
+            if open_count != 1 or len(ticket_ids) != 1:
+                violations.append(f"round {round_number}: {open_count} open tickets, handlers saw {sorted(ticket_ids)}")
+                continue
+
+            ticket = Ticket.objects.get(id=ticket_ids.pop())
+            outcomes = self._race(
+                threads,
+                lambda: ticket_lifecycle.escalate(Ticket.objects.get(id=ticket.id), operator, "Новая эскалация: stress"),
+            )
+            db_errors += sum(count for key, count in outcomes.items() if isinstance(key, str))
+            notifications = Notification.objects.filter(ticket=ticket).count()
+            if outcomes[True] != 1 or (operator and notifications != 1):
+                violations.append(
+                    f"round {round_number}: {outcomes[True]} escalations, {notifications} notifications"
+                )
+
+        close_old_connections()
+        if not options['keep']:
+            User.objects.filter(id__in=created_users).delete()
+
+        counters = get_metrics("tickets").snapshot().get("counters", {})
+        self.stdout.write(f'Раундов: {rounds}, потоков: {threads}, ошибок блокировки БД: {db_errors}')
+        self.stdout.write(f'Разрешённых конфликтов: {counters}')
+        if violations:
+            raise CommandError('Нарушения:\n' + '\n'.join(violations))
+        self.stdout.write(self.style.SUCCESS('Нарушений нет'))
@@ -0,0 +1,71 @@
+"""
+Management command для обучения классификатора префильтра
+Запуск: python manage.py train_spam_filter --from-quarantine --from-tickets 500
+Из файла (JSONL: {"text": "...", "label": "spam" | "ham"}): python manage.py train_spam_filter --file data.jsonl
+Переобучить с нуля: python manage.py train_spam_filter --reset ...
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from tickets import prefilter
+from tickets.models import Message, QuarantinedMessage
+
+
+class Command(BaseCommand):
+    help = 'Обучает байесовский классификатор спама для префильтра входящих'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='JSONL с полями text и label (spam/ham)')
+        parser.add_argument(
+            '--from-quarantine',
+            action='store_true',
+            help='Разобранные операторами сообщения карантина',
+        )
+        parser.add_argument(
+            '--from-tickets',
+            type=int,
+            default=0,
+            help='Первые сообщения клиентов в последних N тикетах как не-спам',
+        )
+        parser.add_argument('--reset', action='store_true', help='Начать модель с нуля')
+
+    def handle(self, *args, **options):
+        samples = []
+
+        if options['file']:
+            try:
+                with open(options['file'], encoding='utf-8') as f:
+                    for line in f:
+                        if line.strip():
+                            item = json.loads(line)
+                            samples.append((item['text'], item['label'] == 'spam'))
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'Не удалось прочитать {options["file"]}: {e}')
+
+        if options['from_quarantine']:
+            reviewed = QuarantinedMessage.objects.exclude(status=QuarantinedMessage.STATUS_QUARANTINED)
+            for payload, status in reviewed.values_list('payload', 'status').iterator():
+                samples.append((prefilter.message_text(payload), status == QuarantinedMessage.STATUS_SPAM))
+
+        if options['from_tickets']:
+            seen = set()
+            for ticket_id, text in (
+                Message.objects.filter(is_bot=False)
+                .order_by('-ticket_id', 'id')
+                .values_list('ticket_id', 'text')
+                .iterator()
+            ):
+                if ticket_id in seen:
+                    continue
+                seen.add(ticket_id)
+                samples.append((text, False))
+                if len(seen) >= options['from_tickets']:
+                    break
+
+        if not samples and not options['reset']:
+            raise CommandError('Нет данных для обучения: укажите --file, --from-quarantine или --from-tickets')
+
+        docs = prefilter.train(samples, reset=options['reset'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Обучено на {len(samples)} примерах; в модели спам: {docs["spam"]}, не-спам: {docs["ham"]}'
+        ))
@@ -0,0 +1,52 @@
+"""
+Management command: локальный стенд WhatsApp Cloud API
+Запуск: python manage.py whatsapp_standin --webhook-url http://127.0.0.1:8000/tickets/api/whatsapp/webhook/
+Нагрузка входящими: python manage.py whatsapp_standin --load 5000 --senders 200 --batch 50
+Для отправки через стенд: WHATSAPP_API_BASE=http://127.0.0.1:8790/v19.0
+"""
+import json
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tickets.integrations.whatsapp_standin import WhatsAppStandIn
+
+
+class Command(BaseCommand):
+    help = 'Запускает локальный стенд WhatsApp Cloud API (отправка, статусы, нагрузка webhook)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--webhook-url',
+            default='http://127.0.0.1:8000/tickets/api/whatsapp/webhook/',
+            help='Адрес webhook приложения',
+        )
+        parser.add_argument('--port', type=int, default=8790, help='Порт стенда')
+        parser.add_argument('--status-delay', type=float, default=0.5, help='Интервал отправки статусов, с')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 429 на отправку')
+        parser.add_argument('--load', type=int, default=0, help='Отправить столько входящих сообщений')
+        parser.add_argument('--senders', type=int, default=100, help='Число отправителей при нагрузке')
+        parser.add_argument('--batch', type=int, default=50, help='Сообщений в одном webhook при нагрузке')
+
+    def handle(self, *args, **options):
+        standin = WhatsAppStandIn(
+            webhook_url=options['webhook_url'],
+            app_secret=getattr(settings, 'WHATSAPP_APP_SECRET', ''),
+            port=options['port'],
+            status_delay=options['status_delay'],
+            error_rate=options['error_rate'],
+        )
+        standin.start()
+        self.stdout.write(f'Стенд Cloud API: {standin.api_base}')
+
+        if options['load']:
+            stats = standin.load(options['load'], senders=options['senders'], batch_size=options['batch'])
+            standin.stop()
+            self.stdout.write(self.style.SUCCESS(json.dumps(stats, ensure_ascii=False)))
+            return
+
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            standin.stop()
+            self.stdout.write(f'Остановлено, отправлено сообщений: {len(standin.sent)}')
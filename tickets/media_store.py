@@ -0,0 +1,310 @@
+"""
+Контентно-адресуемое хранилище вложений (изображения сообщений, файлы Telegram)
+
+Файл сохраняется под именем SHA-256 своего содержимого: хэш считается при
+потоковой записи во временный файл, повторная загрузка того же файла (один и тот
+же скриншот ошибки роутера, пересланный десятки раз) не занимает места и
+возвращает уже сохранённое имя. Каталоги шардированы по первым байтам хэша:
+
+    media/blobs/3f/a1/3fa1...e9.jpg
+    media/blobs/3f/a1/3fa1...e9.thumb320.jpg   - миниатюра рядом с блобом
+
+Каждому блобу соответствует строка MediaBlob со счётчиком ссылок (Message.image,
+TelegramMedia.file, сообщения в архиве тикетов). Счётчик меняют сигналы
+(tickets.signals), storage.delete() блоб не удаляет: неиспользуемые блобы
+удаляет gc_media спустя MEDIA_GC_GRACE_HOURS, он же пересчитывает счётчики.
+Файлы со старыми именами (ticket_images/...) читаются как раньше, перенести их в
+хранилище можно командой dedupe_media.
+"""
+import contextvars
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("media")
+
+_BLOB_NAME = re.compile(r"^(?P<sha>[0-9a-f]{64})(?P<suffix>\.[0-9A-Za-z.]*)?$")
+_EXTENSION = re.compile(r"^\.[0-9a-z]{1,5}$")
+
+# Удаление сообщений при архивации тикетов не должно отпускать блобы: архив продолжает на них ссылаться
+_retain_references = contextvars.ContextVar("media_retain_references", default=False)
+
+
+def _prefix() -> str:
+    return getattr(settings, "MEDIA_BLOB_PREFIX", "blobs")
+
+
+def _extension(name: str) -> str:
+    extension = os.path.splitext(name)[1].lower()
+    return extension if _EXTENSION.match(extension) else ""
+
+
+def blob_name(sha256: str, extension: str = "") -> str:
+    return f"{_prefix()}/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def blob_hash(name: Optional[str]) -> Optional[str]:
+    """SHA-256 блоба по имени файла или None для файлов вне хранилища"""
+    if not name or not name.startswith(_prefix() + "/"):
+        return None
+    match = _BLOB_NAME.match(os.path.basename(name))
+    return match.group("sha") if match else None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, в котором имя файла определяется его содержимым"""
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя выбирает _save по хэшу: одинаковое содержимое - одно имя
+        return name
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        tmp_dir = os.path.join(self.location, _prefix(), "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            sha256 = digest.hexdigest()
+
+            # Строка создаётся и блокируется до записи файла: gc_media удаляет строку
+            # и файлы под той же блокировкой и не сотрёт только что записанный блоб
+            with transaction.atomic():
+                blob, created = MediaBlob.objects.select_for_update().get_or_create(
+                    sha256=sha256, defaults={"name": blob_name(sha256, _extension(name)), "size": size}
+                )
+                if not created:
+                    # Отметка времени защищает блоб от gc_media, пока ссылка на него не сохранена
+                    MediaBlob.objects.filter(id=blob.id).update(updated_at=timezone.now())
+                    if self.exists(blob.name):
+                        metrics.incr("dedup_hits")
+                        metrics.incr("dedup_bytes", value=size)
+                        return blob.name
+
+                path = self.path(blob.name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                tmp_path = None
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+            metrics.incr("blobs_written")
+            metrics.incr("bytes_written", value=size)
+            return blob.name
+        finally:
+            if tmp_path is not None:
+                os.remove(tmp_path)
+
+    def delete(self, name):
+        # Блоб может быть общим для многих сообщений - удаляет только gc_media
+        if blob_hash(name) is None:
+            super().delete(name)
+
+
+_storage: Optional[ContentAddressedStorage] = None
+
+
+def media_storage() -> ContentAddressedStorage:
+    """Хранилище для FileField (storage=media_storage) - один экземпляр на процесс"""
+    global _storage
+    if _storage is None:
+        _storage = ContentAddressedStorage()
+    return _storage
+
+
+@contextmanager
+def retain_references():
+    """Удаление строк внутри блока не уменьшает счётчики ссылок (архивация тикетов)"""
+    token = _retain_references.set(True)
+    try:
+        yield
+    finally:
+        _retain_references.reset(token)
+
+
+def adjust_references(name: Optional[str], delta: int) -> None:
+    """Меняет счётчик ссылок блоба; файлы вне хранилища пропускаются"""
+    from .models import MediaBlob
+
+    sha256 = blob_hash(name)
+    if sha256 is None or not delta or (delta < 0 and _retain_references.get()):
+        return
+    updated = MediaBlob.objects.filter(sha256=sha256).update(
+        ref_count=F("ref_count") + delta, updated_at=timezone.now()
+    )
+    if not updated and delta > 0:
+        storage = media_storage()
+        size = storage.size(name) if storage.exists(name) else 0
+        MediaBlob.objects.get_or_create(sha256=sha256, defaults={"name": name, "size": size, "ref_count": delta})
+
+
+def thumbnail_name(name: str, size: Optional[int] = None) -> str:
+    size = size or getattr(settings, "MEDIA_THUMBNAIL_SIZE", 320)
+    return f"{os.path.splitext(name)[0]}.thumb{size}.jpg"
+
+
+def thumbnail(name: str, size: Optional[int] = None) -> str:
+    """
+    Имя миниатюры (JPEG, сторона не больше size) рядом с файлом; создаётся при
+    первом обращении. Если файл не картинка - возвращается исходное имя.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    size = size or getattr(settings, "MEDIA_THUMBNAIL_SIZE", 320)
+    storage = media_storage()
+    thumb = thumbnail_name(name, size)
+    if storage.exists(thumb):
+        return thumb
+    try:
+        with storage.open(name) as source:
+            image = Image.open(source)
+            image.thumbnail((size, size))
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            path = storage.path(thumb)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as out:
+                image.save(out, "JPEG", quality=80)
+            os.replace(tmp_path, path)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning(f"Thumbnail for {name} failed: {e}")
+        return name
+    metrics.incr("thumbnails_created")
+    return thumb
+
+
+def thumbnail_url(name: str, size: Optional[int] = None) -> str:
+    return media_storage().url(thumbnail(name, size))
+
+
+def recount_references() -> int:
+    """
+    Пересчитывает счётчики ссылок по Message.image, TelegramMedia.file и архиву
+    тикетов; возвращает число исправленных строк. Строки, изменённые во время
+    пересчёта, не трогаются - их счётчик уже актуален.
+    """
+    from .archive import get_reader
+    from .models import MediaBlob, Message, TelegramMedia
+
+    started = timezone.now()
+    chunk_size = getattr(settings, "DB_ITERATOR_CHUNK_SIZE", 2000)
+    counts: Counter = Counter()
+    for name in Message.objects.exclude(image="").exclude(image__isnull=True).values_list(
+        "image", flat=True
+    ).iterator(chunk_size=chunk_size):
+        counts[blob_hash(name)] += 1
+    for name in TelegramMedia.objects.values_list("file", flat=True).iterator(chunk_size=chunk_size):
+        counts[blob_hash(name)] += 1
+    for record in get_reader().records():
+        for message in record["messages"]:
+            counts[blob_hash(message.get("image"))] += 1
+
+    fixed = 0
+    for blob_id, sha256, ref_count in MediaBlob.objects.values_list("id", "sha256", "ref_count").iterator(
+        chunk_size=chunk_size
+    ):
+        actual = counts.get(sha256, 0)
+        if actual != ref_count:
+            fixed += MediaBlob.objects.filter(id=blob_id, updated_at__lt=started).update(ref_count=actual)
+    return fixed
+
+
+def _remove_blob_files(storage: ContentAddressedStorage, name: str) -> int:
+    """Удаляет файл блоба и его миниатюры; возвращает освобождённые байты"""
+    directory = os.path.dirname(storage.path(name))
+    stem = os.path.splitext(os.path.basename(name))[0]
+    freed = 0
+    try:
+        entries = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if entry.startswith(stem):
+            path = os.path.join(directory, entry)
+            freed += os.path.getsize(path)
+            os.remove(path)
+    return freed
+
+
+def collect_garbage(grace_hours: Optional[float] = None, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Удаляет блобы без ссылок, не менявшиеся дольше grace_hours, и файлы в каталоге
+    хранилища без строки MediaBlob (оборванные записи, временные файлы).
+    """
+    from .models import MediaBlob
+
+    grace = grace_hours if grace_hours is not None else getattr(settings, "MEDIA_GC_GRACE_HOURS", 24)
+    cutoff = timezone.now() - timedelta(hours=grace)
+    storage = media_storage()
+    result = {"blobs": 0, "orphans": 0, "bytes": 0}
+
+    unreferenced = MediaBlob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff)
+    for blob_id, name, size in unreferenced.values_list("id", "name", "size").iterator():
+        result["blobs"] += 1
+        if dry_run:
+            result["bytes"] += size
+            continue
+        # Строка и файлы удаляются под блокировкой строки, которую берёт и _save:
+        # блоб, на который успели сослаться или который загрузили заново, остаётся
+        with transaction.atomic():
+            locked = MediaBlob.objects.select_for_update().filter(
+                id=blob_id, ref_count__lte=0, updated_at__lt=cutoff
+            ).values_list("id", flat=True).first()
+            if locked is None:
+                result["blobs"] -= 1
+                continue
+            MediaBlob.objects.filter(id=blob_id).delete()
+            result["bytes"] += _remove_blob_files(storage, name)
+
+    root = storage.path(_prefix())
+    for directory, _, files in os.walk(root):
+        old_files = [
+            name for name in files
+            if os.path.getmtime(os.path.join(directory, name)) < cutoff.timestamp()
+        ]
+        if not old_files:
+            continue
+        hashes = {}
+        for name in old_files:
+            match = _BLOB_NAME.match(name)
+            hashes[name] = match.group("sha") if match else None
+        known = set(MediaBlob.objects.filter(sha256__in=[h for h in hashes.values() if h]).values_list(
+            "sha256", flat=True
+        ))
+        for name, sha256 in hashes.items():
+            if sha256 in known:
+                continue
+            path = os.path.join(directory, name)
+            result["orphans"] += 1
+            result["bytes"] += os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+
+    if not dry_run:
+        metrics.incr("gc_blobs_deleted", value=result["blobs"])
+        metrics.incr("gc_bytes_freed", value=result["bytes"])
+    return result
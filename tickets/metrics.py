@@ -0,0 +1,91 @@
+"""
+Простые in-process метрики для интеграций и фоновых воркеров
+"""
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Tuple
+
+
+def _label_key(name: str, labels: Dict[str, Any]) -> Tuple:
+    return (name,) + tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metrics:
+    """Потокобезопасный набор счётчиков и наблюдений с метками"""
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple, float] = defaultdict(float)
+        self._gauges: Dict[Tuple, float] = {}
+        self._observations: Dict[Tuple, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1, **labels) -> None:
+        """Увеличивает счётчик"""
+        key = _label_key(name, labels)
+        with self._lock:
+            self._counters[key] += value
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        """Устанавливает текущее значение (размер очереди, число активных задач)"""
+        key = _label_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Записывает наблюдение (длительность, размер и т.д.): count/sum/max"""
+        key = _label_key(name, labels)
+        with self._lock:
+            stats = self._observations.get(key)
+            if stats is None:
+                stats = {"count": 0, "sum": 0.0, "max": value}
+                self._observations[key] = stats
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["max"] = max(stats["max"], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Возвращает копию всех метрик в JSON-совместимом виде"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            observations = {k: dict(v) for k, v in self._observations.items()}
+
+        def fmt(key: Tuple) -> str:
+            name, labels = key[0], key[1:]
+            if not labels:
+                return name
+            return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+        return {
+            "counters": {fmt(k): v for k, v in counters.items()},
+            "gauges": {fmt(k): v for k, v in gauges.items()},
+            "observations": {fmt(k): v for k, v in observations.items()},
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._observations.clear()
+
+
+_registry: Dict[str, Metrics] = {}
+_registry_lock = threading.Lock()
+
+
+def get_metrics(namespace: str) -> Metrics:
+    """Возвращает общий экземпляр метрик для пространства имён"""
+    with _registry_lock:
+        metrics = _registry.get(namespace)
+        if metrics is None:
+            metrics = Metrics(namespace)
+            _registry[namespace] = metrics
+        return metrics
+
+
+def snapshot_all() -> Dict[str, Any]:
+    """Снимок метрик всех пространств имён"""
+    with _registry_lock:
+        items = list(_registry.items())
+    return {namespace: metrics.snapshot() for namespace, metrics in items}
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0005_knowledgearticle'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramMedia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_unique_id', models.CharField(max_length=255, unique=True)),
+                ('file_id', models.CharField(max_length=255)),
+                ('file', models.FileField(upload_to='telegram_media/')),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('size', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0008_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticket',
+            name='external_id',
+            field=models.CharField(blank=True, db_index=True, help_text='ID обращения во внешней системе (email message-id, telegram chat_id и т.д.)', max_length=255, null=True),
+        ),
+        migrations.CreateModel(
+            name='EmailReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(help_text='RFC 5322 Message-ID', max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='email_references', to='tickets.ticket')),
+            ],
+        ),
+    ]
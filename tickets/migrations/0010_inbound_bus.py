@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:58
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0009_emailreference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetterEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField()),
+                ('channel', models.CharField(choices=[('web', 'Веб-портал'), ('email', 'Email'), ('telegram', 'Telegram'), ('whatsapp', 'WhatsApp'), ('api', 'API')], max_length=20)),
+                ('conversation_key', models.CharField(max_length=255)),
+                ('idempotency_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField()),
+                ('failed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InboundEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(choices=[('web', 'Веб-портал'), ('email', 'Email'), ('telegram', 'Telegram'), ('whatsapp', 'WhatsApp'), ('api', 'API')], max_length=20)),
+                ('conversation_key', models.CharField(help_text='канал:пользователь - порядок обработки внутри диалога', max_length=255)),
+                ('idempotency_key', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('priority', models.SmallIntegerField(default=1)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('leased', 'Leased'), ('done', 'Done')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lease_owner', models.CharField(blank=True, max_length=100)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'priority', 'available_at'], name='tickets_inb_status_d9df99_idx'), models.Index(fields=['conversation_key', 'status'], name='tickets_inb_convers_e1f89e_idx')],
+            },
+        ),
+    ]
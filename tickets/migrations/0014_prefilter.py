@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0013_outboundmessage_provider_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpamModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='default', max_length=50, unique=True)),
+                ('version', models.IntegerField(default=0)),
+                ('data', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuarantinedMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(choices=[('web', 'Веб-портал'), ('email', 'Email'), ('telegram', 'Telegram'), ('whatsapp', 'WhatsApp'), ('api', 'API')], max_length=20)),
+                ('user_identifier', models.CharField(max_length=255)),
+                ('reason', models.CharField(max_length=50)),
+                ('score', models.FloatField(blank=True, help_text='Вероятность спама по модели', null=True)),
+                ('payload', models.JSONField(default=dict)),
+                ('idempotency_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(choices=[('quarantined', 'Quarantined'), ('released', 'Released'), ('spam', 'Spam')], default='quarantined', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='tickets_qua_status_0e2467_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SenderReputation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(choices=[('web', 'Веб-портал'), ('email', 'Email'), ('telegram', 'Telegram'), ('whatsapp', 'WhatsApp'), ('api', 'API')], max_length=20)),
+                ('identifier', models.CharField(max_length=255)),
+                ('accepted', models.IntegerField(default=0)),
+                ('quarantined', models.IntegerField(default=0)),
+                ('dropped', models.IntegerField(default=0)),
+                ('spam', models.IntegerField(default=0)),
+                ('blocked', models.BooleanField(default=False)),
+                ('first_seen', models.DateTimeField(auto_now_add=True)),
+                ('last_seen', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('channel', 'identifier'), name='unique_sender_reputation')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0014_prefilter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='language',
+            field=models.CharField(blank=True, max_length=2),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='language_confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
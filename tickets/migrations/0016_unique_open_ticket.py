@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def close_duplicate_open_tickets(apps, schema_editor):
+    """
+    До ограничения гонки могли создать несколько открытых тикетов одного
+    пользователя в канале: оставляем последний обновлённый, остальные закрываем.
+    """
+    Ticket = apps.get_model('tickets', 'Ticket')
+    open_tickets = Ticket.objects.filter(
+        channel__in=['telegram', 'whatsapp', 'api'],
+        status__in=['new', 'in_progress'],
+    ).order_by('author_id', 'channel', '-updated_at', '-id')
+
+    kept = set()
+    duplicates = []
+    for ticket_id, author_id, channel in open_tickets.values_list('id', 'author_id', 'channel'):
+        if (author_id, channel) in kept:
+            duplicates.append(ticket_id)
+        else:
+            kept.add((author_id, channel))
+    if duplicates:
+        Ticket.objects.filter(id__in=duplicates).update(status='closed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0015_message_language'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_tickets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ticket',
+            constraint=models.UniqueConstraint(condition=models.Q(('channel__in', ['telegram', 'whatsapp', 'api']), ('status__in', ['new', 'in_progress'])), fields=('author', 'channel'), name='unique_open_ticket_per_channel'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0016_unique_open_ticket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['ticket', 'created_at'], name='message_ticket_created'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', False)), fields=['operator', '-created_at'], name='notification_operator_unread'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['author', 'channel', 'status'], name='ticket_author_channel_status'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(condition=models.Q(('is_auto_solved', False)), fields=['-created_at'], name='ticket_operator_queue'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0018_ticket_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.DateTimeField(blank=True, null=True)),
+                ('tickets_seen', models.IntegerField(default=0, help_text='Изменённых тикетов в последнем проходе')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TicketRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket', models.DateTimeField(help_text='Начало часа (UTC) или местных суток')),
+                ('category', models.CharField(max_length=20)),
+                ('channel', models.CharField(max_length=20)),
+                ('department', models.CharField(max_length=20)),
+                ('priority', models.CharField(max_length=20)),
+                ('ticket_count', models.IntegerField(default=0)),
+                ('auto_solved_count', models.IntegerField(default=0)),
+                ('escalated_count', models.IntegerField(default=0)),
+                ('closed_count', models.IntegerField(default=0)),
+                ('message_count', models.IntegerField(default=0)),
+                ('bot_reply_count', models.IntegerField(default=0)),
+                ('bot_reply_seconds', models.FloatField(default=0)),
+                ('operator_reply_count', models.IntegerField(default=0)),
+                ('operator_reply_seconds', models.FloatField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'bucket', 'category', 'channel', 'department', 'priority'), name='unique_rollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:31
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def stamp_closed_at(apps, schema_editor):
+    """Для уже закрытых тикетов точного времени закрытия нет - берём время последнего изменения"""
+    Ticket = apps.get_model('tickets', 'Ticket')
+    Ticket.objects.filter(status='closed', closed_at__isnull=True).update(closed_at=F('updated_at'))
+
+
+def reset_rollup_watermark(apps, schema_editor):
+    """Старые строки агрегатов без скетчей: следующий проход refresh_rollups пересчитает все корзины"""
+    RollupWatermark = apps.get_model('tickets', 'RollupWatermark')
+    RollupWatermark.objects.update(position=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0019_ticket_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, help_text='Время закрытия (для времени решения)', null=True),
+        ),
+        migrations.RunPython(stamp_closed_at, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='ticketrollup',
+            name='bot_reply_sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticketrollup',
+            name='operator_reply_sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ticketrollup',
+            name='resolution_sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(reset_rollup_watermark, migrations.RunPython.noop),
+    ]
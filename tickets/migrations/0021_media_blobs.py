@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:40
+
+import tickets.media_store
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0020_response_sketches'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=tickets.media_store.media_storage, upload_to='ticket_images/'),
+        ),
+        migrations.AlterField(
+            model_name='telegrammedia',
+            name='file',
+            field=models.FileField(storage=tickets.media_store.media_storage, upload_to='telegram_media/'),
+        ),
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ref_count', 'updated_at'], name='mediablob_gc')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0021_media_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailboxcheckpoint',
+            name='retry_uids',
+            field=models.JSONField(blank=True, default=dict, help_text='UID -> число неудачных попыток'),
+        ),
+    ]
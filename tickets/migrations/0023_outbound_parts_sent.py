@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0022_mailbox_retry_uids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='parts_sent',
+            field=models.IntegerField(default=0),
+        ),
+    ]
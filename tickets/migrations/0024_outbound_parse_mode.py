@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0023_outbound_parts_sent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundmessage',
+            name='parse_mode',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0024_outbound_parse_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundMessagePart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('provider_message_id', models.CharField(db_index=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('outbound', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='tickets.outboundmessage')),
+            ],
+            options={
+                'unique_together': {('outbound', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:09
+
+from django.db import migrations, models
+
+
+def drop_duplicate_quarantine_rows(apps, schema_editor):
+    """
+    Ретраи webhook могли положить в карантин одно сообщение несколько раз:
+    оставляем первую запись с каждым ключом, остальные удаляем.
+    """
+    QuarantinedMessage = apps.get_model('tickets', 'QuarantinedMessage')
+    # Пустой ключ - «ключа нет»: NULL не участвует в ограничении уникальности
+    QuarantinedMessage.objects.filter(idempotency_key='').update(idempotency_key=None)
+    rows = (QuarantinedMessage.objects.exclude(idempotency_key__isnull=True)
+            .order_by('idempotency_key', 'id'))
+
+    seen = set()
+    duplicates = []
+    for row_id, key in rows.values_list('id', 'idempotency_key'):
+        if key in seen:
+            duplicates.append(row_id)
+        else:
+            seen.add(key)
+    if duplicates:
+        QuarantinedMessage.objects.filter(id__in=duplicates).delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0025_outbound_message_parts'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_quarantine_rows, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='quarantinedmessage',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
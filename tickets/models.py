@@ -1,5 +1,8 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
+
+from .media_store import media_storage, thumbnail_url
 
 
 class Channel(models.Model):
@@ -89,6 +92,7 @@ class Ticket(models.Model):
         max_length=255,
         blank=True,
         null=True,
+        db_index=True,
         help_text="ID обращения во внешней системе (email message-id, telegram chat_id и т.д.)"
     )
     assigned_operator = models.ForeignKey(
@@ -108,9 +112,45 @@ class Ticket(models.Model):
     is_auto_solved = models.BooleanField(default=False)
     escalated_at = models.DateTimeField(null=True, blank=True, help_text="Время эскалации к оператору")
     operator_joined = models.BooleanField(default=False, help_text="Оператор присоединился к чату")
+    # Денормализованные факты о переписке: обновляются UPDATE ... F() при создании
+    # сообщения (tickets.signals), для старых данных - backfill_ticket_counters
+    message_count = models.IntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    first_bot_reply_at = models.DateTimeField(null=True, blank=True)
+    first_operator_reply_at = models.DateTimeField(null=True, blank=True)
+    closed_at = models.DateTimeField(null=True, blank=True, help_text="Время закрытия (для времени решения)")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    OPEN_STATUSES = [STATUS_NEW, STATUS_IN_PROGRESS]
+    # Каналы без цепочек сообщений: у пользователя не больше одного открытого тикета в канале
+    SINGLE_OPEN_CHANNELS = [Channel.CHANNEL_TELEGRAM, Channel.CHANNEL_WHATSAPP, Channel.CHANNEL_API]
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["author", "channel"],
+                condition=models.Q(
+                    status__in=["new", "in_progress"],
+                    channel__in=[Channel.CHANNEL_TELEGRAM, Channel.CHANNEL_WHATSAPP, Channel.CHANNEL_API],
+                ),
+                name="unique_open_ticket_per_channel",
+            ),
+        ]
+        indexes = [
+            # Поиск открытого тикета пользователя в канале (ticket_lifecycle.find_open_ticket)
+            models.Index(fields=["author", "channel", "status"], name="ticket_author_channel_status"),
+            # Очередь оператора: не решённые AI тикеты, новые первыми. Открытые тикеты - самые
+            # свежие, поэтому обход индекса с LIMIT останавливается рано. Условие индекса -
+            # NOT is_auto_solved, как его пишет ORM: SQLite применяет частичный индекс, только
+            # если WHERE запроса дословно содержит условие, а status IN (?, ?) с параметрами нет
+            models.Index(
+                fields=["-created_at"],
+                condition=models.Q(is_auto_solved=False),
+                name="ticket_operator_queue",
+            ),
+        ]
+
     def __str__(self) -> str:
         return f"#{self.id} {self.subject}"
 
@@ -129,8 +169,12 @@ class Message(models.Model):
         help_text="Отправитель сообщения (пользователь или оператор)"
     )
     text = models.TextField(blank=True)
-    image = models.ImageField(upload_to="ticket_images/", blank=True, null=True)
+    # Контентно-адресуемое хранилище (tickets.media_store): одинаковые файлы хранятся один раз
+    image = models.ImageField(upload_to="ticket_images/", storage=media_storage, blank=True, null=True)
     is_bot = models.BooleanField(default=False)
+    # Язык сообщения клиента (tickets.langid) и уверенность определения
+    language = models.CharField(max_length=2, blank=True)
+    language_confidence = models.FloatField(null=True, blank=True)
     rating = models.IntegerField(
         null=True,
         blank=True,
@@ -139,9 +183,409 @@ class Message(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # История диалога всегда читается по тикету в хронологическом порядке
+            models.Index(fields=["ticket", "created_at"], name="message_ticket_created"),
+        ]
+
     def __str__(self) -> str:
         return f"Message {self.id} for ticket {self.ticket_id}"
 
+    @property
+    def thumbnail_url(self) -> str:
+        """URL миниатюры изображения (создаётся при первом обращении)"""
+        return thumbnail_url(self.image.name) if self.image else ""
+
+
+class TelegramMedia(models.Model):
+    """Кэш скачанных из Telegram файлов: file_unique_id -> сохранённый файл"""
+    file_unique_id = models.CharField(max_length=255, unique=True)
+    file_id = models.CharField(max_length=255)
+    file = models.FileField(upload_to="telegram_media/", storage=media_storage)
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+    size = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"Telegram media {self.file_unique_id}"
+
+
+class MediaBlob(models.Model):
+    """
+    Файл контентно-адресуемого хранилища (tickets.media_store): SHA-256
+    содержимого, имя в MEDIA_ROOT и число ссылок на него. Блобы без ссылок
+    удаляет gc_media.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Последнее изменение счётчика или повторная загрузка: gc_media ждёт MEDIA_GC_GRACE_HOURS после него
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["ref_count", "updated_at"], name="mediablob_gc"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.ref_count} refs)"
+
+
+class MailboxCheckpoint(models.Model):
+    """
+    Позиция чтения IMAP-ящика: UIDVALIDITY и последний просмотренный UID.
+    Письма до last_uid, которые не удалось обработать, ждут повтора в retry_uids.
+    """
+    mailbox = models.CharField(max_length=255, unique=True, help_text="login@server/папка")
+    uidvalidity = models.BigIntegerField(default=0)
+    last_uid = models.BigIntegerField(default=0)
+    retry_uids = models.JSONField(default=dict, blank=True, help_text="UID -> число неудачных попыток")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.mailbox}: {self.uidvalidity}/{self.last_uid}"
+
+
+class EmailReference(models.Model):
+    """
+    Message-ID писем (входящих и наших ответов) и тикет, к которому они относятся.
+    По In-Reply-To/References ответ клиента находит свой тикет одним запросом по индексу.
+    """
+    message_id = models.CharField(max_length=255, unique=True, help_text="RFC 5322 Message-ID")
+    ticket = models.ForeignKey(
+        Ticket,
+        on_delete=models.CASCADE,
+        related_name="email_references",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.message_id} -> ticket {self.ticket_id}"
+
+
+class OutboundEmail(models.Model):
+    """Очередь исходящих писем: ответы отправляет отдельный воркер через общее SMTP-соединение"""
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    ticket = models.ForeignKey(
+        Ticket,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="outbound_emails",
+    )
+    to_email = models.EmailField()
+    from_email = models.EmailField(blank=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    message_id = models.CharField(max_length=255, unique=True, help_text="Message-ID этого письма")
+    in_reply_to = models.CharField(max_length=255, blank=True)
+    references = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"Email to {self.to_email}: {self.subject}"
+
+
+class InboundEvent(models.Model):
+    """
+    Входящее событие любого не-веб канала (письмо, апдейт Telegram, запрос API).
+    Каналы только записывают событие, а обработку (тикет, AI-ответ) выполняют
+    потребители очереди: с арендой, повторами и порядком внутри диалога.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_LEASED = "leased"
+    STATUS_DONE = "done"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_LEASED, "Leased"),
+        (STATUS_DONE, "Done"),
+    ]
+
+    # Меньше - раньше: события диалогов с приоритетными тикетами обслуживаются первыми
+    PRIORITY_RANKS = {
+        Ticket.PRIORITY_HIGH: 0,
+        Ticket.PRIORITY_MEDIUM: 1,
+        Ticket.PRIORITY_LOW: 2,
+    }
+
+    channel = models.CharField(max_length=20, choices=Channel.CHANNEL_CHOICES)
+    conversation_key = models.CharField(max_length=255, help_text="канал:пользователь - порядок обработки внутри диалога")
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    priority = models.SmallIntegerField(default=1)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    lease_owner = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "priority", "available_at"]),
+            models.Index(fields=["conversation_key", "status"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"Inbound {self.channel} event {self.id} ({self.status})"
+
+
+class DeadLetterEvent(models.Model):
+    """Событие, которое не удалось обработать за допустимое число попыток"""
+    original_id = models.BigIntegerField()
+    channel = models.CharField(max_length=20, choices=Channel.CHANNEL_CHOICES)
+    conversation_key = models.CharField(max_length=255)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField()
+    failed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"Dead letter {self.channel} event {self.original_id}"
+
+
+class OutboundMessage(models.Model):
+    """
+    Сообщение клиенту в канал, из которого пришёл тикет (ответ оператора или AI).
+    Доставляет OutboundDispatcher с повторами; статус доставки виден оператору.
+    """
+    STATUS_PENDING = "pending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name="outbound_messages")
+    message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        related_name="deliveries",
+        null=True,
+        blank=True,
+    )
+    channel = models.CharField(max_length=20, choices=Channel.CHANNEL_CHOICES)
+    recipient = models.CharField(max_length=255, help_text="chat_id, email или телефон получателя")
+    text = models.TextField()
+    # Разметка текста для канала: "HTML" у ответов AI в Telegram, пусто - обычный текст оператора
+    parse_mode = models.CharField(max_length=20, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    provider_message_id = models.CharField(max_length=255, blank=True, db_index=True)
+    # Сколько частей длинного сообщения уже отправлено: повтор продолжает со следующей
+    parts_sent = models.IntegerField(default=0)
+    # Статус от провайдера по callback (WhatsApp: sent/delivered/read/failed)
+    provider_status = models.CharField(max_length=20, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"Outbound {self.channel} message to {self.recipient} ({self.status})"
+
+
+class OutboundMessagePart(models.Model):
+    """
+    Часть длинного исходящего сообщения с собственным id у провайдера (WhatsApp: wamid).
+    Статусы доставки частей применяются к сообщению целиком.
+    """
+    outbound = models.ForeignKey(OutboundMessage, on_delete=models.CASCADE, related_name="parts")
+    index = models.IntegerField()
+    provider_message_id = models.CharField(max_length=255, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [("outbound", "index")]
+
+    def __str__(self) -> str:
+        return f"Part {self.index + 1} of outbound {self.outbound_id}"
+
+
+class WorkerLease(models.Model):
+    """
+    Аренда роли воркера (лидер Telegram-поллера, слушатель почтового ящика).
+    Роль выполняет только держатель непросроченной аренды; fencing_token растёт
+    при каждой смене держателя, и записи состояния принимаются только с текущим токеном.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    holder = models.CharField(max_length=255, blank=True)
+    fencing_token = models.BigIntegerField(default=0)
+    expires_at = models.DateTimeField(default=timezone.now)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    state = models.JSONField(default=dict, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.name} -> {self.holder or '-'} (token {self.fencing_token})"
+
+
+class SenderReputation(models.Model):
+    """Счётчики префильтра по отправителю: сколько сообщений принято, отложено и отброшено"""
+    channel = models.CharField(max_length=20, choices=Channel.CHANNEL_CHOICES)
+    identifier = models.CharField(max_length=255)
+    accepted = models.IntegerField(default=0)
+    quarantined = models.IntegerField(default=0)
+    dropped = models.IntegerField(default=0)
+    # Подтверждённый оператором спам
+    spam = models.IntegerField(default=0)
+    blocked = models.BooleanField(default=False)
+    first_seen = models.DateTimeField(auto_now_add=True)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["channel", "identifier"], name="unique_sender_reputation"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.channel}:{self.identifier} (+{self.accepted}/-{self.quarantined + self.dropped})"
+
+
+class QuarantinedMessage(models.Model):
+    """Сообщение, отложенное префильтром: оператор выпускает его в очередь или подтверждает спам"""
+    STATUS_QUARANTINED = "quarantined"
+    STATUS_RELEASED = "released"
+    STATUS_SPAM = "spam"
+
+    STATUS_CHOICES = [
+        (STATUS_QUARANTINED, "Quarantined"),
+        (STATUS_RELEASED, "Released"),
+        (STATUS_SPAM, "Spam"),
+    ]
+
+    channel = models.CharField(max_length=20, choices=Channel.CHANNEL_CHOICES)
+    user_identifier = models.CharField(max_length=255)
+    reason = models.CharField(max_length=50)
+    score = models.FloatField(null=True, blank=True, help_text="Вероятность спама по модели")
+    payload = models.JSONField(default=dict)
+    # Повторная доставка того же сообщения (ретрай webhook) не создаёт вторую запись
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUARANTINED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    reviewed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"Quarantined {self.channel} message from {self.user_identifier} ({self.reason})"
+
+
+class SpamModel(models.Model):
+    """Счётчики слов наивного байесовского классификатора; version растёт при каждом обучении"""
+    name = models.CharField(max_length=50, unique=True, default="default")
+    version = models.IntegerField(default=0)
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Spam model {self.name} v{self.version}"
+
+
+class TicketRollup(models.Model):
+    """
+    Агрегаты тикетов за час или день по измерениям (категория, канал, отдел,
+    приоритет). Строки пересчитываются целиком для затронутых корзин
+    (tickets.rollups), дашборд читает только их.
+    """
+    GRANULARITY_HOUR = "hour"
+    GRANULARITY_DAY = "day"
+
+    GRANULARITY_CHOICES = [
+        (GRANULARITY_HOUR, "Hour"),
+        (GRANULARITY_DAY, "Day"),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField(help_text="Начало часа (UTC) или местных суток")
+    category = models.CharField(max_length=20)
+    channel = models.CharField(max_length=20)
+    department = models.CharField(max_length=20)
+    priority = models.CharField(max_length=20)
+    ticket_count = models.IntegerField(default=0)
+    auto_solved_count = models.IntegerField(default=0)
+    escalated_count = models.IntegerField(default=0)
+    closed_count = models.IntegerField(default=0)
+    message_count = models.IntegerField(default=0)
+    # Суммы секунд до первого ответа и число тикетов с ответом: среднее = сумма / число
+    bot_reply_count = models.IntegerField(default=0)
+    bot_reply_seconds = models.FloatField(default=0)
+    operator_reply_count = models.IntegerField(default=0)
+    operator_reply_seconds = models.FloatField(default=0)
+    # Оценки ответов AI: число оценок и сумма (+1 полезно, -1 нет)
+    rating_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    # Квантильные скетчи (tickets.sketches.DDSketch) в секундах: объединяются для любого периода
+    bot_reply_sketch = models.BinaryField(null=True, blank=True)
+    operator_reply_sketch = models.BinaryField(null=True, blank=True)
+    resolution_sketch = models.BinaryField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["granularity", "bucket", "category", "channel", "department", "priority"],
+                name="unique_rollup_bucket",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"Rollup {self.granularity} {self.bucket:%Y-%m-%d %H:%M} {self.category}/{self.channel}"
+
+
+class RollupWatermark(models.Model):
+    """Докуда (по Ticket.updated_at) изменения уже учтены в агрегатах"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.DateTimeField(null=True, blank=True)
+    tickets_seen = models.IntegerField(default=0, help_text="Изменённых тикетов в последнем проходе")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Watermark {self.name}: {self.position}"
+
 
 class KnowledgeArticle(models.Model):
     """База знаний - статьи с решениями проблем"""
@@ -224,8 +668,9 @@ class KnowledgeArticle(models.Model):
     
     def increment_views(self):
         """Увеличивает счётчик просмотров"""
+        # Атомарный UPDATE: статья могла быть прочитана с отстающей реплики
+        KnowledgeArticle.objects.filter(pk=self.pk).update(views_count=models.F("views_count") + 1)
         self.views_count += 1
-        self.save(update_fields=["views_count"])
     
     def mark_helpful(self, is_helpful: bool):
         """Отмечает статью как полезную или нет"""
@@ -262,6 +707,14 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Непрочитанные уведомления оператора, новые первыми
+            models.Index(
+                fields=["operator", "-created_at"],
+                condition=models.Q(is_read=False),
+                name="notification_operator_unread",
+            ),
+        ]
 
     def __str__(self) -> str:
         return f"Notification for {self.operator.username}: {self.message}"
@@ -0,0 +1,353 @@
+"""
+Доставка сообщений клиенту в канал, из которого пришёл тикет
+
+Ответ оператора (или AI) только записывается в OutboundMessage, а
+OutboundDispatcher забирает сообщения пачками и отправляет их через транспорт
+канала: Telegram и WhatsApp - через общие клиенты с пулом соединений и
+лимитами, email - через очередь исходящих писем (EmailOutboxSender) с
+заголовками цепочки.
+Каждый канал отправляет в своём пуле потоков; сообщения одному получателю
+уходят строго по порядку. Неудачные попытки повторяются с экспоненциальной задержкой.
+"""
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .integrations.email_outbox import enqueue_email, reply_subject
+from .integrations.email_threading import parse_message_ids
+from .integrations.telegram_client import get_telegram_client, split_message
+from .integrations.whatsapp_client import MAX_TEXT_LENGTH as WHATSAPP_MAX_TEXT_LENGTH
+from .integrations.whatsapp_client import WhatsAppError, get_whatsapp_client
+from .metrics import get_metrics
+from .models import Channel, EmailReference, Message, OutboundMessage, OutboundMessagePart, Ticket
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("outbound")
+
+
+class DeliveryError(Exception):
+    """Транспорт не смог доставить сообщение (попытка будет повторена)"""
+
+
+class TelegramTransport:
+    """Отправка в чат Telegram; лимиты и повторы 429 - в TelegramBotClient"""
+
+    def __init__(self):
+        self.client = get_telegram_client()
+
+    def send(self, outbound: OutboundMessage) -> str:
+        # Части отправляются по одной и отмечаются в parts_sent: если отправка
+        # оборвалась на середине, повтор не дублирует уже доставленные части
+        chunks = split_message(outbound.text, html=outbound.parse_mode == "HTML")
+        message_ids = [message_id for message_id in outbound.provider_message_id.split(",") if message_id]
+        for index in range(outbound.parts_sent, len(chunks)):
+            sent = self.client.send_message_ids(outbound.recipient, chunks[index], outbound.parse_mode or None)
+            if sent is None:
+                raise DeliveryError(
+                    f"sendMessage failed for chat {outbound.recipient} at part {index + 1}/{len(chunks)}"
+                )
+            message_ids.extend(str(message_id) for message_id in sent if message_id)
+            outbound.parts_sent = index + 1
+            outbound.provider_message_id = ",".join(message_ids)[:255]
+            OutboundMessage.objects.filter(id=outbound.id).update(
+                parts_sent=outbound.parts_sent,
+                provider_message_id=outbound.provider_message_id,
+            )
+        return outbound.provider_message_id
+
+
+class WhatsAppTransport:
+    """Отправка через Cloud API; статусы delivered/read приходят webhook'ом по wamid"""
+
+    def __init__(self):
+        self.client = get_whatsapp_client()
+
+    def send(self, outbound: OutboundMessage) -> str:
+        # Как в Telegram: части по одной, повтор продолжает с parts_sent. wamid каждой
+        # части - в OutboundMessagePart, по ним сопоставляются статусы доставки
+        chunks = split_message(outbound.text, WHATSAPP_MAX_TEXT_LENGTH)
+        for index in range(outbound.parts_sent, len(chunks)):
+            message_ids = self.client.send_text(outbound.recipient, chunks[index])
+            if not message_ids:
+                raise DeliveryError(
+                    f"WhatsApp returned no message id for {outbound.recipient} at part {index + 1}/{len(chunks)}"
+                )
+            fields = {"parts_sent": index + 1}
+            if index == 0:
+                fields["provider_message_id"] = message_ids[0][:255]
+            with transaction.atomic():
+                OutboundMessagePart.objects.create(outbound=outbound, index=index, provider_message_id=message_ids[0][:255])
+                OutboundMessage.objects.filter(id=outbound.id).update(**fields)
+            for name, value in fields.items():
+                setattr(outbound, name, value)
+        return outbound.provider_message_id
+
+
+class EmailTransport:
+    """Письмо в цепочку тикета: ставится в очередь OutboundEmail, её отправляет EmailOutboxSender"""
+
+    def send(self, outbound: OutboundMessage) -> str:
+        ticket = outbound.ticket
+        last_reference = (
+            EmailReference.objects.filter(ticket=ticket).order_by("-id").values_list("message_id", flat=True).first()
+        )
+        references = list(dict.fromkeys(parse_message_ids(ticket.external_id) + parse_message_ids(last_reference)))
+        email = enqueue_email(
+            to_email=outbound.recipient,
+            subject=reply_subject(ticket.subject),
+            body=outbound.text,
+            in_reply_to=last_reference or "",
+            references=" ".join(references),
+            ticket=ticket,
+        )
+        return email.message_id
+
+
+def default_transports() -> Dict[str, object]:
+    return {
+        Channel.CHANNEL_TELEGRAM: TelegramTransport(),
+        Channel.CHANNEL_EMAIL: EmailTransport(),
+        Channel.CHANNEL_WHATSAPP: WhatsAppTransport(),
+    }
+
+
+def resolve_recipient(ticket: Ticket) -> Optional[str]:
+    """
+    Адрес клиента в канале тикета. None - канал без исходящей доставки
+    (веб-чат и API забирают сообщения сами).
+    """
+    author = ticket.author
+    if ticket.channel == Channel.CHANNEL_TELEGRAM:
+        # external_id - chat_id; для старых тикетов берём id пользователя (личный чат)
+        if ticket.external_id:
+            return ticket.external_id
+        prefix = f"{Channel.CHANNEL_TELEGRAM}_"
+        return author.username[len(prefix):] if author.username.startswith(prefix) else None
+    if ticket.channel == Channel.CHANNEL_EMAIL:
+        return author.email or None
+    if ticket.channel == Channel.CHANNEL_WHATSAPP:
+        if ticket.external_id:
+            return ticket.external_id
+        prefix = f"{Channel.CHANNEL_WHATSAPP}_"
+        if author.username.startswith(prefix):
+            return author.username[len(prefix):]
+        return getattr(author, "phone", "") or None
+    return None
+
+
+def enqueue_outbound(
+    ticket: Ticket,
+    text: str,
+    message: Optional[Message] = None,
+    parse_mode: str = "",
+) -> Optional[OutboundMessage]:
+    """
+    Ставит сообщение в очередь доставки в канал тикета и сразу возвращает управление.
+    parse_mode - разметка текста для транспорта (Telegram: "HTML"), по умолчанию обычный текст.
+    """
+    recipient = resolve_recipient(ticket)
+    if not recipient:
+        return None
+    outbound = OutboundMessage.objects.create(
+        ticket=ticket,
+        message=message,
+        channel=ticket.channel,
+        recipient=recipient,
+        text=text,
+        parse_mode=parse_mode,
+    )
+    metrics.incr("enqueued", channel=ticket.channel)
+    return outbound
+
+
+class OutboundDispatcher:
+    """Отправляет сообщения из OutboundMessage через транспорты каналов"""
+
+    def __init__(self, batch_size: Optional[int] = None, transports: Optional[Dict[str, object]] = None):
+        self.batch_size = batch_size or getattr(settings, "OUTBOUND_BATCH_SIZE", 100)
+        self.max_attempts = getattr(settings, "OUTBOUND_MAX_ATTEMPTS", 6)
+        self.retry_base = getattr(settings, "OUTBOUND_RETRY_BASE", 15)
+        self.lock_seconds = getattr(settings, "OUTBOUND_LOCK_SECONDS", 300)
+        self.poll_interval = getattr(settings, "OUTBOUND_POLL_INTERVAL", 1)
+        self.transports = transports if transports is not None else default_transports()
+        channel_workers = getattr(settings, "OUTBOUND_CHANNEL_WORKERS", {})
+        self.pools = {
+            channel: ThreadPoolExecutor(
+                max_workers=channel_workers.get(channel, 4),
+                thread_name_prefix=f"outbound-{channel}",
+            )
+            for channel in self.transports
+        }
+
+    def _claim_batch(self) -> List[OutboundMessage]:
+        """
+        Условный UPDATE по locked_until: несколько диспетчеров не отправят сообщение дважды.
+        Сообщение получателю берётся, только если все более ранние его неотправленные
+        сообщения (ждущие повтора, занятые другим диспетчером) тоже в этой пачке.
+        """
+        now = timezone.now()
+        candidates = list(
+            OutboundMessage.objects.filter(status=OutboundMessage.STATUS_PENDING, next_attempt_at__lte=now)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by("id")
+            .values_list("id", "locked_until", "channel", "recipient")[:self.batch_size]
+        )
+        if not candidates:
+            return []
+
+        ready = {outbound_id for outbound_id, _, _, _ in candidates}
+        earlier = (
+            OutboundMessage.objects.filter(
+                status=OutboundMessage.STATUS_PENDING,
+                id__lte=candidates[-1][0],
+                recipient__in={recipient for _, _, _, recipient in candidates},
+            )
+            .order_by("id")
+            .values_list("id", "channel", "recipient")
+        )
+        blocked = set()
+        allowed = set()
+        for outbound_id, channel, recipient in earlier:
+            if (channel, recipient) in blocked:
+                continue
+            if outbound_id in ready:
+                allowed.add(outbound_id)
+            else:
+                blocked.add((channel, recipient))
+
+        lock_until = now + timedelta(seconds=self.lock_seconds)
+        claimed_ids = []
+        for outbound_id, previous_lock, channel, recipient in candidates:
+            if outbound_id not in allowed or (channel, recipient) in blocked:
+                continue
+            claimed = OutboundMessage.objects.filter(
+                id=outbound_id,
+                status=OutboundMessage.STATUS_PENDING,
+                locked_until=previous_lock,
+            ).update(locked_until=lock_until)
+            if claimed:
+                claimed_ids.append(outbound_id)
+            else:
+                # Сообщение забрал другой диспетчер - следующие этому получателю ждут его
+                blocked.add((channel, recipient))
+        return list(OutboundMessage.objects.filter(id__in=claimed_ids).select_related("ticket").order_by("id"))
+
+    def dispatch_pending(self) -> int:
+        """Отправляет одну пачку, возвращает число доставленных сообщений"""
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+
+        # Сообщения одному получателю - последовательно, разным - параллельно
+        groups: "OrderedDict[tuple, List[OutboundMessage]]" = OrderedDict()
+        for outbound in batch:
+            groups.setdefault((outbound.channel, outbound.recipient), []).append(outbound)
+
+        futures = []
+        for (channel, _recipient), group in groups.items():
+            pool = self.pools.get(channel)
+            if pool is None:
+                for outbound in group:
+                    self._mark_failed(outbound, DeliveryError(f"No transport for channel {channel}"), final=True)
+                continue
+            futures.append(pool.submit(self._send_group, group))
+
+        sent = sum(future.result() for future in futures)
+        logger.info(f"Outbound dispatcher: sent {sent}/{len(batch)}")
+        return sent
+
+    def _send_group(self, group: List[OutboundMessage]) -> int:
+        sent = 0
+        try:
+            for index, outbound in enumerate(group):
+                if not self._send_one(outbound):
+                    # Следующие сообщения этому получателю ждут повтора неудачного, чтобы не нарушить порядок
+                    retry_at = (
+                        OutboundMessage.objects.filter(id=outbound.id)
+                        .values_list("next_attempt_at", flat=True)
+                        .first()
+                    )
+                    OutboundMessage.objects.filter(id__in=[o.id for o in group[index + 1:]]).update(
+                        locked_until=None,
+                        next_attempt_at=max(retry_at or timezone.now(), timezone.now()),
+                    )
+                    break
+                sent += 1
+        finally:
+            close_old_connections()
+        return sent
+
+    def _send_one(self, outbound: OutboundMessage) -> bool:
+        started = time.monotonic()
+        try:
+            provider_message_id = self.transports[outbound.channel].send(outbound)
+        except WhatsAppError as e:
+            # Ошибки вроде неверного номера повторять бессмысленно
+            self._mark_failed(outbound, e, final=not e.retryable)
+            return False
+        except Exception as e:
+            self._mark_failed(outbound, e)
+            return False
+        finally:
+            metrics.observe("send_seconds", time.monotonic() - started, channel=outbound.channel)
+
+        OutboundMessage.objects.filter(id=outbound.id).update(
+            status=OutboundMessage.STATUS_SENT,
+            provider_message_id=(provider_message_id or "")[:255],
+            attempts=outbound.attempts + 1,
+            sent_at=timezone.now(),
+            locked_until=None,
+            last_error="",
+        )
+        metrics.incr("sent", channel=outbound.channel)
+        return True
+
+    def _mark_failed(self, outbound: OutboundMessage, error: Exception, final: bool = False) -> None:
+        attempts = outbound.attempts + 1
+        if final or attempts >= self.max_attempts:
+            status = OutboundMessage.STATUS_FAILED
+            next_attempt_at = outbound.next_attempt_at
+            metrics.incr("failed", channel=outbound.channel)
+            logger.error(f"Giving up on {outbound.channel} message {outbound.id} to {outbound.recipient}: {error}")
+        else:
+            status = OutboundMessage.STATUS_PENDING
+            next_attempt_at = timezone.now() + timedelta(seconds=self.retry_base * 2 ** (attempts - 1))
+            metrics.incr("retried", channel=outbound.channel)
+            logger.warning(f"Failed to deliver {outbound.channel} message {outbound.id} (attempt {attempts}): {error}")
+
+        OutboundMessage.objects.filter(id=outbound.id).update(
+            status=status,
+            attempts=attempts,
+            next_attempt_at=next_attempt_at,
+            locked_until=None,
+            last_error=str(error)[:1000],
+        )
+
+    def close(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+    def run(self, stop_event) -> None:
+        """Доставляет сообщения до stop_event; текущая пачка дорабатывается до конца"""
+        try:
+            while not stop_event.is_set():
+                close_old_connections()
+                try:
+                    sent = self.dispatch_pending()
+                except Exception as e:
+                    logger.error(f"Outbound dispatcher error: {e}")
+                    sent = 0
+                if not sent:
+                    stop_event.wait(self.poll_interval)
+        finally:
+            self.close()
+            close_old_connections()
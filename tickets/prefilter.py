@@ -0,0 +1,438 @@
+"""
+Префильтр входящих сообщений перед очередью входящих
+
+Автоответы, рассылки, возвраты писем и спам отсекаются до inbound_bus, то есть
+без пользователя, тикета и вызова LLM. Проверки идут от дешёвых к дорогим:
+1. заголовки письма (Auto-Submitted, Precedence, List-Id, отчёты о доставке);
+2. репутация отправителя и лимит частоты его сообщений;
+3. наивный байесовский классификатор по словам сообщения (SpamModel).
+Автоответы и возвраты отбрасываются, подозрительное откладывается в
+QuarantinedMessage: оператор выпускает сообщение в очередь или подтверждает спам,
+и оба решения дообучают классификатор.
+"""
+import email.utils
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from email.message import Message as EmailMessage
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .integrations.telegram_client import TokenBucket
+from .metrics import get_metrics
+from .models import OutboundEmail, QuarantinedMessage, SenderReputation, SpamModel
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("prefilter")
+
+ACCEPT = "accept"
+QUARANTINE = "quarantine"
+DROP = "drop"
+
+# Поле SenderReputation, которое увеличивается при каждом решении
+COUNTER_FIELDS = {ACCEPT: "accepted", QUARANTINE: "quarantined", DROP: "dropped"}
+
+BOUNCE_SENDERS = {"mailer-daemon", "postmaster"}
+BOUNCE_SUBJECT_RE = re.compile(
+    r"undeliver|delivery status notification|returned mail|delivery failure|failure notice|не доставлено|недоставлен",
+    re.IGNORECASE,
+)
+RECIPIENT_RE = re.compile(r"(?:Final|Original)-Recipient:\s*rfc822;\s*<?([^\s<>;]+@[^\s<>;]+)>?", re.IGNORECASE)
+DIAGNOSTIC_RE = re.compile(r"Diagnostic-Code:\s*(?:smtp;\s*)?(.+)", re.IGNORECASE)
+ADDRESS_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+# Слова (без цифр) и ссылки; цифры - номера договоров и телефоны, они не говорят о спаме
+TOKEN_RE = re.compile(r"https?://|[^\W\d_]{2,30}")
+MAX_TEXT_CHARS = 5000
+
+
+class Verdict:
+    """Решение префильтра: accept, quarantine или drop с причиной"""
+
+    def __init__(self, action: str, reason: str = "", score: Optional[float] = None):
+        self.action = action
+        self.reason = reason
+        self.score = score
+
+    @property
+    def accepted(self) -> bool:
+        return self.action == ACCEPT
+
+    def __repr__(self) -> str:
+        return f"Verdict({self.action}, {self.reason or '-'}, score={self.score})"
+
+
+ACCEPTED = Verdict(ACCEPT)
+
+
+def _enabled_for(channel: str) -> bool:
+    return getattr(settings, "PREFILTER_ENABLED", True) and channel in getattr(
+        settings, "PREFILTER_CHANNELS", ("email", "telegram", "whatsapp")
+    )
+
+
+# ---------------------------------------------------------------------------
+# Заголовки писем и возвраты
+# ---------------------------------------------------------------------------
+
+def check_email_headers(headers: EmailMessage) -> Optional[Verdict]:
+    """Решение по заголовкам письма или None, если по ним ничего не понятно"""
+    sender = email.utils.parseaddr(headers.get("From") or "")[1].lower()
+    content_type = (headers.get("Content-Type") or "").lower().replace('"', "")
+    subject = headers.get("Subject") or ""
+
+    if (
+        "report-type=delivery-status" in content_type
+        or headers.get("X-Failed-Recipients")
+        or sender.split("@")[0] in BOUNCE_SENDERS
+        or ((headers.get("Return-Path") or "").strip() == "<>" and BOUNCE_SUBJECT_RE.search(subject))
+    ):
+        return Verdict(DROP, "bounce")
+
+    # RFC 3834: всё, кроме "no", отправлено автоматически
+    auto_submitted = (headers.get("Auto-Submitted") or "").strip().lower()
+    if auto_submitted and not auto_submitted.startswith("no"):
+        return Verdict(DROP, "auto_reply")
+    if headers.get("X-Autoreply") or headers.get("X-Autorespond"):
+        return Verdict(DROP, "auto_reply")
+
+    precedence = (headers.get("Precedence") or "").strip().lower()
+    if precedence == "auto_reply":
+        return Verdict(DROP, "auto_reply")
+    # Рассылки не выбрасываем: это может быть письмо клиента через его CRM
+    if precedence in ("bulk", "junk", "list"):
+        return Verdict(QUARANTINE, "bulk")
+    if headers.get("List-Id") or headers.get("List-Unsubscribe"):
+        return Verdict(QUARANTINE, "mailing_list")
+    return None
+
+
+def parse_bounce(headers: EmailMessage, body: str) -> Tuple[List[str], str]:
+    """Адреса, на которые не удалось доставить письмо, и диагностика сервера"""
+    recipients = [
+        address.strip().lower()
+        for address in (headers.get("X-Failed-Recipients") or "").split(",")
+        if address.strip()
+    ]
+    recipients += [address.lower() for address in RECIPIENT_RE.findall(body or "")]
+    # Человекочитаемая часть отчёта обычно просто упоминает адрес
+    recipients += [address.lower() for address in ADDRESS_RE.findall(body or "")[:20]]
+
+    diagnostic = DIAGNOSTIC_RE.search(body or "")
+    return list(dict.fromkeys(recipients)), (diagnostic.group(1).strip() if diagnostic else "")
+
+
+def record_bounce(recipients: Iterable[str], diagnostic: str = "") -> int:
+    """Помечает недавно отправленные ответы этим адресатам как недоставленные"""
+    recipients = list(recipients)
+    if not recipients:
+        return 0
+    since = timezone.now() - timedelta(days=getattr(settings, "PREFILTER_BOUNCE_WINDOW_DAYS", 7))
+    latest_ids = []
+    for to_email in recipients:
+        latest = (
+            OutboundEmail.objects.filter(to_email__iexact=to_email, status=OutboundEmail.STATUS_SENT, sent_at__gte=since)
+            .order_by("-sent_at")
+            .values_list("id", flat=True)
+            .first()
+        )
+        if latest:
+            latest_ids.append(latest)
+    if not latest_ids:
+        return 0
+    marked = OutboundEmail.objects.filter(id__in=latest_ids).update(
+        status=OutboundEmail.STATUS_FAILED,
+        last_error=f"bounced: {diagnostic}"[:1000],
+    )
+    metrics.incr("bounces_recorded", marked)
+    return marked
+
+
+# ---------------------------------------------------------------------------
+# Репутация отправителя и лимит частоты
+# ---------------------------------------------------------------------------
+
+class _ReputationCache:
+    """Кэш репутации в процессе: чтение из БД не чаще раза в PREFILTER_REPUTATION_TTL на отправителя"""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._items: "OrderedDict[Tuple[str, str], Tuple[float, Tuple[bool, int, int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, channel: str, identifier: str) -> Tuple[bool, int, int]:
+        """(заблокирован, принято, мусор)"""
+        key = (channel, identifier)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._items.get(key)
+            if cached and cached[0] > now:
+                self._items.move_to_end(key)
+                return cached[1]
+
+        row = (
+            SenderReputation.objects.filter(channel=channel, identifier=identifier)
+            .values_list("blocked", "accepted", "quarantined", "dropped", "spam")
+            .first()
+        )
+        value = (row[0], row[1], row[2] + row[3] + row[4]) if row else (False, 0, 0)
+        with self._lock:
+            self._items[key] = (now + getattr(settings, "PREFILTER_REPUTATION_TTL", 60), value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return value
+
+    def invalidate(self, channel: str, identifier: str) -> None:
+        with self._lock:
+            self._items.pop((channel, identifier), None)
+
+
+_reputation = _ReputationCache()
+_buckets: "OrderedDict[Tuple[str, str], TokenBucket]" = OrderedDict()
+_buckets_lock = threading.Lock()
+
+
+def _flooding(channel: str, identifier: str) -> bool:
+    """Лимит сообщений от одного отправителя (PREFILTER_SENDER_RATE в минуту)"""
+    rate = getattr(settings, "PREFILTER_SENDER_RATE", 20) / 60
+    burst = getattr(settings, "PREFILTER_SENDER_BURST", 10)
+    key = (channel, identifier)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(rate, burst)
+            while len(_buckets) > 10000:
+                _buckets.popitem(last=False)
+        else:
+            _buckets.move_to_end(key)
+    # Долг не списывается: пока отправитель не притихнет, он остаётся над лимитом
+    return bucket.reserve() > 0
+
+
+def _count(channel: str, identifier: str, field: str, value: int = 1) -> None:
+    updates = {field: F(field) + value, "last_seen": timezone.now()}
+    rows = SenderReputation.objects.filter(channel=channel, identifier=identifier)
+    if rows.update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            SenderReputation.objects.create(channel=channel, identifier=identifier, **{field: value})
+    except IntegrityError:
+        rows.update(**updates)
+
+
+# ---------------------------------------------------------------------------
+# Наивный байесовский классификатор
+# ---------------------------------------------------------------------------
+
+def tokenize(text: str) -> Set[str]:
+    return {token.lower() for token in TOKEN_RE.findall((text or "")[:MAX_TEXT_CHARS])}
+
+
+class NaiveBayes:
+    """
+    Байесовский классификатор по наличию слов (spam/ham) со сглаживанием Лапласа.
+    data - словарь {"docs": {"spam": n, "ham": n}, "tokens": {"spam": {...}, "ham": {...}}}.
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        data = data or {}
+        self.docs = dict({"spam": 0, "ham": 0}, **data.get("docs", {}))
+        tokens = data.get("tokens", {})
+        self.tokens = {"spam": dict(tokens.get("spam", {})), "ham": dict(tokens.get("ham", {}))}
+
+    def learn(self, text: str, spam: bool) -> None:
+        label = "spam" if spam else "ham"
+        self.docs[label] += 1
+        counts = self.tokens[label]
+        for token in tokenize(text):
+            counts[token] = counts.get(token, 0) + 1
+
+    def is_ready(self, min_docs: int) -> bool:
+        return self.docs["spam"] >= min_docs and self.docs["ham"] >= min_docs
+
+    def spam_probability(self, text: str) -> float:
+        spam_docs, ham_docs = self.docs["spam"], self.docs["ham"]
+        log_spam = math.log((spam_docs + 1) / (spam_docs + ham_docs + 2))
+        log_ham = math.log((ham_docs + 1) / (spam_docs + ham_docs + 2))
+        for token in tokenize(text):
+            spam_count = self.tokens["spam"].get(token, 0)
+            ham_count = self.tokens["ham"].get(token, 0)
+            if not spam_count and not ham_count:
+                continue
+            log_spam += math.log((spam_count + 1) / (spam_docs + 2))
+            log_ham += math.log((ham_count + 1) / (ham_docs + 2))
+        diff = max(min(log_ham - log_spam, 50), -50)
+        return 1 / (1 + math.exp(diff))
+
+    def to_data(self, max_vocabulary: int) -> Dict[str, Any]:
+        """Сериализация; редкие слова отбрасываются, чтобы модель не росла бесконечно"""
+        vocabulary = set(self.tokens["spam"]) | set(self.tokens["ham"])
+        if len(vocabulary) > max_vocabulary:
+            totals = {
+                token: self.tokens["spam"].get(token, 0) + self.tokens["ham"].get(token, 0)
+                for token in vocabulary
+            }
+            vocabulary = set(sorted(totals, key=totals.get, reverse=True)[:max_vocabulary])
+        return {
+            "docs": self.docs,
+            "tokens": {
+                label: {token: count for token, count in counts.items() if token in vocabulary}
+                for label, counts in self.tokens.items()
+            },
+        }
+
+
+_model: Optional[NaiveBayes] = None
+_model_version = -1
+_model_checked = 0.0
+_model_lock = threading.Lock()
+
+
+def get_model() -> NaiveBayes:
+    """Модель в памяти процесса; новая версия подхватывается раз в PREFILTER_MODEL_RELOAD секунд"""
+    global _model, _model_version, _model_checked
+    with _model_lock:
+        now = time.monotonic()
+        if _model is not None and now - _model_checked < getattr(settings, "PREFILTER_MODEL_RELOAD", 60):
+            return _model
+        _model_checked = now
+        version = SpamModel.objects.filter(name="default").values_list("version", flat=True).first()
+        if _model is None or version != _model_version:
+            data = SpamModel.objects.filter(name="default").values_list("data", flat=True).first()
+            _model = NaiveBayes(data)
+            _model_version = version if version is not None else -1
+        return _model
+
+
+def train(samples: Iterable[Tuple[str, bool]], reset: bool = False) -> Dict[str, int]:
+    """Дообучает (или обучает заново) общую модель; samples - (текст, спам ли)"""
+    global _model_checked
+    with transaction.atomic():
+        record, _ = SpamModel.objects.select_for_update().get_or_create(name="default")
+        model = NaiveBayes(None if reset else record.data)
+        for text, spam in samples:
+            model.learn(text, spam)
+        record.data = model.to_data(getattr(settings, "PREFILTER_MAX_VOCABULARY", 50000))
+        record.version += 1
+        record.save(update_fields=["data", "version", "updated_at"])
+    # Этот процесс увидит новую версию при следующей проверке
+    _model_checked = 0.0
+    return dict(model.docs)
+
+
+def message_text(payload: Dict[str, Any]) -> str:
+    return f"{payload.get('subject') or ''}\n{payload.get('text') or ''}"
+
+
+# ---------------------------------------------------------------------------
+# Точка входа
+# ---------------------------------------------------------------------------
+
+def _classify(channel: str, identifier: str, payload: Dict[str, Any]) -> Verdict:
+    blocked, accepted, junk = _reputation.get(channel, identifier)
+    if blocked:
+        return Verdict(DROP, "blocked_sender")
+    if junk >= getattr(settings, "PREFILTER_REPUTATION_MIN_JUNK", 10) and junk >= 9 * accepted:
+        return Verdict(QUARANTINE, "bad_reputation")
+    if _flooding(channel, identifier):
+        return Verdict(QUARANTINE, "flood")
+
+    model = get_model()
+    if model.is_ready(getattr(settings, "PREFILTER_MIN_TRAINING_DOCS", 20)):
+        score = model.spam_probability(message_text(payload))
+        if score >= getattr(settings, "PREFILTER_SPAM_THRESHOLD", 0.97):
+            return Verdict(QUARANTINE, "spam", score)
+        return Verdict(ACCEPT, score=score)
+    return ACCEPTED
+
+
+def _quarantined_verdict(idempotency_key: str) -> Optional[Verdict]:
+    row = (
+        QuarantinedMessage.objects.filter(idempotency_key=idempotency_key)
+        .values_list("reason", "score")
+        .first()
+    )
+    return Verdict(QUARANTINE, row[0], row[1]) if row else None
+
+
+def screen(
+    channel: str,
+    user_identifier: str,
+    payload: Dict[str, Any],
+    idempotency_key: Optional[str] = None,
+    verdict: Optional[Verdict] = None,
+) -> Verdict:
+    """
+    Проверяет сообщение перед публикацией в очередь. verdict - решение, уже
+    принятое каналом (например, по заголовкам письма). Отложенное сообщение
+    сохраняется в QuarantinedMessage, отброшенное - только в счётчиках.
+    Повтор уже отложенного сообщения (тот же idempotency_key) возвращает
+    прежнее решение без повторной проверки и без счётчиков репутации.
+    """
+    if not _enabled_for(channel):
+        return ACCEPTED
+
+    if idempotency_key:
+        previous = _quarantined_verdict(idempotency_key[:255])
+        if previous is not None:
+            metrics.incr("duplicates", channel=channel)
+            return previous
+
+    started = time.monotonic()
+    try:
+        verdict = verdict or _classify(channel, user_identifier, payload)
+    except Exception as e:
+        # Сбой фильтра не должен терять сообщения клиентов
+        logger.error(f"Prefilter failed for {channel}:{user_identifier}: {e}")
+        metrics.incr("errors", channel=channel)
+        return ACCEPTED
+
+    if verdict.action == QUARANTINE:
+        try:
+            with transaction.atomic():
+                QuarantinedMessage.objects.create(
+                    channel=channel,
+                    user_identifier=user_identifier[:255],
+                    reason=verdict.reason,
+                    score=verdict.score,
+                    payload=payload,
+                    idempotency_key=idempotency_key[:255] if idempotency_key else None,
+                )
+        except IntegrityError:
+            # Параллельный повтор того же сообщения уже отложил и посчитал его
+            metrics.incr("duplicates", channel=channel)
+            return _quarantined_verdict(idempotency_key[:255]) or verdict
+    _count(channel, user_identifier[:255], COUNTER_FIELDS[verdict.action])
+
+    metrics.incr(verdict.action, channel=channel, reason=verdict.reason or "ok")
+    metrics.observe("screen_seconds", time.monotonic() - started, channel=channel)
+    if not verdict.accepted:
+        logger.info(f"Prefilter {verdict.action} {channel}:{user_identifier} ({verdict.reason})")
+    return verdict
+
+
+def confirm_spam(quarantined: QuarantinedMessage) -> None:
+    """Оператор подтвердил спам: дообучаем модель, после PREFILTER_BLOCK_AFTER случаев блокируем отправителя"""
+    train([(message_text(quarantined.payload), True)])
+    QuarantinedMessage.objects.filter(id=quarantined.id).update(
+        status=QuarantinedMessage.STATUS_SPAM,
+        reviewed_at=timezone.now(),
+    )
+    _count(quarantined.channel, quarantined.user_identifier, "spam")
+    SenderReputation.objects.filter(
+        channel=quarantined.channel,
+        identifier=quarantined.user_identifier,
+        spam__gte=getattr(settings, "PREFILTER_BLOCK_AFTER", 3),
+    ).update(blocked=True)
+    _reputation.invalidate(quarantined.channel, quarantined.user_identifier)
@@ -0,0 +1,363 @@
+"""
+Инкрементальные агрегаты тикетов для дашборда (TicketRollup)
+
+Проход refresh() берёт тикеты, изменённые после водяного знака (Ticket.updated_at
+с запасом ROLLUP_OVERLAP_SECONDS на транзакции, закоммиченные позже своего
+updated_at), находит часы их создания и пересчитывает эти часовые корзины
+целиком одним сканированием тикетов за каждый непрерывный интервал. Пересчёт
+корзины идемпотентен, поэтому повторная обработка тикета не искажает итоги, а
+тикет, сменивший категорию, уходит из старой строки. Суточные корзины (по
+местному времени) собираются из часовых строк затронутых суток. Стоимость
+прохода пропорциональна числу изменений, а не размеру таблицы.
+
+Удаление тикета updated_at не меняет: после массовых удалений выполните
+refresh_rollups --rebuild. Тикеты, перенесённые в архив (tickets.archive),
+учитываются при пересчёте корзин по архивному индексу.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .archive import get_reader, ticket_from_record
+from .leases import LeaderLease
+from .metrics import get_metrics
+from .models import RollupWatermark, Ticket, TicketRollup
+from .sketches import DDSketch, merge_serialized, percentiles
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("rollups")
+
+WATERMARK_NAME = "ticket_rollups"
+DIMENSIONS = ("category", "channel", "department", "priority")
+COUNTERS = (
+    "ticket_count",
+    "auto_solved_count",
+    "escalated_count",
+    "closed_count",
+    "message_count",
+    "bot_reply_count",
+    "bot_reply_seconds",
+    "operator_reply_count",
+    "operator_reply_seconds",
+    "rating_count",
+    "rating_sum",
+)
+# Скетчи времени (секунды): поле TicketRollup -> поле тикета, от created_at до которого считается время
+SKETCHES = {
+    "bot_reply_sketch": "first_bot_reply_at",
+    "operator_reply_sketch": "first_operator_reply_at",
+    "resolution_sketch": "closed_at",
+}
+# Поля тикета, которые читает Accumulator.add (кроме оценок)
+TICKET_FIELDS = (
+    "id",
+    "created_at",
+    "is_auto_solved",
+    "status",
+    "escalated_at",
+    "message_count",
+    "first_bot_reply_at",
+    "first_operator_reply_at",
+    "closed_at",
+    *DIMENSIONS,
+)
+HOUR = timedelta(hours=1)
+
+
+def hour_bucket(moment: datetime) -> datetime:
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(moment: datetime) -> datetime:
+    """Начало местных суток (TIME_ZONE), в которые попадает момент"""
+    local = timezone.localtime(moment)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class Accumulator:
+    """Суммы и скетчи одной строки агрегата; add - тикет, merge - другая строка"""
+
+    def __init__(self):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        self.sketches = {name: DDSketch() for name in SKETCHES}
+
+    def add(self, ticket: Dict[str, Any]) -> None:
+        self.ticket_count += 1
+        self.auto_solved_count += ticket["is_auto_solved"]
+        self.escalated_count += ticket["escalated_at"] is not None
+        self.closed_count += ticket["status"] == Ticket.STATUS_CLOSED
+        self.message_count += ticket["message_count"]
+        if ticket["first_bot_reply_at"]:
+            self.bot_reply_count += 1
+            self.bot_reply_seconds += max(0.0, (ticket["first_bot_reply_at"] - ticket["created_at"]).total_seconds())
+        if ticket["first_operator_reply_at"]:
+            self.operator_reply_count += 1
+            self.operator_reply_seconds += max(
+                0.0, (ticket["first_operator_reply_at"] - ticket["created_at"]).total_seconds()
+            )
+        self.rating_count += ticket["rating_count"]
+        self.rating_sum += ticket["rating_sum"] or 0
+        for name, field in SKETCHES.items():
+            if ticket[field]:
+                self.sketches[name].add(max(0.0, (ticket[field] - ticket["created_at"]).total_seconds()))
+
+    def merge(self, row: Any) -> None:
+        for name in COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(row, name))
+        for name in SKETCHES:
+            blob = getattr(row, name)
+            if blob:
+                self.sketches[name].merge(DDSketch.from_bytes(blob))
+
+    def as_fields(self) -> Dict[str, Any]:
+        fields = {name: getattr(self, name) for name in COUNTERS}
+        for name, sketch in self.sketches.items():
+            fields[name] = sketch.to_bytes() if sketch.count else None
+        return fields
+
+
+def _spans(hours: Iterable[datetime]) -> List[Tuple[datetime, datetime]]:
+    """Соседние часы склеиваются в интервалы [начало, конец) - по одному запросу на интервал"""
+    spans: List[Tuple[datetime, datetime]] = []
+    for hour in sorted(set(hours)):
+        if spans and spans[-1][1] == hour:
+            spans[-1] = (spans[-1][0], hour + HOUR)
+        else:
+            spans.append((hour, hour + HOUR))
+    return spans
+
+
+def _ticket_rows(start: datetime, end: datetime):
+    chunk_size = getattr(settings, "DB_ITERATOR_CHUNK_SIZE", 2000)
+    return (
+        Ticket.objects.filter(created_at__gte=start, created_at__lt=end)
+        .annotate(rating_count=Count("messages__rating"), rating_sum=Sum("messages__rating"))
+        .values(*TICKET_FIELDS, "rating_count", "rating_sum")
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _archived_rows(start: datetime, end: datetime, live_ids: set):
+    """Тикеты из архива, созданные в [start, end), которых уже нет в БД"""
+    for record in get_reader().records_created_between(start, end):
+        if record["ticket"]["id"] in live_ids:
+            continue
+        ticket = ticket_from_record(record)
+        ratings = [message.rating for message in ticket.archived_messages if message.rating is not None]
+        row = {name: getattr(ticket, name) for name in TICKET_FIELDS}
+        row.update(rating_count=len(ratings), rating_sum=sum(ratings) if ratings else None)
+        yield row
+
+
+def recompute_hours(hours: Iterable[datetime]) -> int:
+    """Пересчитывает часовые корзины и суточные, в которые они входят; возвращает число строк"""
+    spans = _spans(hour_bucket(hour) for hour in hours)
+    if not spans:
+        return 0
+
+    rows: Dict[Tuple, Accumulator] = {}
+    for start, end in spans:
+        live_ids = set()
+        for ticket in _ticket_rows(start, end):
+            live_ids.add(ticket["id"])
+            key = (hour_bucket(ticket["created_at"]),) + tuple(ticket[name] for name in DIMENSIONS)
+            rows.setdefault(key, Accumulator()).add(ticket)
+        for ticket in _archived_rows(start, end, live_ids):
+            key = (hour_bucket(ticket["created_at"]),) + tuple(ticket[name] for name in DIMENSIONS)
+            rows.setdefault(key, Accumulator()).add(ticket)
+
+    with transaction.atomic():
+        for start, end in spans:
+            TicketRollup.objects.filter(
+                granularity=TicketRollup.GRANULARITY_HOUR, bucket__gte=start, bucket__lt=end
+            ).delete()
+        TicketRollup.objects.bulk_create(
+            [
+                TicketRollup(
+                    granularity=TicketRollup.GRANULARITY_HOUR,
+                    bucket=key[0],
+                    **dict(zip(DIMENSIONS, key[1:])),
+                    **accumulator.as_fields(),
+                )
+                for key, accumulator in rows.items()
+            ],
+            batch_size=500,
+        )
+        days = {day_bucket(start + HOUR * offset) for start, end in spans for offset in range((end - start) // HOUR)}
+        written = len(rows) + _recompute_days(days)
+
+    metrics.incr("hours_recomputed", value=sum((end - start) // HOUR for start, end in spans))
+    return written
+
+
+def _recompute_days(days: Iterable[datetime]) -> int:
+    """Суточные строки - суммы часовых строк, чьё начало попадает в местные сутки"""
+    written = 0
+    for day in sorted(days):
+        next_day = day_bucket(day + timedelta(hours=36))
+        totals: Dict[Tuple, Accumulator] = {}
+        for row in TicketRollup.objects.filter(
+            granularity=TicketRollup.GRANULARITY_HOUR, bucket__gte=day, bucket__lt=next_day
+        ):
+            key = tuple(getattr(row, name) for name in DIMENSIONS)
+            totals.setdefault(key, Accumulator()).merge(row)
+
+        TicketRollup.objects.filter(granularity=TicketRollup.GRANULARITY_DAY, bucket=day).delete()
+        TicketRollup.objects.bulk_create([
+            TicketRollup(
+                granularity=TicketRollup.GRANULARITY_DAY,
+                bucket=day,
+                **dict(zip(DIMENSIONS, key)),
+                **accumulator.as_fields(),
+            )
+            for key, accumulator in totals.items()
+        ])
+        written += len(totals)
+    return written
+
+
+def refresh(rebuild: bool = False) -> Dict[str, Any]:
+    """
+    Один проход по изменениям после водяного знака. rebuild - пересчитать все
+    корзины с нуля (после удаления тикетов или смены логики агрегатов).
+    """
+    started = time.monotonic()
+    # Водяной знак - момент до чтения изменений: тикет, изменённый во время прохода, попадёт в следующий
+    now = timezone.now()
+    watermark, _ = RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+
+    changed = Ticket.objects.all()
+    if watermark.position is not None and not rebuild:
+        overlap = timedelta(seconds=getattr(settings, "ROLLUP_OVERLAP_SECONDS", 300))
+        changed = changed.filter(updated_at__gte=watermark.position - overlap)
+    hours = set(
+        changed.annotate(hour=TruncHour("created_at", tzinfo=dt_timezone.utc))
+        .values_list("hour", flat=True)
+        .distinct()
+        .order_by()
+    )
+    if rebuild:
+        hours |= get_reader().created_hours()
+    tickets_seen = changed.count()
+
+    with transaction.atomic():
+        if rebuild:
+            TicketRollup.objects.all().delete()
+        written = recompute_hours(hours)
+
+    RollupWatermark.objects.filter(id=watermark.id).update(
+        position=now, tickets_seen=tickets_seen, updated_at=timezone.now()
+    )
+    elapsed = time.monotonic() - started
+    metrics.incr("refreshes")
+    metrics.observe("refresh_seconds", elapsed)
+    return {"tickets": tickets_seen, "hours": len(hours), "rows": written, "seconds": round(elapsed, 3)}
+
+
+def freshness() -> Optional[datetime]:
+    """Время последнего прохода или None, если агрегаты ещё не строились"""
+    return RollupWatermark.objects.filter(name=WATERMARK_NAME).values_list("updated_at", flat=True).first()
+
+
+def daily_rows(date_from=None, date_to=None, **dimensions):
+    """Суточные строки за местные сутки [date_from, date_to] включительно; без границ - за всё время"""
+    rows = TicketRollup.objects.filter(granularity=TicketRollup.GRANULARITY_DAY)
+    tz = timezone.get_current_timezone()
+    if date_from:
+        rows = rows.filter(bucket__gte=datetime.combine(date_from, datetime.min.time(), tzinfo=tz))
+    if date_to:
+        rows = rows.filter(bucket__lt=datetime.combine(date_to + timedelta(days=1), datetime.min.time(), tzinfo=tz))
+    return rows.filter(**{name: value for name, value in dimensions.items() if name in DIMENSIONS and value})
+
+
+def hourly_rows(start: datetime, end: datetime, **dimensions):
+    """Часовые строки, чьё начало попадает в [start, end) - период с точностью до часа"""
+    rows = TicketRollup.objects.filter(
+        granularity=TicketRollup.GRANULARITY_HOUR, bucket__gte=hour_bucket(start), bucket__lt=end
+    )
+    return rows.filter(**{name: value for name, value in dimensions.items() if name in DIMENSIONS and value})
+
+
+def latency_percentiles(rows) -> Dict[str, Dict[str, Any]]:
+    """
+    p50/p90/p99 (секунды) времени первого ответа бота, оператора и решения:
+    скетчи строк объединяются, память не зависит от числа тикетов.
+    """
+    chunk_size = getattr(settings, "DB_ITERATOR_CHUNK_SIZE", 2000)
+    result = {}
+    for name in SKETCHES:
+        sketch = merge_serialized(rows.values_list(name, flat=True).iterator(chunk_size=chunk_size))
+        key = name[: -len("_sketch")]
+        result[key] = {"count": sketch.count, "mean": sketch.mean, **percentiles(sketch)}
+    return result
+
+
+def summary(date_from=None, date_to=None) -> Dict[str, Any]:
+    """Итоги для дашборда за местные сутки [date_from, date_to]; без границ - за всё время"""
+    rollups = daily_rows(date_from, date_to)
+
+    totals = rollups.aggregate(**{name: Sum(name) for name in COUNTERS})
+    totals = {name: value or 0 for name, value in totals.items()}
+    by_category = list(
+        rollups.values("category").annotate(count=Sum("ticket_count")).order_by("category")
+    )
+    by_channel = list(
+        rollups.values("channel").annotate(count=Sum("ticket_count")).order_by("-count")
+    )
+    return {
+        "totals": totals,
+        "by_category": by_category,
+        "by_channel": by_channel,
+        "auto_solved_percent": (
+            totals["auto_solved_count"] / totals["ticket_count"] * 100 if totals["ticket_count"] else 0
+        ),
+        "avg_bot_reply_seconds": (
+            totals["bot_reply_seconds"] / totals["bot_reply_count"] if totals["bot_reply_count"] else 0
+        ),
+        "avg_operator_reply_seconds": (
+            totals["operator_reply_seconds"] / totals["operator_reply_count"]
+            if totals["operator_reply_count"] else 0
+        ),
+        "rating_percent": (
+            (totals["rating_sum"] + totals["rating_count"]) / 2 / totals["rating_count"] * 100
+            if totals["rating_count"] else None
+        ),
+        "latency": latency_percentiles(rollups),
+    }
+
+
+class RollupRefresher:
+    """Роль воркера: периодический refresh() на одном узле (аренда rollups:refresher)"""
+
+    LEASE_NAME = "rollups:refresher"
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval or getattr(settings, "ROLLUP_INTERVAL", 60)
+        self.lease = LeaderLease(self.LEASE_NAME)
+
+    def run(self, stop_event) -> None:
+        try:
+            self.lease.run_while_leader(stop_event, self._refresh_as_leader)
+        finally:
+            close_old_connections()
+
+    def _refresh_as_leader(self, leader_stop) -> None:
+        while not leader_stop.is_set():
+            close_old_connections()
+            try:
+                result = refresh()
+                if result["tickets"]:
+                    logger.info(f"Rollups refreshed: {result}")
+            except Exception as e:
+                logger.error(f"Rollup refresh error: {e}")
+            leader_stop.wait(self.interval)
@@ -0,0 +1,117 @@
+"""
+Обработчики сигналов моделей тикетов
+
+Счётчики переписки на Ticket (message_count, last_message_at, first_bot_reply_at,
+first_operator_reply_at) обновляются одним UPDATE с F()-выражениями при создании
+сообщения: параллельные сообщения одного тикета не теряют приращения, а отчётам
+не нужно сканировать Message. bulk_create сигналы не вызывает - после массовой
+загрузки запустите backfill_ticket_counters.
+
+Счётчики ссылок на файлы хранилища вложений (MediaBlob, tickets.media_store)
+меняются при сохранении и удалении Message и TelegramMedia; для UPDATE в обход
+save() их меняет вызывающий код, расхождения исправляет gc_media --recount.
+"""
+from django.db.models import Case, F, Q, QuerySet, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .media_store import adjust_references
+from .models import Message, TelegramMedia, Ticket
+
+# Ответ оператора: не бот и отправитель не автор тикета. OPERATOR_REPLY_Q - условие
+# относительно Message (backfill_ticket_counters); при создании сообщения автор
+# сравнивается внутри UPDATE тикета, без отдельного SELECT
+OPERATOR_REPLY_Q = Q(is_bot=False, sender__isnull=False) & ~Q(sender_id=F("ticket__author_id"))
+
+
+@receiver(pre_save, sender=Ticket, dispatch_uid="tickets.ticket_closed_at")
+def stamp_closed_at(sender, instance: Ticket, raw: bool = False, **kwargs):
+    # Закрытие через save() (админка, формы); условный UPDATE в ticket_lifecycle.reopen сбрасывает поле сам
+    if raw:
+        return
+    if instance.status == Ticket.STATUS_CLOSED:
+        if instance.closed_at is None:
+            instance.closed_at = timezone.now()
+    else:
+        instance.closed_at = None
+
+
+@receiver(post_save, sender=Message, dispatch_uid="tickets.message_counters")
+def update_ticket_counters(sender, instance: Message, created: bool, raw: bool = False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if not created:
+        # Оценка ответа меняет агрегаты тикета: сдвигаем updated_at, чтобы тикет попал
+        # в следующий проход tickets.rollups
+        if update_fields is None or "rating" in update_fields:
+            Ticket.objects.filter(id=instance.ticket_id).update(updated_at=timezone.now())
+        return
+    sent_at = Value(instance.created_at)
+    fields = {
+        # .update() не трогает auto_now; updated_at - водяной знак агрегатов (tickets.rollups)
+        "updated_at": timezone.now(),
+        "message_count": F("message_count") + 1,
+        # Greatest с NULL даёт NULL в SQLite, поэтому пустое значение заменяем датой сообщения
+        "last_message_at": Greatest(Coalesce("last_message_at", sent_at), sent_at),
+    }
+    if instance.is_bot:
+        fields["first_bot_reply_at"] = Coalesce("first_bot_reply_at", sent_at)
+    elif instance.sender_id is not None:
+        fields["first_operator_reply_at"] = Case(
+            When(author_id=instance.sender_id, then=F("first_operator_reply_at")),
+            default=Coalesce("first_operator_reply_at", sent_at),
+        )
+    Ticket.objects.filter(id=instance.ticket_id).update(**fields)
+
+
+@receiver(post_delete, sender=Message, dispatch_uid="tickets.message_counters_delete")
+def decrement_ticket_counters(sender, instance: Message, origin=None, **kwargs):
+    # Каскадное удаление вместе с тикетом или пользователем счётчик не трогает
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is not Message:
+        return
+    # Времена не пересчитываем: удаление сообщений - редкая ручная операция,
+    # точные значения восстановит backfill_ticket_counters
+    Ticket.objects.filter(id=instance.ticket_id, message_count__gt=0).update(
+        message_count=F("message_count") - 1
+    )
+
+
+@receiver(pre_save, sender=Message, dispatch_uid="tickets.message_image_previous")
+def remember_previous_image(sender, instance: Message, raw: bool = False, update_fields=None, **kwargs):
+    if raw or instance.pk is None or (update_fields is not None and "image" not in update_fields):
+        return
+    instance._previous_image = Message.objects.filter(pk=instance.pk).values_list("image", flat=True).first()
+
+
+@receiver(post_save, sender=Message, dispatch_uid="tickets.message_image_references")
+def count_image_references(sender, instance: Message, created: bool, raw: bool = False, **kwargs):
+    if raw:
+        return
+    current = instance.image.name if instance.image else None
+    previous = None if created else getattr(instance, "_previous_image", current) or None
+    if current != previous:
+        adjust_references(current, 1)
+        adjust_references(previous, -1)
+    instance._previous_image = current
+
+
+@receiver(post_delete, sender=Message, dispatch_uid="tickets.message_image_release")
+def release_image_reference(sender, instance: Message, **kwargs):
+    # При архивации тикетов (media_store.retain_references) ссылка остаётся за архивом
+    if instance.image:
+        adjust_references(instance.image.name, -1)
+
+
+@receiver(post_save, sender=TelegramMedia, dispatch_uid="tickets.telegram_media_references")
+def count_telegram_media_reference(sender, instance: TelegramMedia, created: bool, raw: bool = False, **kwargs):
+    if created and not raw and instance.file:
+        adjust_references(instance.file.name, 1)
+
+
+@receiver(post_delete, sender=TelegramMedia, dispatch_uid="tickets.telegram_media_release")
+def release_telegram_media_reference(sender, instance: TelegramMedia, **kwargs):
+    if instance.file:
+        adjust_references(instance.file.name, -1)
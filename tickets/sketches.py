@@ -0,0 +1,181 @@
+"""
+DDSketch - квантильный скетч с гарантированной относительной точностью
+
+Значение x > 0 попадает в корзину ceil(log_gamma(x)), gamma = (1 + a) / (1 - a):
+любой квантиль возвращается с относительной ошибкой не больше a (по умолчанию
+1%). Скетчи одной точности складываются (merge) без потери точности, поэтому
+скетчи часовых корзин собираются в сутки и в произвольный период. Число корзин
+ограничено MAX_BINS: при переполнении сливаются самые нижние (точность
+сохраняется для верхних квантилей - p90/p99 важнее для SLA). Для секунд от 1 мс
+до года при a = 1% хватает ~1200 корзин, т.е. память не зависит от числа значений.
+
+Сериализация компактная: заголовок и пары (дельта индекса, число) в varint.
+"""
+import math
+import struct
+from typing import Dict, Iterable, Optional
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+MAX_BINS = 2048
+# Значения меньше этого (секунды) считаются нулём
+MIN_INDEXABLE = 1e-3
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<BdQdd")
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+
+def _unzigzag(value: int) -> int:
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+
+class DDSketch:
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, weight: int = 1) -> None:
+        if value < 0:
+            raise ValueError("DDSketch принимает только неотрицательные значения")
+        if value < MIN_INDEXABLE:
+            self.zero_count += weight
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            if len(self.bins) > MAX_BINS:
+                self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self) -> None:
+        indexes = sorted(self.bins)
+        excess = len(indexes) - MAX_BINS
+        target = indexes[excess]
+        self.bins[target] += sum(self.bins.pop(index) for index in indexes[:excess])
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.count == 0:
+            return
+        if abs(other.gamma - self.gamma) > 1e-12:
+            raise ValueError("Нельзя объединить скетчи с разной точностью")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > MAX_BINS:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Значение квантиля q (0..1) или None для пустого скетча"""
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                # Середина корзины (gamma^(i-1), gamma^i] в смысле относительной ошибки
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def to_bytes(self) -> bytes:
+        out = bytearray(_HEADER.pack(
+            FORMAT_VERSION,
+            self.relative_accuracy,
+            self.zero_count,
+            self.sum,
+            self.min if self.count else 0.0,
+        ))
+        out += struct.pack("<d", self.max if self.count else 0.0)
+        _write_varint(out, len(self.bins))
+        previous = 0
+        for index in sorted(self.bins):
+            _write_varint(out, _zigzag(index - previous))
+            _write_varint(out, self.bins[index])
+            previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "DDSketch":
+        """Пустой скетч для пустых данных (строки агрегатов без значений)"""
+        if not data:
+            return cls()
+        data = bytes(data)
+        version, accuracy, zero_count, total, minimum = _HEADER.unpack_from(data, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Неизвестная версия скетча: {version}")
+        pos = _HEADER.size
+        (maximum,) = struct.unpack_from("<d", data, pos)
+        pos += 8
+        sketch = cls(accuracy)
+        bins, pos = _read_varint(data, pos)
+        index = 0
+        for _ in range(bins):
+            delta, pos = _read_varint(data, pos)
+            count, pos = _read_varint(data, pos)
+            index += _unzigzag(delta)
+            sketch.bins[index] = count
+        sketch.zero_count = zero_count
+        sketch.count = zero_count + sum(sketch.bins.values())
+        sketch.sum = total
+        if sketch.count:
+            sketch.min, sketch.max = minimum, maximum
+        return sketch
+
+
+def merge_serialized(blobs: Iterable[Optional[bytes]]) -> DDSketch:
+    """Объединение сериализованных скетчей (строки агрегатов за период)"""
+    merged = DDSketch()
+    for blob in blobs:
+        if blob:
+            merged.merge(DDSketch.from_bytes(blob))
+    return merged
+
+
+def percentiles(sketch: DDSketch, quantiles=(0.5, 0.9, 0.99)) -> Dict[str, Optional[float]]:
+    """{"p50": ..., "p90": ..., "p99": ...} в единицах значений скетча"""
+    return {f"p{round(q * 100)}": sketch.quantile(q) for q in quantiles}
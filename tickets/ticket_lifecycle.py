@@ -0,0 +1,130 @@
+"""
+Переходы состояний тикета, безопасные при параллельной обработке
+
+У пользователя не больше одного открытого тикета в канале без цепочек
+(Telegram, WhatsApp, API): это гарантирует частичный уникальный индекс
+unique_open_ticket_per_channel. При гонке INSERT проигравшего падает с
+IntegrityError, и он продолжает работу с тикетом победителя. На PostgreSQL
+создание в таком канале сначала блокирует строку автора (SELECT ... FOR UPDATE):
+параллельные обработчики одного клиента ждут друг друга и находят уже созданный
+тикет без неудачного INSERT; SQLite блокировку строк не поддерживает, и там
+работает только уникальный индекс. Эскалация,
+взятие в работу и переоткрытие - условные UPDATE ... WHERE: переход выполняет
+ровно один из параллельных запросов, без блокировок на уровне приложения.
+"""
+import logging
+from typing import Any, Optional, Tuple
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .metrics import get_metrics
+from .models import Notification, Ticket
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("tickets")
+
+
+def find_open_ticket(user: Any, channel: str) -> Optional[Ticket]:
+    return (
+        Ticket.objects.filter(author=user, channel=channel, status__in=Ticket.OPEN_STATUSES)
+        .order_by("-id")
+        .first()
+    )
+
+
+def create_ticket(user: Any, channel: str, **fields) -> Tuple[Ticket, bool]:
+    """
+    Создаёт тикет; в каналах с одним открытым тикетом при гонке возвращает
+    тикет, созданный параллельным обработчиком. Возвращает (тикет, создан ли).
+    """
+    try:
+        with transaction.atomic():
+            if channel in Ticket.SINGLE_OPEN_CHANNELS and connection.features.has_select_for_update:
+                list(type(user).objects.select_for_update().filter(pk=user.pk).values_list("pk", flat=True))
+                existing = find_open_ticket(user, channel)
+                if existing is not None:
+                    metrics.incr("create_conflicts", channel=channel)
+                    return existing, False
+            return Ticket.objects.create(author=user, channel=channel, **fields), True
+    except IntegrityError:
+        if channel not in Ticket.SINGLE_OPEN_CHANNELS:
+            raise
+        existing = find_open_ticket(user, channel)
+        if existing is None:
+            raise
+        metrics.incr("create_conflicts", channel=channel)
+        return existing, False
+
+
+def escalate(ticket: Ticket, operator: Any = None, notification_text: str = "") -> bool:
+    """
+    Переводит тикет на оператора ровно один раз: повторная или параллельная
+    эскалация не меняет тикет и не создаёт второе уведомление.
+    """
+    now = timezone.now()
+    fields = {
+        "status": Ticket.STATUS_IN_PROGRESS,
+        "is_auto_solved": False,
+        "escalated_at": now,
+        "updated_at": now,
+    }
+    if operator is not None:
+        fields["assigned_operator"] = operator
+
+    with transaction.atomic():
+        if not Ticket.objects.filter(id=ticket.id, escalated_at__isnull=True).update(**fields):
+            metrics.incr("escalation_conflicts")
+            return False
+        if operator is not None and notification_text:
+            Notification.objects.create(operator=operator, ticket=ticket, message=notification_text)
+
+    for name, value in fields.items():
+        setattr(ticket, name, value)
+    metrics.incr("escalations", channel=ticket.channel)
+    return True
+
+
+def mark_auto_solved(ticket: Ticket) -> bool:
+    """Отмечает тикет решённым AI, если его не успели эскалировать"""
+    updated = Ticket.objects.filter(id=ticket.id, escalated_at__isnull=True).update(
+        is_auto_solved=True,
+        updated_at=timezone.now(),
+    )
+    if updated:
+        ticket.is_auto_solved = True
+    return bool(updated)
+
+
+def start_progress(ticket: Ticket, auto_solved: Optional[bool] = None) -> bool:
+    """new -> in_progress; тикет, уже взятый в работу или закрытый, не трогаем"""
+    fields = {"status": Ticket.STATUS_IN_PROGRESS, "updated_at": timezone.now()}
+    if auto_solved is not None:
+        fields["is_auto_solved"] = auto_solved
+    updated = Ticket.objects.filter(id=ticket.id, status=Ticket.STATUS_NEW).update(**fields)
+    if updated:
+        for name, value in fields.items():
+            setattr(ticket, name, value)
+    return bool(updated)
+
+
+def reopen(ticket: Ticket) -> bool:
+    """
+    closed -> new (ответ в цепочку закрытого тикета). В канале с одним открытым
+    тикетом переоткрыть нельзя, если у пользователя уже есть другой открытый.
+    """
+    try:
+        with transaction.atomic():
+            updated = Ticket.objects.filter(id=ticket.id, status=Ticket.STATUS_CLOSED).update(
+                status=Ticket.STATUS_NEW,
+                closed_at=None,
+                updated_at=timezone.now(),
+            )
+    except IntegrityError:
+        metrics.incr("reopen_conflicts", channel=ticket.channel)
+        return False
+    if updated:
+        ticket.status = Ticket.STATUS_NEW
+        ticket.closed_at = None
+    return bool(updated)
@@ -5,6 +5,7 @@ from . import views_chat as chat_views
 from . import views_operator as op_views
 from . import views_api as api_views
 from .integrations.telegram_integration import telegram_webhook
+from .integrations.whatsapp_integration import whatsapp_webhook
 
 app_name = "tickets"
 
@@ -14,12 +15,16 @@ urlpatterns = [
     path("api/chat/rate/", views.rate_message, name="rate_message"),
     # External API endpoints
     path("api/external/message/", api_views.external_api_endpoint, name="external_api"),
+    path("api/external/events/<int:event_id>/", api_views.external_api_event, name="external_api_event"),
     path("api/status/", api_views.api_status, name="api_status"),
     # Telegram webhook
     path("api/telegram/webhook/", telegram_webhook, name="telegram_webhook"),
+    path("api/whatsapp/webhook/", whatsapp_webhook, name="whatsapp_webhook"),
     path("operator/", op_views.operator_ticket_list, name="operator_ticket_list"),
     path("operator/<int:pk>/", op_views.operator_ticket_detail, name="operator_ticket_detail"),
     path("dashboard/", op_views.manager_dashboard, name="dashboard"),
+    path("api/dashboard/percentiles/", op_views.dashboard_percentiles_api, name="dashboard_percentiles"),
+    path("api/export/", op_views.export_tickets_api, name="export_tickets"),
     # Chat endpoints для операторов
     path("api/operator/chat/<int:ticket_id>/join/", chat_views.operator_join_chat, name="operator_join_chat"),
     path("api/operator/chat/<int:ticket_id>/send/", chat_views.operator_send_message, name="operator_send_message"),
@@ -9,6 +9,7 @@ from django.db import models
 from .models import Ticket, Message, Notification, Channel
 from core.utils import AIService
 from .channel_handler import ChannelHandler
+from . import archive, ticket_lifecycle
 from django.views.decorators.http import require_POST
 
 from core.models import User
@@ -121,35 +122,22 @@ def chat_api(request: HttpRequest) -> JsonResponse:
     
     if needs_escalation and not ticket.escalated_at:
         # Эскалация: назначаем оператора и создаём уведомление
-        ticket.status = Ticket.STATUS_IN_PROGRESS
-        ticket.is_auto_solved = False
-        ticket.escalated_at = timezone.now()
-        
         # Находим доступного оператора (с ролью operator или staff)
         available_operator = User.objects.filter(
             models.Q(role=User.ROLE_OPERATOR) | models.Q(is_staff=True)
         ).first()
         
-        if available_operator:
-            ticket.assigned_operator = available_operator
-            
-            # Создаём уведомление для оператора
-            language = getattr(request.user, "language", "ru") or "ru"
-            if language == "kk":
-                notification_text = f"Жаңа эскалация: {ticket.subject[:50]}"
-            else:
-                notification_text = f"Новая эскалация: {ticket.subject[:50]}"
-            
-            Notification.objects.create(
-                operator=available_operator,
-                ticket=ticket,
-                message=notification_text,
-            )
+        # Текст уведомления для оператора
+        language = getattr(request.user, "language", "ru") or "ru"
+        if language == "kk":
+            notification_text = f"Жаңа эскалация: {ticket.subject[:50]}"
+        else:
+            notification_text = f"Новая эскалация: {ticket.subject[:50]}"
         
-        ticket.save(update_fields=["status", "is_auto_solved", "escalated_at", "assigned_operator"])
+        # Условный UPDATE: при параллельных запросах эскалирует и уведомляет только один
+        ticket_lifecycle.escalate(ticket, available_operator, notification_text)
     elif not needs_escalation:
-        ticket.is_auto_solved = True
-        ticket.save(update_fields=["is_auto_solved"])
+        ticket_lifecycle.mark_auto_solved(ticket)
 
     return JsonResponse({
         "reply": bot_message.text,
@@ -167,11 +155,16 @@ def chat_history(request: HttpRequest) -> JsonResponse:
     
     try:
         ticket = Ticket.objects.get(id=ticket_id, author=request.user)
+        history = ticket.messages.order_by("created_at")
     except Ticket.DoesNotExist:
-        return JsonResponse({"messages": []})
+        # Старый закрытый тикет мог уйти в архив (tickets.archive)
+        ticket = archive.load_ticket(ticket_id, author_id=request.user.id)
+        if ticket is None:
+            return JsonResponse({"messages": []})
+        history = ticket.archived_messages
     
     messages = []
-    for msg in ticket.messages.order_by("created_at"):
+    for msg in history:
         messages.append({
             "id": msg.id,
             "text": msg.text,
@@ -4,10 +4,12 @@ API endpoints для внешних систем
 import json
 import base64
 from django.http import JsonResponse, HttpRequest
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from . import inbound_bus
 from .channel_handler import ChannelHandler
-from .models import Channel
+from .models import Channel, DeadLetterEvent, InboundEvent
 import logging
 
 logger = logging.getLogger(__name__)
@@ -32,7 +34,9 @@ def external_api_endpoint(request: HttpRequest) -> JsonResponse:
             "full_name": "Иванов Иван",
             "email": "user@example.com",
             "phone": "+77001234567"
-        }
+        },
+        "async": false,  // Опционально: поставить в очередь и сразу вернуть 202
+        "idempotency_key": "..."  // Опционально: защита от повторной отправки (для async)
     }
     
     Response:
@@ -42,6 +46,13 @@ def external_api_endpoint(request: HttpRequest) -> JsonResponse:
         "reply": "Ответ AI ассистента",
         "needs_escalation": false
     }
+    
+    Response (async, 202):
+    {
+        "success": true,
+        "event_id": 456,
+        "status_url": "/tickets/api/external/events/456/"
+    }
     """
     try:
         data = json.loads(request.body)
@@ -67,6 +78,31 @@ def external_api_endpoint(request: HttpRequest) -> JsonResponse:
                 "error": "user_identifier and text are required"
             }, status=400)
         
+        # Асинхронный режим: событие обработает потребитель очереди входящих
+        if data.get('async'):
+            idempotency_key = data.get('idempotency_key')
+            event, _created = inbound_bus.publish(
+                Channel.CHANNEL_API,
+                user_identifier,
+                {
+                    "text": text,
+                    "image_base64": data.get('image_base64'),
+                    "external_id": data.get('external_id'),
+                    "metadata": data.get('metadata', {}),
+                },
+                idempotency_key=f"api:{idempotency_key}" if idempotency_key else None,
+            )
+            if event is None:
+                return JsonResponse({
+                    "success": False,
+                    "error": "Message rejected by spam filter"
+                }, status=422)
+            return JsonResponse({
+                "success": True,
+                "event_id": event.id,
+                "status_url": reverse("tickets:external_api_event", args=[event.id]),
+            }, status=202)
+        
         # Декодируем изображение если есть
         image_data = None
         if 'image_base64' in data:
@@ -106,6 +142,35 @@ def external_api_endpoint(request: HttpRequest) -> JsonResponse:
         }, status=500)
 
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def external_api_event(request: HttpRequest, event_id: int) -> JsonResponse:
+    """
+    Статус сообщения, отправленного в асинхронном режиме
+    URL: /tickets/api/external/events/<event_id>/?api_key=...
+    """
+    from django.conf import settings
+    valid_api_key = getattr(settings, 'EXTERNAL_API_KEY', 'demo-api-key-change-in-production')
+    if request.GET.get('api_key') != valid_api_key:
+        return JsonResponse({"success": False, "error": "Invalid API key"}, status=401)
+    
+    event = InboundEvent.objects.filter(id=event_id, channel=Channel.CHANNEL_API).first()
+    if event is None:
+        if DeadLetterEvent.objects.filter(original_id=event_id, channel=Channel.CHANNEL_API).exists():
+            return JsonResponse({"success": False, "status": "failed"})
+        return JsonResponse({"success": False, "error": "Event not found"}, status=404)
+    
+    response = {"success": True, "event_id": event.id, "status": event.status}
+    if event.status == InboundEvent.STATUS_DONE and event.result:
+        response.update({
+            "ticket_id": event.result['ticket_id'],
+            "reply": event.result['reply'],
+            "needs_escalation": event.result['needs_escalation'],
+            "ticket_status": event.result['status'],
+        })
+    return JsonResponse(response)
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def api_status(request: HttpRequest) -> JsonResponse:
@@ -120,6 +185,7 @@ def api_status(request: HttpRequest) -> JsonResponse:
             "web": True,
             "email": True,
             "telegram": True,
+            "whatsapp": True,
             "api": True,
         }
     })
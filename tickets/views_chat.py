@@ -5,12 +5,14 @@ from typing import Dict, List
 
 from django.contrib.auth.decorators import login_required
 from django.db import models
-from django.http import HttpRequest, JsonResponse
-from django.shortcuts import get_object_or_404, render
+from django.http import Http404, HttpRequest, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
 from django.views.decorators.http import require_POST
 
-from .models import Message, Notification, Ticket
+from .models import Message, Notification, OutboundMessage, Ticket
+from . import archive, ticket_lifecycle
+from .outbound_dispatcher import enqueue_outbound
 
 
 @login_required
@@ -62,10 +64,11 @@ def operator_send_message(request: HttpRequest, ticket_id: int) -> JsonResponse:
         sender=request.user,
     )
     
-    # Обновляем статус тикета
-    if ticket.status == Ticket.STATUS_NEW:
-        ticket.status = Ticket.STATUS_IN_PROGRESS
-        ticket.save(update_fields=["status"])
+    # Обновляем статус тикета (условным UPDATE, чтобы не затереть параллельное закрытие)
+    ticket_lifecycle.start_progress(ticket)
+    
+    # Клиенту из Telegram/email ответ доставляется в его канал асинхронно
+    delivery = enqueue_outbound(ticket, text, message)
     
     return JsonResponse({
         "success": True,
@@ -74,6 +77,7 @@ def operator_send_message(request: HttpRequest, ticket_id: int) -> JsonResponse:
             "text": message.text,
             "created_at": message.created_at.isoformat(),
             "sender": request.user.username,
+            "delivery_status": delivery.status if delivery else None,
         }
     })
 
@@ -81,7 +85,12 @@ def operator_send_message(request: HttpRequest, ticket_id: int) -> JsonResponse:
 @login_required
 def operator_chat_view(request: HttpRequest, ticket_id: int):
     """Страница чата оператора с пользователем"""
-    ticket = get_object_or_404(Ticket, id=ticket_id)
+    ticket = Ticket.objects.filter(id=ticket_id).first()
+    if ticket is None:
+        # В архивный тикет писать нельзя - показываем его историю только для чтения
+        if ticket_id in archive.get_reader():
+            return redirect("tickets:operator_ticket_detail", pk=ticket_id)
+        raise Http404("Ticket not found")
     
     # Проверяем, что пользователь - оператор или админ
     if not (request.user.is_staff or request.user.role == 'operator'):
@@ -106,16 +115,34 @@ def operator_chat_view(request: HttpRequest, ticket_id: int):
 @login_required
 def get_chat_messages(request: HttpRequest, ticket_id: int) -> JsonResponse:
     """API для получения сообщений чата (для обновления в реальном времени)"""
-    ticket = get_object_or_404(Ticket, id=ticket_id)
+    # Закрытый давно тикет мог уйти в архив (tickets.archive) - читаем его оттуда
+    ticket = Ticket.objects.filter(id=ticket_id).first() or archive.load_ticket(ticket_id)
+    if ticket is None:
+        raise Http404("Ticket not found")
     
     # Проверяем доступ: либо автор тикета, либо оператор/админ
-    is_author = ticket.author == request.user
+    is_author = ticket.author_id == request.user.id
     is_operator = request.user.is_staff or request.user.role == 'operator'
     
     if not (is_author or is_operator):
         return JsonResponse({"error": "Access denied"}, status=403)
     
-    messages = ticket.messages.select_related('sender').order_by('created_at')
+    if getattr(ticket, "is_archived", False):
+        messages = ticket.archived_messages
+        delivery_statuses = {
+            row["message_id"]: row["status"]
+            for row in ticket.archived_record["outbound_messages"]
+            if row["message_id"] is not None
+        }
+    else:
+        messages = ticket.messages.select_related('sender').order_by('created_at')
+        
+        # Статус доставки в канал клиента (последняя попытка по каждому сообщению)
+        delivery_statuses = dict(
+            OutboundMessage.objects.filter(ticket=ticket, message__isnull=False)
+            .order_by('id')
+            .values_list('message_id', 'status')
+        )
     
     messages_data = []
     for msg in messages:
@@ -131,6 +158,7 @@ def get_chat_messages(request: HttpRequest, ticket_id: int) -> JsonResponse:
             "is_bot": msg.is_bot,
             "sender": sender_name,
             "created_at": msg.created_at.isoformat(),
+            "delivery_status": delivery_statuses.get(msg.id),
         })
     
     return JsonResponse({
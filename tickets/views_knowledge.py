@@ -9,10 +9,13 @@ from django.utils import timezone
 from django.db.models import Q
 import json
 
+from core.db_router import read_replica
+
 from .models import KnowledgeArticle, Ticket
 from .knowledge_service import KnowledgeBaseService
 
 
+@read_replica
 def knowledge_base_list(request: HttpRequest):
     """Список всех статей базы знаний"""
     query = request.GET.get("q", "")
@@ -50,6 +53,7 @@ def knowledge_base_list(request: HttpRequest):
     return render(request, "knowledge/list.html", context)
 
 
+@read_replica
 def knowledge_article_detail(request: HttpRequest, slug: str):
     """Просмотр статьи"""
     article = get_object_or_404(KnowledgeArticle, slug=slug, status=KnowledgeArticle.STATUS_PUBLISHED)
@@ -92,6 +96,7 @@ def rate_article(request: HttpRequest, article_id: int):
 
 
 @login_required
+@read_replica
 def knowledge_search_api(request: HttpRequest):
     """API для поиска статей (для автокомплита)"""
     query = request.GET.get("q", "")
@@ -174,6 +179,7 @@ def edit_article(request: HttpRequest, article_id: int):
 
 
 @login_required
+@read_replica
 def suggest_articles_for_ticket(request: HttpRequest, ticket_id: int):
     """API: предлагает статьи для тикета"""
     ticket = get_object_or_404(Ticket, id=ticket_id)
@@ -1,15 +1,18 @@
 from __future__ import annotations
 
-from datetime import timedelta
+from datetime import date, datetime, timedelta
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.db.models import Avg, Count, Min, Q
-from django.http import HttpRequest, HttpResponse
-from django.shortcuts import get_object_or_404, redirect, render
+from django.core.paginator import Paginator
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
 from django.utils import timezone
 
+from core.db_router import read_replica
 from core.utils import AIService
 
+from . import archive, export, rollups
 from .models import Ticket
 
 
@@ -32,71 +35,148 @@ operator_required = user_passes_test(_is_operator)
 @operator_required
 def operator_ticket_list(request: HttpRequest) -> HttpResponse:
     tickets = (
-        Ticket.objects.filter(is_auto_solved=False)
-        .filter(Q(status=Ticket.STATUS_NEW) | Q(status=Ticket.STATUS_IN_PROGRESS))
+        # Частичный индекс ticket_operator_queue (-created_at WHERE NOT is_auto_solved) отдаёт
+        # строки уже в порядке сортировки; статус проверяется по ним, и LIMIT страницы
+        # останавливает чтение индекса - без LIMIT читалась бы вся очередь
+        Ticket.objects.filter(is_auto_solved=False, status__in=Ticket.OPEN_STATUSES)
         .select_related("author")
         .order_by("-created_at")
     )
-    return render(request, "tickets/operator_ticket_list.html", {"tickets": tickets})
+    page = Paginator(tickets, getattr(settings, "OPERATOR_TICKETS_PER_PAGE", 50)).get_page(request.GET.get("page"))
+    return render(request, "tickets/operator_ticket_list.html", {"tickets": page, "page_obj": page})
 
 
 @login_required
 @operator_required
 def operator_ticket_detail(request: HttpRequest, pk: int) -> HttpResponse:
-    ticket = get_object_or_404(Ticket.objects.select_related("author"), pk=pk)
+    ticket = Ticket.objects.select_related("author").filter(pk=pk).first() or archive.load_ticket(pk)
+    if ticket is None:
+        raise Http404("Ticket not found")
+    is_archived = getattr(ticket, "is_archived", False)
+    ticket_messages = ticket.archived_messages if is_archived else ticket.messages.all()
+    context = {"ticket": ticket, "ticket_messages": ticket_messages, "is_archived": is_archived}
 
     if request.method == "POST" and "generate_ai_reply" in request.POST:
         history = [
             {"text": m.text, "is_bot": m.is_bot}
-            for m in ticket.messages.order_by("created_at")
+            for m in sorted(ticket_messages, key=lambda m: m.created_at)
         ]
         user_input = request.POST.get("operator_note", "")
         language = getattr(request.user, "language", "ru") or "ru"
-        ai_suggestion = AIService.generate_response(history=history, user_input=user_input, language=language)
-        return render(
-            request,
-            "tickets/operator_ticket_detail.html",
-            {"ticket": ticket, "ai_suggestion": ai_suggestion},
+        context["ai_suggestion"] = AIService.generate_response(
+            history=history, user_input=user_input, language=language
         )
 
-    return render(request, "tickets/operator_ticket_detail.html", {"ticket": ticket})
+    return render(request, "tickets/operator_ticket_detail.html", context)
+
+
+def _parse_date(value: str):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
 
 
 @login_required
 @operator_required
+@read_replica
 def manager_dashboard(request: HttpRequest) -> HttpResponse:
-    total_tickets = Ticket.objects.count()
-    by_category = (
-        Ticket.objects.values("category")
-        .annotate(count=Count("id"))
-        .order_by("category")
-    )
-    auto_solved = Ticket.objects.filter(is_auto_solved=True).count()
-    auto_solved_percent = (auto_solved / total_tickets * 100) if total_tickets else 0
-
-    from .models import Message
-
-    first_bot_times = (
-        Message.objects.filter(is_bot=True)
-        .values("ticket_id")
-        .annotate(first_bot=Min("created_at"))
-    )
-    diffs = []
-    for row in first_bot_times:
-        try:
-            t = Ticket.objects.get(id=row["ticket_id"])
-            diffs.append(row["first_bot"] - t.created_at)
-        except Ticket.DoesNotExist:
-            continue
-    if diffs:
-        avg_seconds = sum((d.total_seconds() for d in diffs)) / len(diffs)
-    else:
-        avg_seconds = 0
+    # Только агрегаты TicketRollup (tickets.rollups): время ответа не зависит от числа тикетов
+    date_from = _parse_date(request.GET.get("from", ""))
+    date_to = _parse_date(request.GET.get("to", ""))
+    summary = rollups.summary(date_from, date_to)
 
     context = {
-        "total_tickets": total_tickets,
-        "auto_solved_percent": round(auto_solved_percent, 1),
-        "by_category": list(by_category),
-        "avg_response_time_seconds": int(avg_seconds),
+        "total_tickets": summary["totals"]["ticket_count"],
+        "auto_solved_percent": round(summary["auto_solved_percent"], 1),
+        "by_category": summary["by_category"],
+        "by_channel": summary["by_channel"],
+        "avg_response_time_seconds": int(summary["avg_bot_reply_seconds"]),
+        "avg_operator_response_seconds": int(summary["avg_operator_reply_seconds"]),
+        "rating_percent": round(summary["rating_percent"]) if summary["rating_percent"] is not None else None,
+        "latency": summary["latency"],
+        "date_from": date_from,
+        "date_to": date_to,
+        "rollups_updated_at": rollups.freshness(),
     }
     return render(request, "tickets/dashboard.html", context)
+
+
+def _parse_datetime(value: str):
+    # Дата без времени - начало местных суток
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+@login_required
+@operator_required
+@read_replica
+def dashboard_percentiles_api(request: HttpRequest) -> JsonResponse:
+    """
+    p50/p90/p99 времени первого ответа бота, оператора и решения (секунды)
+
+    GET-параметры: from, to, granularity (day - суточные агрегаты, from/to - даты
+    включительно; hour - часовые, from/to - дата и время, to не включается),
+    category, channel, department, priority.
+    """
+    dimensions = {name: request.GET.get(name, "") for name in rollups.DIMENSIONS}
+    granularity = request.GET.get("granularity", "day")
+
+    if granularity == "hour":
+        start = _parse_datetime(request.GET.get("from", ""))
+        end = _parse_datetime(request.GET.get("to", "")) or timezone.now()
+        if start is None:
+            return JsonResponse({"error": "Для granularity=hour параметр from обязателен"}, status=400)
+        rows = rollups.hourly_rows(start, end, **dimensions)
+        period = {"from": start.isoformat(), "to": end.isoformat()}
+    elif granularity == "day":
+        date_from = _parse_date(request.GET.get("from", ""))
+        date_to = _parse_date(request.GET.get("to", ""))
+        rows = rollups.daily_rows(date_from, date_to, **dimensions)
+        period = {
+            "from": date_from.isoformat() if date_from else None,
+            "to": date_to.isoformat() if date_to else None,
+        }
+    else:
+        return JsonResponse({"error": "granularity: day или hour"}, status=400)
+
+    updated_at = rollups.freshness()
+    return JsonResponse({
+        "granularity": granularity,
+        "period": period,
+        "filters": {name: value for name, value in dimensions.items() if value},
+        "latency": rollups.latency_percentiles(rows),
+        "rollups_updated_at": updated_at.isoformat() if updated_at else None,
+    })
+
+
+@login_required
+@operator_required
+def export_tickets_api(request: HttpRequest) -> HttpResponse:
+    """
+    Потоковая выгрузка тикетов с сообщениями (tickets.export)
+
+    GET-параметры: format (csv, jsonl, parquet), from, to (даты создания
+    включительно), category, channel, status, archived=1 - вместе с архивом.
+    """
+    fmt = request.GET.get("format", "csv")
+    try:
+        export.check_format(fmt)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    filters = export.Filters(
+        date_from=_parse_date(request.GET.get("from", "")),
+        date_to=_parse_date(request.GET.get("to", "")),
+        category=request.GET.get("category", ""),
+        channel=request.GET.get("channel", ""),
+        status=request.GET.get("status", ""),
+    )
+    response = StreamingHttpResponse(
+        export.export_tickets(fmt, filters, include_archived=request.GET.get("archived") == "1"),
+        content_type=export.FORMATS[fmt][0],
+    )
+    response["Content-Disposition"] = f'attachment; filename="{export.filename(fmt)}"'
+    return response
@@ -0,0 +1,357 @@
+"""
+Супервизор фоновых воркеров (python manage.py run_workers)
+
+В одном дереве процессов запускаются роли:
+
+    telegram - long polling Telegram (TelegramPoller)
+    email    - слушатели почтовых ящиков (MailboxSupervisor)
+    inbound  - потребители очереди входящих (InboundConsumer)
+    outbox   - отправка писем из очереди исходящих (EmailOutboxSender)
+    dispatch - доставка ответов в каналы клиентов (OutboundDispatcher)
+    rollups  - агрегаты дашборда по водяному знаку (RollupRefresher)
+    archive  - перенос старых закрытых тикетов в архив (TicketArchiver)
+
+Для каждой роли задаются число экземпляров и режим (поток или отдельный
+процесс), см. WORKER_ROLES в settings. Упавший экземпляр перезапускается с
+экспоненциальной задержкой. SIGTERM/SIGINT останавливают приём новой работы
+и дают экземплярам доделать текущую (не дольше WORKER_DRAIN_TIMEOUT секунд).
+Состояние периодически пишется в WORKER_STATUS_FILE и, если задан
+WORKER_STATUS_PORT, отдаётся по HTTP.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from . import inbound_bus
+from .archive import TicketArchiver
+from .inbound_consumer import InboundConsumer
+from .integrations.email_integration import EmailIntegration
+from .integrations.email_outbox import EmailOutboxSender
+from .integrations.mailbox_supervisor import MailboxSupervisor, load_mailboxes
+from .integrations.telegram_client import get_telegram_client
+from .integrations.telegram_poller import TelegramPoller
+from .metrics import get_metrics, snapshot_all
+from .models import OutboundEmail, OutboundMessage, WorkerLease
+from .outbound_dispatcher import OutboundDispatcher
+from .rollups import RollupRefresher
+
+logger = logging.getLogger(__name__)
+
+metrics = get_metrics("workers")
+
+MODE_THREAD = "thread"
+MODE_PROCESS = "process"
+
+# Запуск дольше этого времени считается успешным: задержка перезапуска сбрасывается
+STABLE_RUN_SECONDS = 60
+
+
+def _email_configured() -> bool:
+    for mailbox in load_mailboxes():
+        integration = EmailIntegration(mailbox)
+        if integration.email_address and integration.email_password:
+            return True
+    return False
+
+
+class Role:
+    """Описание роли: фабрика экземпляра с методом run(stop_event)"""
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[int], Any],
+        enabled: Callable[[], bool] = lambda: True,
+        singleton: bool = False,
+    ):
+        self.name = name
+        self.factory = factory
+        self.enabled = enabled
+        # Роли с внешним состоянием (offset getUpdates, IMAP-соединения) запускаются в одном экземпляре
+        self.singleton = singleton
+
+
+ROLES: Dict[str, Role] = {
+    # Одна копия на процесс; между узлами роль распределяет аренда (см. leases.py)
+    "telegram": Role(
+        "telegram",
+        lambda index: TelegramPoller(),
+        enabled=lambda: get_telegram_client().is_configured,
+        singleton=True,
+    ),
+    "email": Role("email", lambda index: MailboxSupervisor(), enabled=_email_configured, singleton=True),
+    "inbound": Role("inbound", lambda index: InboundConsumer(name=f"inbound-{index}")),
+    "outbox": Role("outbox", lambda index: EmailOutboxSender()),
+    "dispatch": Role("dispatch", lambda index: OutboundDispatcher()),
+    "rollups": Role("rollups", lambda index: RollupRefresher(), singleton=True),
+    "archive": Role("archive", lambda index: TicketArchiver(), singleton=True),
+}
+
+
+def _process_main(role_name: str, index: int) -> None:
+    """Точка входа дочернего процесса: SIGTERM завершает текущую работу и выходит"""
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    # Ctrl+C получает вся группа процессов; останавливает детей родитель через SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ROLES[role_name].factory(index).run(stop_event)
+
+
+class Worker:
+    """Один экземпляр роли в потоке или процессе с перезапуском после падения"""
+
+    def __init__(self, role: Role, index: int, mode: str, stop_event: threading.Event):
+        self.role = role
+        self.index = index
+        self.mode = mode
+        self.name = f"{role.name}-{index}"
+        self.stop_event = stop_event
+        self.restart_base = getattr(settings, "WORKER_RESTART_BASE", 1)
+        self.restart_max = getattr(settings, "WORKER_RESTART_MAX", 60)
+        self.restarts = 0
+        self.crashes_in_row = 0
+        self.last_error = ""
+        self.started_at: Optional[float] = None
+        self._next_start = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._process: Optional[multiprocessing.Process] = None
+
+    def _backoff(self) -> float:
+        return min(self.restart_base * 2 ** min(self.crashes_in_row - 1, 10), self.restart_max)
+
+    def _record_crash(self, error: str) -> None:
+        if self.started_at and time.monotonic() - self.started_at >= STABLE_RUN_SECONDS:
+            self.crashes_in_row = 0
+        self.crashes_in_row += 1
+        self.restarts += 1
+        self.last_error = error[:500]
+        metrics.incr("crashes", role=self.role.name)
+        logger.error(f"Worker {self.name} crashed ({error}), restart in {self._backoff():.0f}s")
+
+    def start(self) -> None:
+        if self.mode == MODE_PROCESS:
+            self._start_process()
+        else:
+            self._thread = threading.Thread(target=self._thread_main, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _thread_main(self) -> None:
+        while not self.stop_event.is_set():
+            self.started_at = time.monotonic()
+            try:
+                self.role.factory(self.index).run(self.stop_event)
+                if self.stop_event.is_set():
+                    break
+                raise RuntimeError("worker exited unexpectedly")
+            except Exception as e:
+                self._record_crash(str(e) or e.__class__.__name__)
+                self.stop_event.wait(self._backoff())
+            finally:
+                close_old_connections()
+
+    def _start_process(self) -> None:
+        # Дочерний процесс не должен унаследовать открытые соединения с БД
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        self._process = context.Process(target=_process_main, args=(self.role.name, self.index), name=self.name)
+        self._process.start()
+        self.started_at = time.monotonic()
+
+    def supervise(self) -> None:
+        """Перезапускает упавший процесс (потоки перезапускают себя сами)"""
+        if self.mode != MODE_PROCESS or self.stop_event.is_set() or self._process is None:
+            return
+        if self._process.is_alive():
+            return
+        if self._next_start == 0.0:
+            self._record_crash(f"exit code {self._process.exitcode}")
+            self._next_start = time.monotonic() + self._backoff()
+        elif time.monotonic() >= self._next_start:
+            self._next_start = 0.0
+            self._start_process()
+
+    def stop(self) -> None:
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+
+    def join(self, timeout: float) -> bool:
+        """Ждёт завершения; False, если экземпляр не успел остановиться"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        if self._process is not None:
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join(5)
+                return False
+        return True
+
+    def is_alive(self) -> bool:
+        if self._process is not None:
+            return self._process.is_alive()
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "mode": self.mode,
+            "alive": self.is_alive(),
+            "pid": self._process.pid if self._process is not None else os.getpid(),
+            "restarts": self.restarts,
+            "uptime_seconds": int(time.monotonic() - self.started_at) if self.started_at else 0,
+            "last_error": self.last_error,
+        }
+
+
+class WorkerHost:
+    """Запускает роли, следит за экземплярами и пишет статус"""
+
+    def __init__(self, roles: Optional[List[str]] = None, concurrency: Optional[Dict[str, int]] = None):
+        self.config: Dict[str, Dict[str, Any]] = getattr(settings, "WORKER_ROLES", {})
+        self.role_names = roles or [name for name in ROLES if self.config.get(name, {}).get("enabled", True)]
+        self.concurrency = concurrency or {}
+        self.drain_timeout = getattr(settings, "WORKER_DRAIN_TIMEOUT", 60)
+        self.status_interval = getattr(settings, "WORKER_STATUS_INTERVAL", 5)
+        self.status_file = getattr(settings, "WORKER_STATUS_FILE", "")
+        self.status_port = getattr(settings, "WORKER_STATUS_PORT", 0)
+        self.stop_event = threading.Event()
+        self.workers: List[Worker] = []
+        self.started_at = timezone.now()
+        self._status_server: Optional[ThreadingHTTPServer] = None
+
+    def _mode(self, role_name: str) -> str:
+        mode = self.config.get(role_name, {}).get("mode", MODE_THREAD)
+        if mode == MODE_PROCESS and "fork" not in multiprocessing.get_all_start_methods():
+            logger.warning(f"Process mode is not available on this platform, {role_name} runs in threads")
+            return MODE_THREAD
+        return mode
+
+    def start(self) -> None:
+        for role_name in self.role_names:
+            role = ROLES.get(role_name)
+            if role is None:
+                raise ValueError(f"Unknown worker role: {role_name}")
+            if not role.enabled():
+                logger.warning(f"Worker role {role_name} is not configured, skipping")
+                continue
+
+            count = self.concurrency.get(role_name) or self.config.get(role_name, {}).get("concurrency", 1)
+            if role.singleton:
+                count = 1
+            mode = self._mode(role_name)
+            for index in range(count):
+                worker = Worker(role, index, mode, self.stop_event)
+                worker.start()
+                self.workers.append(worker)
+            logger.info(f"Started {count} {role_name} worker(s) in {mode} mode")
+
+        if self.status_port:
+            self._start_status_server()
+
+    def request_stop(self, *args) -> None:
+        if not self.stop_event.is_set():
+            logger.info("Stopping workers, draining current work...")
+            self.stop_event.set()
+
+    def run(self) -> None:
+        """Главный цикл (в главном потоке): сигналы, перезапуск процессов, статус"""
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        self.start()
+        last_status = 0.0
+        while not self.stop_event.is_set():
+            for worker in self.workers:
+                worker.supervise()
+            if time.monotonic() - last_status >= self.status_interval:
+                self.write_status()
+                last_status = time.monotonic()
+            self.stop_event.wait(1)
+
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.stop()
+
+        deadline = time.monotonic() + self.drain_timeout
+        for worker in self.workers:
+            if not worker.join(max(deadline - time.monotonic(), 0.1)):
+                logger.warning(f"Worker {worker.name} did not stop within drain timeout")
+
+        self.write_status()
+        if self._status_server is not None:
+            self._status_server.shutdown()
+        logger.info("All workers stopped")
+
+    def status(self) -> Dict[str, Any]:
+        roles: Dict[str, Any] = {}
+        for worker in self.workers:
+            roles.setdefault(worker.role.name, []).append(worker.status())
+
+        status: Dict[str, Any] = {
+            "pid": os.getpid(),
+            "started_at": self.started_at.isoformat(),
+            "updated_at": timezone.now().isoformat(),
+            "stopping": self.stop_event.is_set(),
+            "roles": roles,
+            # Метрики процессов-детей сюда не попадают: у каждого процесса свой реестр
+            "metrics": snapshot_all(),
+        }
+        try:
+            status["queues"] = {
+                "inbound": inbound_bus.depth(),
+                "outbound_email_pending": OutboundEmail.objects.filter(status=OutboundEmail.STATUS_PENDING).count(),
+                "outbound_pending": OutboundMessage.objects.filter(status=OutboundMessage.STATUS_PENDING).count(),
+            }
+            status["leases"] = list(
+                WorkerLease.objects.values("name", "holder", "fencing_token", "expires_at", "heartbeat_at")
+            )
+        except Exception as e:
+            status["queues"] = {"error": str(e)}
+        finally:
+            close_old_connections()
+        return status
+
+    def write_status(self) -> None:
+        if not self.status_file:
+            return
+        tmp_path = f"{self.status_file}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.status(), f, ensure_ascii=False, indent=2, default=str)
+            os.replace(tmp_path, self.status_file)
+        except OSError as e:
+            logger.warning(f"Failed to write worker status: {e}")
+
+    def _start_status_server(self) -> None:
+        host = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(host.status(), ensure_ascii=False, default=str).encode("utf-8")
+                healthy = all(worker.is_alive() for worker in host.workers)
+                self.send_response(200 if healthy else 503)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._status_server = ThreadingHTTPServer(("127.0.0.1", self.status_port), StatusHandler)
+        threading.Thread(target=self._status_server.serve_forever, name="worker-status", daemon=True).start()
+        logger.info(f"Worker status available at http://127.0.0.1:{self.status_port}/")